@@ -0,0 +1,171 @@
+import os
+import sys
+import gc
+import copy
+import json
+import itertools
+from collections import OrderedDict
+
+import torch
+
+from options.benchmark_options import BenchmarkOptions
+from models.models import create_model
+from benchmark_step import synthetic_batch, synchronize, iterations_per_sec, train_step
+
+# Microbenchmarks of the pix2pix networks over a sweep of configurations
+# (--sweep_netG, --sweep_norm, --sweep_depth, --sweep_fineSize,
+# --sweep_batchSize; every combination is run). For each configuration,
+# on synthetic clips:
+#   G_forward           netG inference (no_grad)
+#   G_forward_backward  netG forward and backward of a dummy loss
+#   D_forward           netD on the real pair (no_grad)
+#   D_forward_backward  netD forward and backward of a dummy loss
+#   step                the full model.optimize_parameters()
+# with iterations/sec, clips/sec and the peak memory allocated above what
+# was held before the call (CUDA allocator on the GPU, profiler memory
+# events on the CPU). Results are written as json; --compare checks them
+# against a stored run and exits with 1 on regressions.
+#
+#   python benchmark.py --name bench --model pix2pix --gpu_ids -1 --norm batch \
+#       --sweep_netG unet_128,unet_128_2plus1d --sweep_depth 8,16 --fineSize 128 --batchSize 1
+
+SWEEPS = [('which_model_netG', 'sweep_netG', str), ('norm', 'sweep_norm', str), ('depth', 'sweep_depth', int),
+          ('fineSize', 'sweep_fineSize', int), ('batchSize', 'sweep_batchSize', int)]
+
+
+def configurations(opt):
+    values = [[cast(v) for v in getattr(opt, sweep).split(',')] if getattr(opt, sweep) else [getattr(opt, key)]
+              for key, sweep, cast in SWEEPS]
+    for combination in itertools.product(*values):
+        config = OrderedDict(zip([key for key, _, _ in SWEEPS], combination))
+        config['precision'] = opt.precision
+        yield config
+
+
+def peak_memory_mb(step, device):
+    if device.type == 'cuda':
+        synchronize(device)
+        torch.cuda.reset_peak_memory_stats()
+        before = torch.cuda.memory_allocated()
+        step()
+        synchronize(device)
+        return (torch.cuda.max_memory_allocated() - before) / 2. ** 20
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True) as prof:
+        step()
+    usage = peak = 0
+    for e in sorted((e for e in prof.events() if e.name == '[memory]'), key=lambda e: e.time_range.start):
+        usage += e.cpu_memory_usage
+        peak = max(peak, usage)
+    return peak / 2. ** 20
+
+
+def network_steps(model):
+    def forward(net, input):
+        def step():
+            with torch.no_grad(), model.autocast():
+                net(input)
+        return step
+
+    def forward_backward(net, input):
+        def step():
+            net.zero_grad(set_to_none=True)
+            with model.autocast():
+                output = net(input)
+            output.float().mean().backward()
+        return step
+
+    return [('G_forward', forward(model.netG, model.input_A)),
+            ('G_forward_backward', forward_backward(model.netG, model.input_A)),
+            ('D_forward', forward(model.netD, model.input_AB)),
+            ('D_forward_backward', forward_backward(model.netD, model.input_AB))]
+
+
+def run(opt, config, device):
+    bench_opt = copy.copy(opt)
+    for key, value in config.items():
+        setattr(bench_opt, key, value)
+    model = create_model(bench_opt)
+    data = synthetic_batch(bench_opt)
+    model.set_input(data)
+    steps = network_steps(model) + [('step', lambda: train_step(model, data))]
+    results = []
+    for metric, step in steps:
+        for _ in range(opt.bench_warmup):
+            step()
+        speed = iterations_per_sec(step, opt.bench_steps, device)
+        results.append(OrderedDict([('config', config), ('metric', metric), ('it_per_s', speed),
+                                    ('clips_per_s', speed * bench_opt.batchSize),
+                                    ('peak_mb', peak_memory_mb(step, device))]))
+        print('%-20s %9.3f it/s %9.3f clips/s %10.1f MB peak' %
+              (metric, speed, speed * bench_opt.batchSize, results[-1]['peak_mb']))
+    return results
+
+
+def result_key(result):
+    return json.dumps(result['config'], sort_keys=True), result['metric']
+
+
+# configurations whose throughput dropped or peak memory grew by more than
+# |tolerance| relative to |baseline|, that fail where the baseline ran, or
+# that the baseline has and the new run does not
+def compare(results, baseline, tolerance):
+    reference = dict((result_key(result), result) for result in baseline)
+    current = dict((result_key(result), result) for result in results)
+    # a configuration that failed as a whole is stored under metric 'all'
+    failed = set(key[0] for key, result in current.items() if 'error' in result)
+    regressions = []
+    for result in results:
+        key = result_key(result)
+        base = reference.get(key)
+        if 'error' in result:
+            if any(k[0] == key[0] and 'error' not in b for k, b in reference.items()):
+                print('%-10s %s failed: %s' % ('REGRESSION', dict(result['config']), result['error']))
+                regressions.append(result)
+            continue
+        if base is None or 'error' in base:
+            continue
+        slower = result['it_per_s'] < base['it_per_s'] * (1 - tolerance)
+        larger = result['peak_mb'] > base['peak_mb'] * (1 + tolerance) + 1
+        status = 'REGRESSION' if slower or larger else 'ok'
+        print('%-10s %s %-20s %8.3f -> %8.3f it/s %9.1f -> %9.1f MB' %
+              (status, dict(result['config']), result['metric'], base['it_per_s'], result['it_per_s'],
+               base['peak_mb'], result['peak_mb']))
+        if slower or larger:
+            regressions.append(result)
+    for key, base in reference.items():
+        if key not in current and key[0] not in failed and 'error' not in base:
+            print('%-10s %s %-20s missing from this run' % ('REGRESSION', dict(base['config']), base['metric']))
+            regressions.append(base)
+    return regressions
+
+if __name__ == '__main__':
+    opt = BenchmarkOptions().parse()
+    assert opt.model == 'pix2pix', 'benchmark.py only supports --model pix2pix'
+    device = torch.device('cuda' if opt.gpu_ids else 'cpu')
+
+    results = []
+    for config in configurations(opt):
+        print('---------- Benchmark: %s -------------' % dict(config))
+        try:
+            results += run(opt, config, device)
+        except RuntimeError as e:
+            # out of memory or an unsupported shape; the sweep goes on
+            print('failed: %s' % e)
+            results.append(OrderedDict([('config', config), ('metric', 'all'), ('error', str(e))]))
+        gc.collect()
+        if device.type == 'cuda':
+            torch.cuda.empty_cache()
+
+    path = opt.bench_results or os.path.join(opt.checkpoints_dir, opt.name, 'benchmark.json')
+    with open(path, 'w') as f:
+        json.dump({'device': torch.cuda.get_device_name() if device.type == 'cuda' else 'cpu',
+                   'torch': torch.__version__, 'threads': torch.get_num_threads(), 'results': results}, f, indent=1)
+    print('results written to %s' % path)
+
+    if opt.compare:
+        with open(opt.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, opt.tolerance)
+        print('%d regressions against %s' % (len(regressions), opt.compare))
+        if regressions:
+            sys.exit(1)
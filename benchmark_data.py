@@ -0,0 +1,220 @@
+import os
+import glob
+import json
+import time
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+import skvideo.io
+import zmq
+
+from options.data_benchmark_options import DataBenchmarkOptions
+from data.img_loder import get_pair, crop_resize, resize_frame, gen_frame
+from data.server import SerializingContext, list_files, setup_server
+
+# Throughput of the training data pipeline, stage by stage, in clips/sec
+# and MB/sec of each stage's output:
+#   decode      png reads (cv2.imread) or video decoding (skvideo)
+#   preprocess  crop/resize and stacking into (2, C, depth, 256, 256) clips
+#   serialize   the C-contiguous copy a producer makes before sending
+#   transport   ZMQ push/pull of ready clips over localhost tcp
+#   assembly    concatenation of batchSize clips by data.server.client
+#   normalize   uint8 to [-1, 1] float A and B of VideoDataset
+# then end to end with 1, 2, 4, ... --max_producers producer processes
+# (data.server.start_server), with the scaling efficiency against one
+# producer and the throughput per core used.
+#
+# --synthetic_dir generates png sequences (or, with --load_video 1, avi
+# videos) of the configured length and resolution to run on.
+#
+#   python benchmark_data.py --name bench_data --synthetic_dir ./synthetic --depth 16 --batchSize 1
+
+
+def synthetic_frames(opt, seed):
+    rng = np.random.RandomState(seed)
+    h, w = opt.synthetic_height, opt.synthetic_width
+    # smooth content that moves, so it compresses like video and not noise
+    base = cv2.resize(rng.randint(0, 256, (max(h // 16, 2), max(w // 16, 2), 3)).astype(np.uint8), (w, h))
+    for t in range(opt.synthetic_frames):
+        noise = rng.randint(-8, 9, (h, w, 3))
+        yield np.clip(np.roll(base, 3 * t, axis=1).astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+# writes the synthetic files and points opt.data_dir at them
+def make_synthetic(opt):
+    root = opt.synthetic_dir
+    for i in range(opt.synthetic_files):
+        if opt.load_video == 1:
+            if not os.path.exists(root):
+                os.makedirs(root)
+            skvideo.io.vwrite(os.path.join(root, 'synthetic_%03d.avi' % i), np.asarray(list(synthetic_frames(opt, i))))
+        else:
+            directory = os.path.join(root, 'scene_%03d' % i, 'clone')
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            for t, frame in enumerate(synthetic_frames(opt, i)):
+                cv2.imwrite(os.path.join(directory, '%06d.png' % t), frame)
+    opt.data_dir = os.path.join(root, '*.avi') if opt.load_video == 1 else os.path.join(root, '*', '*', '')
+    print('wrote %d synthetic %s to %s' % (opt.synthetic_files, 'videos' if opt.load_video == 1 else 'sequences', root))
+
+
+def rate(name, seconds, clips, nbytes):
+    seconds = max(seconds, 1e-9)
+    result = OrderedDict([('stage', name), ('clips_per_s', clips / seconds),
+                          ('mb_per_s', nbytes / 2. ** 20 / seconds), ('mb_per_clip', nbytes / 2. ** 20 / max(clips, 1))])
+    print('%-12s %10.2f clips/s %10.1f MB/s' % (name, result['clips_per_s'], result['mb_per_s']))
+    return result
+
+
+# decoded frames of the first |num_clips| clips, as data.img_loder reads
+# them: lists of A then B frames
+def decode_stage(opt, files, num_clips):
+    decoded = []
+    start = time.time()
+    for path in files:
+        if opt.load_video == 1:
+            frames = [frame for i, frame in enumerate(skvideo.io.vreader(path)) if i % opt.skip == 0]
+            for i in range(len(frames) // (opt.depth * 2)):
+                decoded.append(('video', frames, i))
+        else:
+            A, B = get_pair(sorted(glob.glob(path + '**.png')), opt.depth, opt.skip, opt.depth)
+            for a, b in zip(A, B):
+                decoded.append(('png', [cv2.imread(p) for p in list(a) + list(b)], None))
+                if len(decoded) >= num_clips:
+                    break
+        if len(decoded) >= num_clips:
+            break
+    seconds = time.time() - start
+    decoded = decoded[:num_clips]
+    # a video's frames are shared by its clips
+    frames = dict((id(frames), frames) for kind, frames, i in decoded)
+    nbytes = sum(f.nbytes for frame_list in frames.values() for f in frame_list)
+    return decoded, rate('decode', seconds, len(decoded), nbytes)
+
+
+def preprocess_stage(opt, decoded):
+    clips = []
+    resized = {}
+    start = time.time()
+    for kind, frames, i in decoded:
+        if kind == 'video':
+            if id(frames) not in resized:
+                resized[id(frames)] = [resize_frame(frame) for frame in frames]
+            clips.append(gen_frame(i, frames_lst=resized[id(frames)], length=opt.depth, overlap=opt.overlap))
+        else:
+            frames = [crop_resize(frame) for frame in frames]
+            clips.append(np.transpose(np.asarray([frames[:opt.depth], frames[opt.depth:]]), (0, 4, 1, 2, 3)))
+    return clips, rate('preprocess', time.time() - start, len(clips), sum(c.nbytes for c in clips))
+
+
+def serialize_stage(clips):
+    start = time.time()
+    serialized = [clip.copy(order='C') for clip in clips]
+    return serialized, rate('serialize', time.time() - start, len(serialized), sum(c.nbytes for c in serialized))
+
+
+def transport_stage(clips, port):
+    ctx = SerializingContext()
+    push, pull = ctx.socket(zmq.PUSH), ctx.socket(zmq.PULL)
+    push.set_hwm(20)
+    pull.set_hwm(20)
+    push.bind('tcp://127.0.0.1:%d' % port)
+    pull.connect('tcp://127.0.0.1:%d' % port)
+
+    def send():
+        for i, clip in enumerate(clips):
+            push.send_array_(clip, copy=False, filename={'clip': i})
+    sender = threading.Thread(target=send)
+    start = time.time()
+    sender.start()
+    received = [pull.recv_array_(copy=False)[1] for _ in clips]
+    seconds = time.time() - start
+    sender.join()
+    push.close(linger=0)
+    pull.close(linger=0)
+    return received, rate('transport', seconds, len(received), sum(c.nbytes for c in received))
+
+
+def assembly_stage(clips, batch_size):
+    batches = [clips[i:i + batch_size] for i in range(0, len(clips) - batch_size + 1, batch_size)]
+    start = time.time()
+    assembled = [np.concatenate(batch, axis=0) for batch in batches]
+    return assembled, rate('assembly', time.time() - start, len(batches) * batch_size, sum(b.nbytes for b in assembled))
+
+
+def normalize_stage(batches, batch_size):
+    start = time.time()
+    nbytes = 0
+    for AB in batches:
+        A = AB[::2] / 127.5 - 1.
+        B = AB[1::2] / 127.5 - 1.
+        nbytes += A.nbytes + B.nbytes
+    return rate('normalize', time.time() - start, len(batches) * batch_size, nbytes)
+
+
+# clips/sec delivered by |num_producers| start_server processes
+def producers_stage(opt, files, num_producers, num_clips):
+    ports = range(opt.bench_port, opt.bench_port + num_producers)
+    processes = setup_server(ports, opt, None, files)
+    ctx = SerializingContext()
+    pull = ctx.socket(zmq.PULL)
+    pull.set_hwm(20)
+    for port in ports:
+        pull.connect('tcp://localhost:%d' % port)
+    try:
+        # the first clip of each producer includes its start up
+        for _ in range(num_producers):
+            pull.recv_array_(copy=False)
+        start = time.time()
+        nbytes = sum(pull.recv_array_(copy=False)[1].nbytes for _ in range(num_clips))
+        return rate('%d producers' % num_producers, time.time() - start, num_clips, nbytes)
+    finally:
+        pull.close(linger=0)
+        for process in processes:
+            process.terminate()
+            process.join()
+
+
+if __name__ == '__main__':
+    opt = DataBenchmarkOptions().parse()
+    if opt.synthetic_dir:
+        make_synthetic(opt)
+    files = list_files(opt)
+    assert files, 'no files match %s' % opt.data_dir
+    num_clips = max(opt.bench_clips, opt.batchSize)
+
+    print('---------- Data benchmark: %d files, depth %d, batchSize %d -------------' %
+          (len(files), opt.depth, opt.batchSize))
+    decoded, decode = decode_stage(opt, files, num_clips)
+    clips, preprocess = preprocess_stage(opt, decoded)
+    serialized, serialize = serialize_stage(clips)
+    received, transport = transport_stage(serialized, opt.bench_port)
+    batches, assembly = assembly_stage(received, opt.batchSize)
+    stages = [decode, preprocess, serialize, transport, assembly, normalize_stage(batches, opt.batchSize)]
+    bottleneck = min(stages, key=lambda s: s['clips_per_s'])
+    print('slowest stage: %s (%.2f clips/s on one core)' % (bottleneck['stage'], bottleneck['clips_per_s']))
+
+    cores = os.cpu_count() or 1
+    counts = []
+    n = 1
+    while n < opt.max_producers:
+        counts.append(n)
+        n *= 2
+    counts.append(opt.max_producers)
+    scaling = []
+    for n in counts:
+        result = producers_stage(opt, files, n, num_clips * n)
+        result['producers'] = n
+        result['efficiency'] = result['clips_per_s'] / (n * scaling[0]['clips_per_s']) if scaling else 1.
+        result['clips_per_s_per_core'] = result['clips_per_s'] / min(n, cores)
+        scaling.append(result)
+        print('%12s efficiency %5.1f%%, %.2f clips/s per core' %
+              ('', 100 * result['efficiency'], result['clips_per_s_per_core']))
+
+    path = opt.bench_results or os.path.join(opt.checkpoints_dir, opt.name, 'data_benchmark.json')
+    with open(path, 'w') as f:
+        json.dump({'files': len(files), 'depth': opt.depth, 'batchSize': opt.batchSize, 'cores': cores,
+                   'stages': stages, 'producers': scaling}, f, indent=1)
+    print('results written to %s' % path)
@@ -0,0 +1,105 @@
+import time
+
+import numpy as np
+import torch
+
+from options.benchmark_options import BenchmarkOptions
+from models.models import create_model
+
+# Measures iterations/sec and tensor allocations per training step on
+# synthetic clips, so no producers are needed. With --legacy_step the
+# previous pix2pix step (fresh input tensors, the fake pair concatenated
+# twice, gradients zeroed in place, per-parameter Adam) runs on the same
+# networks for comparison.
+#
+#   python benchmark_step.py --name bench --model pix2pix --which_model_netG unet_128 \
+#       --fineSize 128 --depth 16 --batchSize 1 --norm batch --gpu_ids 0 --legacy_step
+
+
+def synthetic_batch(opt):
+    shape = (opt.batchSize, opt.depth, opt.fineSize, opt.fineSize)
+    return {'A': np.random.uniform(-1, 1, (shape[0], opt.input_nc) + shape[1:]).astype(np.float32),
+            'B': np.random.uniform(-1, 1, (shape[0], opt.output_nc) + shape[1:]).astype(np.float32),
+            'A_paths': 'synthetic', 'B_paths': 'synthetic'}
+
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def iterations_per_sec(step, steps, device):
+    synchronize(device)
+    start = time.time()
+    for _ in range(steps):
+        step()
+    synchronize(device)
+    return steps / (time.time() - start)
+
+
+# device allocations per step from the CUDA caching allocator counters; on
+# the CPU, allocation events recorded by the profiler
+def allocations_per_step(step, steps, device):
+    if device.type == 'cuda':
+        synchronize(device)
+        before = torch.cuda.memory_stats()['allocation.all.allocated']
+        for _ in range(steps):
+            step()
+        synchronize(device)
+        return (torch.cuda.memory_stats()['allocation.all.allocated'] - before) / float(steps)
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True) as prof:
+        for _ in range(steps):
+            step()
+    return sum(1 for e in prof.events() if e.name == '[memory]' and e.cpu_memory_usage > 0) / float(steps)
+
+
+def legacy_step(model, data, optimizer_G, optimizer_D):
+    AtoB = model.opt.which_direction == 'AtoB'
+    device = model.input_AB.device
+    real_A = torch.from_numpy(data['A' if AtoB else 'B']).to(device)
+    real_B = torch.from_numpy(data['B' if AtoB else 'A']).to(device)
+    fake_B = model.netG(real_A)
+
+    optimizer_D.zero_grad(set_to_none=False)
+    pred_fake = model.netD(torch.cat((real_A, fake_B), 1).detach())
+    pred_real = model.netD(torch.cat((real_A, real_B), 1))
+    loss_D = (model.criterionGAN(pred_fake, False) + model.criterionGAN(pred_real, True)) * 0.5
+    loss_D.backward()
+    optimizer_D.step()
+
+    optimizer_G.zero_grad(set_to_none=False)
+    pred_fake = model.netD(torch.cat((real_A, fake_B), 1))
+    loss_G = model.criterionGAN(pred_fake, True) + model.criterionL1(fake_B, real_B) * model.opt.lambda_A
+    loss_G.backward()
+    optimizer_G.step()
+
+
+def train_step(model, data):
+    model.set_input(data)
+    model.optimize_parameters()
+
+
+if __name__ == '__main__':
+    opt = BenchmarkOptions().parse()
+    model = create_model(opt)
+    data = synthetic_batch(opt)
+    device = torch.device('cuda' if opt.gpu_ids else 'cpu')
+
+    steps = [('current', lambda: train_step(model, data))]
+    if opt.legacy_step:
+        assert opt.model == 'pix2pix', '--legacy_step is only implemented for --model pix2pix'
+        optimizer_G = torch.optim.Adam(model.netG.parameters(), lr=opt.lr, betas=(opt.beta1, 0.999), foreach=False)
+        optimizer_D = torch.optim.Adam(model.netD.parameters(), lr=opt.lr, betas=(opt.beta1, 0.999), foreach=False)
+        steps.append(('legacy', lambda: legacy_step(model, data, optimizer_G, optimizer_D)))
+
+    print('---------- Benchmark: %s, input %s -------------' %
+          (opt.model, (opt.batchSize, opt.input_nc, opt.depth, opt.fineSize, opt.fineSize)))
+    for name, step in steps:
+        for _ in range(opt.bench_warmup):
+            step()
+        speed = iterations_per_sec(step, opt.bench_steps, device)
+        allocations = allocations_per_step(step, max(1, opt.bench_steps // 4), device)
+        print('%-8s %8.3f it/s %10.1f allocations/step' % (name, speed, allocations))
+        if device.type == 'cuda':
+            print('%-8s %8.1f MB peak' % ('', torch.cuda.max_memory_allocated() / 2. ** 20))
+            torch.cuda.reset_peak_memory_stats()
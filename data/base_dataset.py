@@ -12,6 +12,24 @@ class BaseDataset(data.Dataset):
     def initialize(self, opt):
         pass
 
+    # position in the data stream, saved with the training state
+    def state_dict(self):
+        return {}
+
+    def load_state_dict(self, state):
+        pass
+
+    # items from index |start| on, for resuming an epoch part way through
+    def iterate(self, start=0):
+        index = start
+        while True:
+            try:
+                item = self[index]
+            except IndexError:
+                return
+            yield item
+            index += 1
+
 def get_transform(opt):
     transform_list = []
     if opt.resize_or_crop == 'resize_and_crop':
@@ -21,12 +21,14 @@ def get_pair(img_lst, pre, skip, length):
 
 
 read_ = lambda x: cv2.resize(cv2.imread(x)[:, int(1242 / 2 - 375 / 2):int(1242 / 2 + 375 / 2), ::-1], (256, 256))
+# the whole frame at its native resolution, BGR to RGB
+read_native = lambda x: cv2.imread(x)[:, :, ::-1]
 
 
-def gen_np(c):
+def gen_np(c, read=read_):
     #     print(c)
-    img1 = [read_(i) for i in c[0]]
-    img2 = [read_(i) for i in c[1]]
+    img1 = [read(i) for i in c[0]]
+    img2 = [read(i) for i in c[1]]
 
     v = np.asarray([img1, img2])
     v = np.transpose(v, (0, 4, 1, 2, 3))
@@ -34,10 +36,10 @@ def gen_np(c):
     return v
 
 
-def dump(img_lst, dirpath = 'data', start = 0, skip = 2, length = 7, pre = 2):
+def dump(img_lst, dirpath = 'data', start = 0, skip = 2, length = 7, pre = 2, read = read_):
     a, b = get_pair(img_lst, pre, skip, length)
     task = [(i, j) for i, j in zip(a, b)]
-    gen = (gen_np(j) for j in task)
+    gen = (gen_np(j, read) for j in task)
     return gen
 
 
@@ -46,10 +48,11 @@ def dump(img_lst, dirpath = 'data', start = 0, skip = 2, length = 7, pre = 2):
 
 
 #         return
-def data_gen(data_path, skip, length, pre):
+def data_gen(data_path, skip, length, pre, resize=True):
     start = 0
     img_lst = glob.glob(data_path + "**.png")
     img_lst.sort()
     # print(img_lst)
-    gen = dump(img_lst, 'video/{}{}'.format(*data_path.split('/')[-3:-1]), start, skip, length, pre)
+    gen = dump(img_lst, 'video/{}{}'.format(*data_path.split('/')[-3:-1]), start, skip, length, pre,
+               read_ if resize else read_native)
     return gen
\ No newline at end of file
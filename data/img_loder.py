@@ -22,13 +22,17 @@ def get_pair(img_lst, pre, skip, length):
     return A, B
 
 
-read_ = lambda x: cv2.resize(cv2.imread(x)[:, int(1242 / 2 - 375 / 2):int(1242 / 2 + 375 / 2), ::-1], (256, 256))
+# centre crop of a (1242 wide) virtual kitti frame, BGR to RGB, 256x256
+crop_resize = lambda img: cv2.resize(img[:, int(1242 / 2 - 375 / 2):int(1242 / 2 + 375 / 2), ::-1], (256, 256))
+read_ = lambda x: crop_resize(cv2.imread(x))
+# the whole frame at its native resolution (--no_resize), BGR to RGB
+read_native = lambda x: cv2.imread(x)[:, :, ::-1]
 
 
-def gen_np(c):
+def gen_np(c, read=read_):
     #     print(c)
-    img1 = [read_(i) for i in c[0]]
-    img2 = [read_(i) for i in c[1]]
+    img1 = [read(i) for i in c[0]]
+    img2 = [read(i) for i in c[1]]
 
     v = np.asarray([img1, img2])
     v = np.transpose(v, (0, 4, 1, 2, 3))
@@ -36,19 +40,21 @@ def gen_np(c):
     return v
 
 
-def dump(img_lst, dirpath = 'data', start = 0, skip = 2, length = 7, pre = 2):
+def dump(img_lst, dirpath = 'data', start = 0, skip = 2, length = 7, pre = 2, read = read_):
     a, b = get_pair(img_lst, pre, skip, length)
     task = [(i, j) for i, j in zip(a, b)]
-    gen = (gen_np(j) for j in task)
+    gen = (gen_np(j, read) for j in task[start:])
     return gen
 
 
-def data_gen(data_path, skip, length, pre):
-    start = 0
+# |start| skips that many clips without reading their frames; with
+# |resize| False the frames keep their native resolution
+def data_gen(data_path, skip, length, pre, start=0, resize=True):
     img_lst = glob.glob(data_path + "**.png")
     img_lst.sort()
     # print(img_lst)
-    gen = dump(img_lst, 'video/{}{}'.format(*data_path.split('/')[-3:-1]), start, skip, length, pre)
+    gen = dump(img_lst, 'video/{}{}'.format(*data_path.split('/')[-3:-1]), start, skip, length, pre,
+               read_ if resize else read_native)
     return data_path, gen
 
 
@@ -65,21 +71,32 @@ def gen_frame(i, frames_lst, length, overlap):
     return v
 
 
-def video_data_gen(vid_path, opt):
-    skip = opt.skip
-    length = opt.depth
-    overlap = opt.overlap
-    #if not os.path.exists(out_path):
-        #os.mkdir(out_path)
-
-    #vid_name = os.path.basename(vid_path).split('.')[0]
-    videogen = skvideo.io.vreader(vid_path)
-
-    frames_lst = [cv2.resize(frame[:, 40:280, :], (256, 256))
-                  for i, frame in enumerate(videogen) if i % skip == 0]
-
-    n = int(len(frames_lst) / (length * 2))
-
-    gen = (gen_frame(i, frames_lst=frames_lst, length=length, overlap=overlap) for i in range(n))
-
-    return vid_path, gen
\ No newline at end of file
+def resize_frame(frame):
+    return cv2.resize(frame[:, 40:280, :], (256, 256))
+
+
+# Clip i holds frames i .. i + 2 * length - overlap of the video subsampled
+# by |skip|, for the first len(frames) // (2 * length) values of i. The
+# video is decoded as the clips are consumed: clip i is ready once
+# 2 * length * (i + 1) frames are read, frames before |start| are decoded
+# but neither resized nor kept, and frames are released once no later clip
+# needs them. With |resize| False the frames keep their native resolution.
+def video_clips(vid_path, skip, length, overlap, start=0, resize=True):
+    frames = []     # frames i onwards
+    count = 0
+    i = start
+    for k, frame in enumerate(skvideo.io.vreader(vid_path)):
+        if k % skip != 0:
+            continue
+        if count >= start:
+            frames.append(resize_frame(frame) if resize else frame)
+        count += 1
+        while count >= length * 2 * (i + 1):
+            yield gen_frame(0, frames_lst=frames, length=length, overlap=overlap)
+            del frames[0]
+            i += 1
+
+
+def video_data_gen(vid_path, opt, start=0):
+    return vid_path, video_clips(vid_path, opt.skip, opt.depth, opt.overlap, start,
+                                 not getattr(opt, 'no_resize', False))
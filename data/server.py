@@ -9,17 +9,17 @@ import zmq
 import random
 import logging
 
-from options.train_options import TrainOptions
 from multiprocessing import Process
 from data.img_loder import data_gen, video_data_gen
 
 logger = logging.getLogger(__name__)
 
-opt = TrainOptions().parse()
+
 ## f_lst = glob.glob(opt.data_dir + 'v_BabyCrawling**.avi')
-f_lst = glob.glob(opt.data_dir)
 ##f_lst = glob.glob('/data/dataset/depthdata/vkitti_1.3.1_rgb/**/**/')
-print("Total videos: {}".format(len(f_lst)))
+# sorted, so the seeded producers draw the same files on every run
+def list_files(opt):
+    return sorted(glob.glob(opt.data_dir))
 
 
 class SerializingSocket(zmq.Socket):
@@ -107,7 +107,18 @@ def test():
     print("Okay" if (C == B).all() else "Failed")
 
 
-def start_server(port , opt ):
+def clip_gen(path, opt, start=0):
+    if opt.load_video == 1:
+        return video_data_gen(path, opt, start)
+    return data_gen(path, skip = opt.skip, length = opt.depth, pre = opt.depth, start = start,
+                    resize = not getattr(opt, 'no_resize', False))
+
+
+# Each producer walks its own sequence of files drawn by an RNG seeded from
+# --seed and its port, so the stream of a port is reproducible. Every clip
+# is sent with its position (file number, clip number) in that sequence;
+# |cursor| restarts the producer at such a position.
+def start_server(port , opt , cursor = None, f_lst = None):
     hwm = 20
     ctx = SerializingContext()
 
@@ -117,38 +128,50 @@ def start_server(port , opt ):
 
     s.bind('tcp://*:{}'.format(port))
 
+    f_lst = f_lst or list_files(opt)
+    rng = random.Random(opt.seed * 100003 + port)
+    file_index, clip_index = cursor or (0, 0)
+    for _ in range(file_index):
+        rng.choice(f_lst)
 
     # fix ndarray not continious bug :  array.copy(order='C')
 
     while 1:
-        if opt.load_video == 1:
-            data_path, gen = video_data_gen(random.choice(f_lst), opt )
-            #print(data_path, gen)
-            try:
-                [s.send_array_(data.copy(order='C'), copy=False, filename=data_path) for data in gen]
-            except StopIteration:
-                data_path, gen = video_data_gen(random.choice(f_lst), opt)
-        else:
-            data_path, gen = data_gen(random.choice(f_lst), skip = opt.skip, length = opt.depth, pre = opt.depth)
-            try:
-                [s.send_array_(data.copy(order='C'), copy=False, filename=data_path) for data in gen]
-            except StopIteration:
-                data_path, gen = data_gen(random.choice(f_lst), skip = opt.skip, length = opt.depth, pre = opt.depth)
-
-def client(opt = None):
+        data_path, gen = clip_gen(rng.choice(f_lst), opt, clip_index)
+        for i, data in enumerate(gen, clip_index):
+            meta = {'path': data_path, 'port': port, 'file': file_index, 'clip': i}
+            s.send_array_(data.copy(order='C'), copy=False, filename=meta)
+        file_index, clip_index = file_index + 1, 0
+
+def producer_ports(opt, num_producers = 8):
+    return range(int(5550 + 10*opt.depth), int(5550 + 10*opt.depth) + num_producers)
+
+# |cursor| maps each producer port to the position right after the last clip
+# received from it and is updated in place. Filled in before the first
+# next() (e.g. from a training state), it resumes the producers there.
+def client(opt = None, cursor = None, num_producers = 8):
     hwm = 20
     host = 'localhost'
-    server_ports = range(int(5550 + 10*opt.depth), int(5558 + 10*opt.depth))
-    setup_server(server_ports,opt)
+    cursor = {} if cursor is None else cursor
+    f_lst = list_files(opt)
+    print("Total videos: {}".format(len(f_lst)))
+    server_ports = producer_ports(opt, num_producers)
+    setup_server(server_ports,opt,cursor,f_lst)
     ctx = SerializingContext()
 
     c = ctx.socket(zmq.PULL)
     c.set_hwm(hwm)
     [c.connect('tcp://{}:{}'.format(host,p)) for p in server_ports]
+
+    def receive():
+        meta, a = c.recv_array_(copy = False)
+        cursor[str(meta['port'])] = [meta['file'], meta['clip'] + 1]
+        return meta['path'], a
+
     res = []
     while 1:
-        filename , a = c.recv_array_(copy = False)
-        array = [ c.recv_array_(copy = False)[1]for i in range(opt.batchSize) ]
+        filename , a = receive()
+        array = [ receive()[1] for i in range(opt.batchSize) ]
         #print(filename)
         A = np.concatenate(array,axis = 0)
         #print('gen',A.shape)
@@ -162,11 +185,15 @@ f_lst = glob.glob('/data/dataset/depthdata/vkitti_1.3.1_rgb/**/**/')
 '''
 
 
-def setup_server(server_ports, opt):
+def setup_server(server_ports, opt, cursor = None, f_lst = None):
     # Now we can run a few servers
     print("Server starts ...")
+    cursor = cursor or {}
+    processes = []
     for p in server_ports:
-        Process(target = start_server, args = (p ,opt )).start()
+        processes.append(Process(target = start_server, args = (p ,opt , cursor.get(str(p)), f_lst)))
+        processes[-1].start()
+    return processes
 
     # Now we can connect a client to all these servers
     #Process(target = client, kwargs = {'ports' : server_ports}).start()
\ No newline at end of file
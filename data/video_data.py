@@ -10,6 +10,7 @@ from collections import namedtuple
 
 server_ports = range(5550, 5558, 2)
 from data.server import client
+from util.stream_log import StreamRecorder, StreamReplay
 
 
 def make_dataset(data_path):
@@ -27,7 +28,18 @@ class VideoDataset(BaseDataset):
         #self.root = opt.dataroot
         #self.data_path = os.path.join(opt.dataroot, opt.phase)
         self.data_list = make_dataset(opt.dataroot)
-        self.c = client(opt = opt)
+        self.cursor = {}
+        # --replay_stream feeds back a recorded stream instead of starting
+        # the producers; --record_stream logs the batches they deliver
+        self.replay = None
+        self.recorder = None
+        if opt.replay_stream:
+            self.replay = StreamReplay(opt.replay_stream)
+            self.replay_index = opt.replay_start
+        else:
+            self.c = client(opt = opt, cursor = self.cursor)
+            if opt.record_stream:
+                self.recorder = StreamRecorder(opt.record_stream)
         self.max_size = opt.max_dataset_size
         #print(self.data_list)
 
@@ -39,7 +51,14 @@ class VideoDataset(BaseDataset):
             raise IndexError
 
         #AB = np.load(AB_path)
-        filename, AB = next(self.c)
+        if self.replay is not None:
+            # wraps around at the end of the log
+            filename, AB = self.replay.get(self.replay_index % len(self.replay))
+            self.replay_index += 1
+        else:
+            filename, AB = next(self.c)
+            if self.recorder is not None:
+                self.recorder.append(filename, AB)
         AB_path = filename
         A = AB[::2]/127.5 -1.
         #print("====== load A size ==== {0}".format(A.shape))
@@ -50,6 +69,19 @@ class VideoDataset(BaseDataset):
     def __len__(self):
         return len(self.data_list)
 
+    # producer positions, see data.server.client, or the replay position
+    def state_dict(self):
+        if self.replay is not None:
+            return {'cursor': dict(self.cursor), 'replay_index': self.replay_index}
+        return {'cursor': dict(self.cursor)}
+
+    # must be called before the first item is read
+    def load_state_dict(self, state):
+        self.cursor.clear()
+        self.cursor.update(state['cursor'])
+        if self.replay is not None and 'replay_index' in state:
+            self.replay_index = state['replay_index']
+
     def name(self):
         return 'VideoDataset'
 
@@ -0,0 +1,127 @@
+import os
+import sys
+import copy
+import json
+import argparse
+
+import numpy as np
+import torch
+
+from models import networks
+from models import pruning
+from util.runtime import GeneratorRuntime
+from util import mmap_checkpoint
+
+# Exports a trained generator checkpoint to TorchScript and/or ONNX for
+# util/runtime.GeneratorRuntime. Deliberately does not go through options/
+# or create_model, so it has no CUDA or checkpoint-directory side effects.
+#
+#   python export.py --checkpoint checkpoints/vkitti75-zdx/latest_net_G.pth \
+#       --which_model_netG unet_256 --norm batch --depth 75 --dynamic_depth --check
+
+
+def build_generator(args):
+    spec = pruning.load_spec(args.prune_spec) if args.prune_spec else {}
+    netG = networks.define_G(args.input_nc, args.output_nc, args.ngf, args.which_model_netG,
+                             args.norm, not args.no_dropout, None, [], channels=spec.get('G'))
+    if args.checkpoint.endswith(mmap_checkpoint.INDEX_SUFFIX):
+        netG.load_state_dict(mmap_checkpoint.load(args.checkpoint[:-len(mmap_checkpoint.INDEX_SUFFIX)]))
+    else:
+        netG.load_state_dict(torch.load(args.checkpoint, map_location='cpu'))
+    netG.eval()
+    return netG
+
+
+def example_input(netG, args):
+    if isinstance(netG, networks.ResnetGenerator):
+        return torch.rand(1, args.input_nc, args.fineSize, args.fineSize) * 2 - 1
+    return torch.rand(1, args.input_nc, args.depth, args.fineSize, args.fineSize) * 2 - 1
+
+
+def export_torchscript(netG, example, path):
+    with torch.no_grad():
+        traced = torch.jit.trace(netG.model, example)
+    traced.save(path)
+    print('saved TorchScript generator to %s' % path)
+
+
+def export_onnx(netG, example, path, dynamic_depth):
+    dynamic_axes = {'input': {0: 'batch'}, 'output': {0: 'batch'}}
+    if dynamic_depth and example.dim() == 5:
+        dynamic_axes['input'][2] = 'depth'
+        dynamic_axes['output'][2] = 'depth'
+    with torch.no_grad():
+        torch.onnx.export(netG.model, example, path, input_names=['input'], output_names=['output'],
+                          dynamic_axes=dynamic_axes, opset_version=13)
+    print('saved ONNX generator to %s' % path)
+
+
+# compares every exported artifact against the eager (unoptimized) model; with
+# |dynamic_depth| a second, shorter clip checks that depth really is free
+def check_parity(reference, example, paths, args):
+    inputs = [example]
+    if args.dynamic_depth and example.dim() == 5:
+        inputs.append(torch.rand(1, args.input_nc, max(1, args.depth // 2), args.fineSize, args.fineSize) * 2 - 1)
+    ok = True
+    for path in paths:
+        runtime = GeneratorRuntime(path)
+        for input in inputs:
+            with torch.no_grad():
+                expected = reference.model(input).numpy()
+            diff = float(np.abs(runtime(input.numpy()) - expected).max())
+            print('%s input %s: max abs diff %.2e' % (os.path.basename(path), tuple(input.size()), diff))
+            ok = ok and diff <= args.atol
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--checkpoint', type=str, required=True, help='path to a [epoch]_net_G.pth state dict or [epoch]_net_G.mmap.json index')
+    parser.add_argument('--output', type=str, default='', help='artifact path without extension, defaults to the checkpoint path')
+    parser.add_argument('--format', type=str, default='torchscript,onnx', help='comma separated: torchscript, onnx')
+    parser.add_argument('--input_nc', type=int, default=3, help='# of input image channels')
+    parser.add_argument('--output_nc', type=int, default=3, help='# of output image channels')
+    parser.add_argument('--ngf', type=int, default=64, help='# of gen filters in first conv layer')
+    parser.add_argument('--which_model_netG', type=str, default='unet_256', help='selects model to use for netG')
+    parser.add_argument('--norm', type=str, default='batch', help='instance normalization or batch normalization')
+    parser.add_argument('--no_dropout', action='store_true', help='no dropout for the generator')
+    parser.add_argument('--prune_spec', type=str, default='', help='channel spec json of a pruned generator')
+    parser.add_argument('--depth', type=int, default=75, help='3D Video frames length used for tracing')
+    parser.add_argument('--fineSize', type=int, default=256, help='frame size used for tracing')
+    parser.add_argument('--dynamic_depth', action='store_true', help='allow any clip length at run time (ONNX dynamic axis)')
+    parser.add_argument('--optimize', action='store_true', help='fold batch norm and strip dropout before exporting (networks.optimize_for_inference)')
+    parser.add_argument('--check', action='store_true', help='check output parity of the artifacts against the eager model')
+    parser.add_argument('--atol', type=float, default=1e-4, help='max abs difference allowed by --check')
+    args = parser.parse_args()
+
+    netG = build_generator(args)
+    example = example_input(netG, args)
+    reference = netG
+    if args.optimize:
+        netG = networks.optimize_for_inference(copy.deepcopy(reference), example)
+        ok, diff = networks.check_equivalence(reference, netG, example, args.atol)
+        if not ok:
+            print('optimized generator differs from the checkpoint (max abs diff %.2e), not exporting' % diff)
+            sys.exit(1)
+    prefix = args.output or os.path.splitext(args.checkpoint)[0]
+    if not args.output and args.checkpoint.endswith(mmap_checkpoint.INDEX_SUFFIX):
+        prefix = args.checkpoint[:-len(mmap_checkpoint.INDEX_SUFFIX)]
+    paths = []
+    for fmt in args.format.split(','):
+        if fmt == 'torchscript':
+            paths.append(prefix + '.pt')
+            export_torchscript(netG, example, paths[-1])
+        elif fmt == 'onnx':
+            paths.append(prefix + '.onnx')
+            export_onnx(netG, example, paths[-1], args.dynamic_depth)
+        else:
+            raise ValueError('export format [%s] not recognized' % fmt)
+
+    meta = dict(which_model_netG=args.which_model_netG, input_nc=args.input_nc, output_nc=args.output_nc,
+                depth=args.depth, fineSize=args.fineSize, dynamic_depth=args.dynamic_depth)
+    with open(prefix + '.json', 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    if args.check and not check_parity(reference, example, paths, args):
+        print('parity check failed')
+        sys.exit(1)
@@ -0,0 +1,89 @@
+import time
+import json
+import argparse
+import threading
+
+import numpy as np
+import zmq
+
+from server import SerializingContext
+
+# Client for inference_server.py. Run as a script it acts as a load
+# generator: --clients threads each send --requests random clips and the
+# client-side latency percentiles are printed next to the server's own stats.
+
+
+class InferenceClient():
+    def __init__(self, address='tcp://localhost:5600', ctx=None):
+        self.ctx = ctx or SerializingContext()
+        self.socket = self.ctx.socket(zmq.DEALER)
+        self.socket.connect(address)
+        self.next_id = 0
+
+    def request(self, header, clip=None):
+        header = dict(header, id=self.next_id)
+        self.next_id += 1
+        if clip is None:
+            self.socket.send(json.dumps(header).encode())
+        else:
+            self.socket.send(json.dumps(header).encode(), zmq.SNDMORE)
+            self.socket.send_array(np.ascontiguousarray(clip), copy=False)
+        return header['id']
+
+    # |clip|: uint8 array shaped (C, D, H, W); returns netG output, same
+    # layout. Raises RuntimeError if the server could not process it.
+    def infer(self, clip):
+        req_id = self.request({'op': 'infer'}, clip)
+        frames = self.socket.recv_multipart()
+        header = json.loads(frames[0].decode())
+        assert(header['id'] == req_id)
+        if 'error' in header:
+            raise RuntimeError('inference server: %s' % header['error'])
+        md = json.loads(frames[1].decode())
+        return np.frombuffer(frames[2], dtype=md['dtype']).reshape(md['shape'])
+
+    def stats(self):
+        self.request({'op': 'stats'})
+        return json.loads(self.socket.recv().decode())
+
+    def close(self):
+        self.socket.close()
+
+
+def run_client(address, ctx, num_requests, shape, latencies):
+    client = InferenceClient(address, ctx)
+    clip = np.random.randint(0, 256, size=shape).astype(np.uint8)
+    for i in range(num_requests):
+        start = time.time()
+        client.infer(clip)
+        latencies.append(time.time() - start)
+    client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--address', type=str, default='tcp://localhost:5600', help='inference server address')
+    parser.add_argument('--clients', type=int, default=8, help='number of concurrent clients')
+    parser.add_argument('--requests', type=int, default=20, help='requests sent by each client')
+    parser.add_argument('--input_nc', type=int, default=3, help='# of input image channels')
+    parser.add_argument('--depth', type=int, default=16, help='frames per clip')
+    parser.add_argument('--fineSize', type=int, default=256, help='clip height and width')
+    args = parser.parse_args()
+
+    ctx = SerializingContext()
+    shape = (args.input_nc, args.depth, args.fineSize, args.fineSize)
+    latencies = []
+    threads = [threading.Thread(target=run_client, args=(args.address, ctx, args.requests, shape, latencies))
+               for i in range(args.clients)]
+    start = time.time()
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    elapsed = time.time() - start
+
+    lat = np.asarray(latencies) * 1000.
+    print('%d requests in %.2f sec, %.2f clips/sec' % (len(lat), elapsed, len(lat) / elapsed))
+    print('client latency ms: p50 %.1f, p90 %.1f, p99 %.1f' %
+          (np.percentile(lat, 50), np.percentile(lat, 90), np.percentile(lat, 99)))
+    client = InferenceClient(args.address, ctx)
+    print('server stats: %s' % json.dumps(client.stats()))
+    client.close()
@@ -0,0 +1,271 @@
+import os
+import time
+import json
+from collections import deque, OrderedDict
+
+import numpy as np
+import torch
+import zmq
+from torch.autograd import Variable
+
+from options.serve_options import ServeOptions
+from models.models import create_model
+from models import networks
+from server import SerializingContext
+from util.result_cache import ResultCache, weights_digest
+from util.checkpoint_watcher import CheckpointWatcher
+from util import mmap_checkpoint
+
+# Long-running generator server. Clients (see inference_client.py) send uint8
+# clips shaped (C, D, H, W) over a DEALER socket; requests with the same
+# shape are grouped into one netG batch, bounded by --max_batch and
+# --max_wait_ms, and answered with uint8 clips of the same layout.
+#
+# wire format, as seen by the ROUTER socket:
+#   request: [identity, header json, array md json, array bytes]
+#            header = {'op': 'infer' | 'stats', 'id': <client request id>}
+#   reply:   [identity, header json, array md json, array bytes]  (infer)
+#            [identity, header json]                              (stats)
+#            [identity, {'id': ..., 'error': <message>}]           (failure)
+#
+# A malformed request, or a batch netG fails on, is answered with an error
+# reply; the server keeps running.
+#
+# Results are cached by input clip and checkpoint identity (ResultCache), so
+# repeated clips are answered without touching netG. With --watch_checkpoint
+# a new checkpoint is loaded in the background and swapped in between
+# batches.
+
+
+class PendingRequest():
+    def __init__(self, identity, req_id, clip, key=None):
+        self.identity = identity
+        self.req_id = req_id
+        self.clip = clip
+        self.key = key
+        self.model_id = None
+        self.arrival = time.time()
+
+
+class LatencyStats():
+    def __init__(self, window=1000):
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.num_requests = 0
+        self.num_batches = 0
+
+    def add_cached(self, latency):
+        self.latencies.append(latency)
+        self.num_requests += 1
+
+    def add_batch(self, latencies):
+        self.latencies.extend(latencies)
+        self.batch_sizes.append(len(latencies))
+        self.num_requests += len(latencies)
+        self.num_batches += 1
+
+    def summary(self):
+        stats = OrderedDict([('requests', self.num_requests), ('batches', self.num_batches)])
+        if self.latencies:
+            lat = np.asarray(self.latencies) * 1000.
+            for p in (50, 90, 99):
+                stats['p%d_ms' % p] = float(np.percentile(lat, p))
+            stats['mean_batch'] = float(np.mean(self.batch_sizes))
+        return stats
+
+
+class InferenceServer():
+    def __init__(self, model, opt):
+        self.model = model
+        self.opt = opt
+        self.max_batch = opt.max_batch
+        self.max_wait = opt.max_wait_ms / 1000.
+        self.stats = LatencyStats(opt.latency_window)
+        self.pending = []
+        self.cache = None
+        if opt.cache_items > 0 or opt.cache_dir:
+            self.cache = ResultCache(opt.cache_items, opt.cache_dir, opt.cache_disk_mb)
+        self.model_id = self.make_model_id(weights_digest(model.netG))
+        self.watcher = None
+        if opt.watch_checkpoint:
+            path = os.path.join(model.save_dir, '%s_net_G.pth' % opt.which_epoch)
+            if opt.checkpoint_format == 'mmap':
+                # the index is replaced last, after the new shards are complete
+                path = mmap_checkpoint.index_path(path[:-len('.pth')])
+            template, prepare = None, None
+            if 'G' in model.unoptimized:
+                # --optimize_inference: reload into the unfolded layout
+                # and fold again, in the memory format picked at start up
+                template = model.unoptimized['G']
+                prepare = lambda net: networks.optimize_for_inference(net, memory_format=model.netG.memory_format)
+            self.watcher = CheckpointWatcher(model.netG, path, opt.watch_interval, template, prepare)
+            self.watcher.start()
+
+        self.ctx = SerializingContext()
+        self.socket = self.ctx.socket(zmq.ROUTER)
+        self.socket.bind('tcp://*:{}'.format(opt.port))
+        self.poller = zmq.Poller()
+        self.poller.register(self.socket, zmq.POLLIN)
+
+    # Identity of the results netG currently produces, part of every cache
+    # key: the checkpoint plus the settings that change the output (tiling,
+    # dropout and batch norm mode, the folded graph's rounding)
+    def make_model_id(self, digest):
+        opt = self.opt
+        return '%s:%s:tile%d-%d:%s%s' % (opt.which_epoch, digest, opt.tile_size, opt.tile_overlap,
+                                         'eval' if opt.eval_mode else 'train',
+                                         ':optimized' if opt.optimize_inference else '')
+
+    # the clip of an infer request; raises ValueError if it is malformed
+    def parse_clip(self, frames):
+        if len(frames) != 4:
+            raise ValueError('infer expects a header, array metadata and array bytes, got %d frames' %
+                             (len(frames) - 1))
+        try:
+            md = json.loads(frames[2].decode())
+            shape = tuple(int(n) for n in md['shape'])
+            dtype = np.dtype(md['dtype'])
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError('bad array metadata: %s' % e)
+        if dtype != np.uint8:
+            raise ValueError('expected a uint8 clip, got %s' % dtype)
+        if len(shape) != 4 or shape[0] != self.opt.input_nc or min(shape) < 1:
+            raise ValueError('expected a clip shaped (%d, D, H, W), got %s' % (self.opt.input_nc, shape))
+        if len(frames[3]) != int(np.prod(shape)):
+            raise ValueError('clip has %d bytes, its shape %s needs %d' % (len(frames[3]), shape, np.prod(shape)))
+        return np.frombuffer(frames[3], dtype=dtype).reshape(shape)
+
+    def handle(self, frames):
+        identity = frames[0]
+        try:
+            header = json.loads(frames[1].decode())
+        except (IndexError, ValueError) as e:
+            self.send_error(identity, None, 'bad header: %s' % e)
+            return
+        if not isinstance(header, dict) or header.get('op') not in ('infer', 'stats'):
+            self.send_error(identity, header.get('id') if isinstance(header, dict) else None,
+                            'unknown op, expected infer or stats')
+            return
+        if header['op'] == 'stats':
+            self.reply_stats(identity, header)
+            return
+        try:
+            clip = self.parse_clip(frames)
+        except ValueError as e:
+            self.send_error(identity, header.get('id'), str(e))
+            return
+        request = PendingRequest(identity, header.get('id'), clip)
+        if self.cache is not None:
+            request.key = self.cache.key(clip, self.model_id)
+            request.model_id = self.model_id
+            cached = self.cache.get(request.key)
+            if cached is not None:
+                self.send_result(request, cached)
+                self.stats.add_cached(time.time() - request.arrival)
+                return
+        self.pending.append(request)
+
+    def receive(self, timeout):
+        events = dict(self.poller.poll(timeout))
+        while events.get(self.socket) == zmq.POLLIN:
+            self.handle(self.socket.recv_multipart())
+            events = dict(self.poller.poll(0))
+
+    def reply_stats(self, identity, header):
+        reply = dict(self.stats.summary(), id=header.get('id'))
+        if self.cache is not None:
+            reply['cache'] = self.cache.stats()
+        self.socket.send_multipart([identity, json.dumps(reply).encode()])
+
+    def next_batch(self):
+        # group requests by clip shape, oldest group first
+        now = time.time()
+        shapes = []
+        for r in self.pending:
+            if r.clip.shape not in shapes:
+                shapes.append(r.clip.shape)
+        for shape in shapes:
+            batch = [r for r in self.pending if r.clip.shape == shape][:self.max_batch]
+            if len(batch) >= self.max_batch or now - batch[0].arrival >= self.max_wait:
+                taken = set(id(r) for r in batch)
+                self.pending = [r for r in self.pending if id(r) not in taken]
+                return batch
+        return None
+
+    def run_batch(self, batch):
+        clips = np.stack([r.clip for r in batch])
+        input = torch.from_numpy(clips).float() / 127.5 - 1.
+        if len(self.model.gpu_ids) > 0:
+            input = input.cuda(self.model.gpu_ids[0])
+        with torch.no_grad():
+            output = self.model.run_tiled(self.model.netG, Variable(input))
+        # round to the nearest level, .byte() alone truncates
+        output = ((output.data + 1.) * 127.5).round_().clamp_(0, 255).byte().cpu().numpy()
+        return output
+
+    def send_error(self, identity, req_id, message):
+        print('request %s failed: %s' % (req_id, message))
+        self.socket.send_multipart([identity, json.dumps(dict(id=req_id, error=message)).encode()])
+
+    def send_result(self, request, out):
+        md = dict(dtype=str(out.dtype), shape=out.shape)
+        header = dict(op='infer', id=request.req_id)
+        self.socket.send_multipart([request.identity, json.dumps(header).encode(),
+                                    json.dumps(md).encode(), np.ascontiguousarray(out)], copy=False)
+
+    def respond(self, batch, output):
+        latencies = []
+        for r, out in zip(batch, output):
+            self.send_result(r, out)
+            latencies.append(time.time() - r.arrival)
+            # requests keyed before a checkpoint swap are not cached
+            if self.cache is not None and r.model_id == self.model_id:
+                self.cache.put(r.key, out.copy())
+        self.stats.add_batch(latencies)
+
+    def swap_checkpoint(self):
+        reloaded = self.watcher.poll()
+        if reloaded is not None:
+            self.model.netG, digest = reloaded
+            self.model_id = self.make_model_id(digest)
+            print('swapped in new checkpoint %s' % self.model_id)
+
+    def serve_forever(self):
+        print('inference server listening on port %d' % self.opt.port)
+        while True:
+            if self.pending:
+                wait = self.max_wait - (time.time() - self.pending[0].arrival)
+                timeout = max(0, int(wait * 1000))
+            else:
+                timeout = 1000
+            self.receive(timeout)
+
+            batch = self.next_batch() if self.pending else None
+            while batch:
+                if self.watcher is not None:
+                    self.swap_checkpoint()
+                try:
+                    output = self.run_batch(batch)
+                except RuntimeError as e:
+                    # e.g. out of memory, or a clip netG cannot take
+                    for r in batch:
+                        self.send_error(r.identity, r.req_id, 'inference failed: %s' % e)
+                    if len(self.model.gpu_ids) > 0:
+                        torch.cuda.empty_cache()
+                else:
+                    self.respond(batch, output)
+                if self.stats.num_batches % self.opt.stats_freq == 0:
+                    print('server stats: %s' % json.dumps(self.stats.summary()))
+                    if self.cache is not None:
+                        print('cache stats: %s' % json.dumps(self.cache.stats()))
+                batch = self.next_batch() if self.pending else None
+            if self.watcher is not None:
+                self.swap_checkpoint()
+
+
+if __name__ == '__main__':
+    opt = ServeOptions().parse()
+    model = create_model(opt)
+    if opt.eval_mode:
+        model.netG.eval()
+    InferenceServer(model, opt).serve_forever()
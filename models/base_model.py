@@ -1,5 +1,16 @@
 import os
+import random
+import numpy as np
+import copy
 import torch
+import contextlib
+from collections import OrderedDict
+from . import networks
+from . import quantization
+from util.checkpoint_writer import CheckpointWriter, atomic_write
+from util import mmap_checkpoint
+
+AMP_DTYPES = {'fp32': None, 'fp16': torch.float16, 'bf16': torch.bfloat16}
 
 
 class BaseModel():
@@ -12,6 +23,85 @@ class BaseModel():
         self.isTrain = opt.isTrain
         self.Tensor = torch.cuda.FloatTensor if self.gpu_ids else torch.Tensor
         self.save_dir = os.path.join(opt.checkpoints_dir, opt.name)
+        self.init_precision()
+        # training checkpoints are written by a background thread
+        self.checkpoint_writer = None
+        if self.isTrain:
+            self.checkpoint_writer = CheckpointWriter(self.save_dir, opt.keep_checkpoints)
+        self.unoptimized = {}
+        # a util.profiler.StepProfiler, set by train.py with --profile
+        self.profiler = None
+
+    # --precision: fp16 and bf16 run the forward passes and losses under
+    # autocast, keeping fp32 master weights. fp16 losses are scaled by a
+    # GradScaler, which skips optimizer steps whose gradients overflowed
+    # and then lowers the scale. bf16 has the fp32 exponent range and needs
+    # no scaling.
+    def init_precision(self):
+        precision = self.opt.precision
+        if precision not in AMP_DTYPES:
+            raise NotImplementedError('precision [%s] is not implemented' % precision)
+        self.amp_dtype = AMP_DTYPES[precision]
+        self.amp_device = 'cuda' if self.gpu_ids else 'cpu'
+        if precision == 'fp16' and not self.gpu_ids:
+            raise ValueError('--precision fp16 needs a GPU, use bf16 on the CPU')
+        self.scaler = torch.amp.GradScaler('cuda', enabled=precision == 'fp16')
+        # device counters of iterations with inf/nan fp16 gradients and of
+        # the optimizer steps skipped because of them, see update_scale
+        self.overflow_steps = None
+        self.skipped_steps = None
+
+    # Adam with the fused (GPU) or multi-tensor (CPU) kernels, which update
+    # all parameters in a few launches instead of several per parameter
+    def adam(self, params):
+        kwargs = {'fused': True} if self.gpu_ids else {'foreach': True}
+        return torch.optim.Adam(params, lr=self.opt.lr, betas=(self.opt.beta1, 0.999), **kwargs)
+
+    # times the enclosed phase of a training step when profiling
+    def profile(self, name):
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.section(name)
+
+    def autocast(self):
+        return torch.autocast(self.amp_device, dtype=self.amp_dtype, enabled=self.amp_dtype is not None)
+
+    # loss.backward(), scaled for fp16
+    def backward(self, loss):
+        self.scaler.scale(loss).backward()
+
+    # optimizer.step(), skipped if the fp16 gradients overflowed (counted in
+    # update_scale); the check stays on the device, so there is no host sync
+    def step(self, optimizer):
+        self.scaler.step(optimizer)
+
+    # call once per iteration, after the last step(): counts the skipped
+    # steps and adjusts the loss scale. The scaler's found-inf flags of the
+    # iteration's steps (cleared by update()) are added up on the device,
+    # so counting needs no host sync either.
+    def update_scale(self):
+        if not self.scaler.is_enabled():
+            return
+        skipped = [sum(state['found_inf_per_device'].values()).clamp(max=1)
+                   for state in self.scaler._per_optimizer_states.values() if state['found_inf_per_device']]
+        if skipped:
+            skipped = torch.stack(skipped).sum().reshape(1)
+            if self.skipped_steps is None:
+                self.overflow_steps = torch.zeros_like(skipped)
+                self.skipped_steps = torch.zeros_like(skipped)
+            self.overflow_steps.add_(skipped.clamp(max=1))
+            self.skipped_steps.add_(skipped)
+        self.scaler.update()
+
+    # read only when reported: get_scale() and the counters wait for the GPU
+    def get_precision_stats(self):
+        if not self.scaler.is_enabled():
+            return OrderedDict()
+        stats = OrderedDict([('loss_scale', self.scaler.get_scale()), ('overflows', 0), ('skipped_steps', 0)])
+        if self.skipped_steps is not None:
+            stats['overflows'] = int(self.overflow_steps.item())
+            stats['skipped_steps'] = int(self.skipped_steps.item())
+        return stats
 
     def set_input(self, input):
         self.input = input
@@ -26,32 +116,209 @@ class BaseModel():
     def get_image_paths(self):
         pass
 
+    # applies networks.optimize_for_inference to a test-time network, which
+    # also picks the faster memory format on an input of the test shape.
+    # The unoptimized structure is kept (on the meta device, without
+    # storage) in self.unoptimized[name]: checkpoints are saved and loaded
+    # in that layout (see util.checkpoint_watcher).
+    def optimize_network(self, network, name):
+        if self.isTrain or not self.opt.optimize_inference:
+            return network
+        print('optimizing network for inference')
+        self.unoptimized[name] = copy.deepcopy(network).to('meta')
+        return networks.optimize_for_inference(network, self.inference_example(network))
+
+    # random input of the shape netG sees at test time (a tile with
+    # --tile_size)
+    def inference_example(self, network):
+        opt = self.opt
+        size = min(opt.fineSize, opt.tile_size) if opt.tile_size > 0 else opt.fineSize
+        shape = (opt.batchSize, opt.input_nc, size, size)
+        if not isinstance(network, networks.ResnetGenerator):
+            shape = shape[:2] + (opt.depth,) + shape[2:]
+        return self.Tensor(*shape).uniform_(-1, 1)
+
+    # runs |net| on |input|, splitting frames larger than --tile_size into
+    # overlapping tiles (see networks.tiled_forward)
+    def run_tiled(self, net, input):
+        input = input.contiguous(memory_format=getattr(net, 'memory_format', torch.contiguous_format))
+        if self.opt.tile_size > 0:
+            return networks.tiled_forward(net, input, self.opt.tile_size,
+                                          self.opt.tile_overlap, self.opt.tile_batch)
+        return net(input)
+
     def optimize_parameters(self):
         pass
 
     def get_current_visuals(self):
         return self.input
 
+    # device tensors for PreviewWriter, or None if the model has none
+    def get_current_visual_tensors(self):
+        return None
+
+    # the model's networks (netG, netD, ...) by attribute name
+    def get_networks(self):
+        return OrderedDict((name, net) for name, net in sorted(vars(self).items())
+                           if name.startswith('net') and isinstance(net, torch.nn.Module))
+
     def get_current_errors(self):
         return {}
 
     def save(self, label):
         pass
 
+    # saves every network under |label| and applies the retention policy
+    # (--keep_checkpoints; milestones are never removed). Returns once the
+    # state is snapshotted, or written with --sync_save.
+    # With |state|, the training state is saved next to the weights.
+    def checkpoint(self, label, milestone=False, state=None):
+        self.save(label)
+        if state is not None:
+            self.save_training_state(label, state)
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.commit(label, milestone)
+            if self.opt.sync_save:
+                self.checkpoint_writer.flush()
+
+    # Everything besides the weights needed to continue training where it
+    # stopped: optimizer moments, schedulers, the fp16 loss scale and the
+    # RNG states. Subclasses add their own counters.
+    def get_training_state(self):
+        rng = {'torch': torch.get_rng_state(), 'numpy': np.random.get_state(), 'random': random.getstate()}
+        if torch.cuda.is_available():
+            rng['cuda'] = torch.cuda.get_rng_state_all()
+        return {'optimizers': [optimizer.state_dict() for optimizer in self.optimizers],
+                'schedulers': [scheduler.state_dict() for scheduler in self.schedulers],
+                'scaler': self.scaler.state_dict(),
+                'rng': rng}
+
+    def set_training_state(self, state):
+        for optimizer, optimizer_state in zip(self.optimizers, state['optimizers']):
+            optimizer.load_state_dict(optimizer_state)
+        for scheduler, scheduler_state in zip(self.schedulers, state['schedulers']):
+            scheduler.load_state_dict(scheduler_state)
+        if state['scaler']:
+            self.scaler.load_state_dict(state['scaler'])
+        rng = state['rng']
+        torch.set_rng_state(rng['torch'])
+        np.random.set_state(rng['numpy'])
+        random.setstate(rng['random'])
+        if 'cuda' in rng and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(rng['cuda'])
+
+    # [label]_train_state.pth: get_training_state() plus the caller's
+    # |extra| entries (epoch, counters, data stream position)
+    def save_training_state(self, label, extra):
+        state = self.get_training_state()
+        state.update(extra)
+        self.checkpoint_writer.submit('%s_train_state.pth' % label, state,
+                                      slot=self.checkpoint_slot(label, 'train_state'))
+
+    # returns the |extra| entries saved with |label|, or None if there is
+    # no training state for it
+    def load_training_state(self, label):
+        path = os.path.join(self.save_dir, '%s_train_state.pth' % label)
+        if not os.path.exists(path):
+            return None
+        state = torch.load(path, map_location='cpu', weights_only=False)
+        self.set_training_state(state)
+        print('resumed training state from %s' % path)
+        return state
+
+    # waits for pending checkpoint writes
+    def flush_checkpoints(self):
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.flush()
+
+    # the networks are about to be loaded from checkpoints, so they need no
+    # weight initialization (networks.define_G/define_D with init_type None)
+    def init_type(self):
+        if not self.isTrain or self.opt.continue_train:
+            return None
+        return self.opt.init_type
+
+    # host buffers of the checkpoint writer: one set for 'latest', which is
+    # saved often, and one shared by all other labels (epochs, steps), so
+    # pinned memory does not grow with the number of labels saved
+    def checkpoint_slot(self, label, name):
+        return '%s/%s' % ('latest' if str(label) == 'latest' else 'snapshot', name)
+
     # helper saving function that can be used by subclasses
+    # --checkpoint_format mmap writes util/mmap_checkpoint files instead of
+    # a pickled state dict
     def save_network(self, network, network_label, epoch_label, gpu_ids):
         save_filename = '%s_net_%s.pth' % (epoch_label, network_label)
+        save = None
+        if self.opt.checkpoint_format == 'mmap':
+            save_filename = save_filename[:-len('.pth')]
+            fp16 = self.opt.checkpoint_fp16
+            save = lambda state, path: mmap_checkpoint.save(state, path, fp16)
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.submit(save_filename, network.state_dict(), save,
+                                          slot=self.checkpoint_slot(epoch_label, network_label))
+            return
         save_path = os.path.join(self.save_dir, save_filename)
-        torch.save(network.cpu().state_dict(), save_path)
+        if save is not None:
+            save(network.state_dict(), save_path)
+            return
+        atomic_write(save_path, lambda f: torch.save(network.cpu().state_dict(), f))
         if len(gpu_ids) and torch.cuda.is_available():
             network.cuda(gpu_ids[0])
 
     # helper loading function that can be used by subclasses
-    def load_network(self, network, network_label, epoch_label):
-        save_filename = '%s_net_%s.pth' % (epoch_label, network_label)
-        save_path = os.path.join(self.save_dir, save_filename)
+    # loads [epoch]_net_[label] in the --checkpoint_format, falling back to
+    # the other format if only that one exists
+    def load_network(self, network, network_label, epoch_label, save_dir=None):
+        prefix = os.path.join(save_dir or self.save_dir, '%s_net_%s' % (epoch_label, network_label))
+        use_mmap = mmap_checkpoint.exists(prefix)
+        if self.opt.checkpoint_format != 'mmap' and os.path.exists(prefix + '.pth'):
+            use_mmap = False
+        if use_mmap:
+            print(mmap_checkpoint.index_path(prefix))
+            network.load_state_dict(mmap_checkpoint.load(prefix))
+            return
+        save_path = prefix + '.pth'
         print(save_path)
-        network.load_state_dict(torch.load(save_path))
+        state = torch.load(save_path)
+        if quantization.is_quantized_state(state):
+            # int8 checkpoints written by quantize.py run on the CPU
+            quantization.load_quantized(network.cpu(), state)
+            self.use_cpu()
+        else:
+            network.load_state_dict(state)
+
+    # moves the model's input buffers to the CPU and keeps them there, for
+    # networks that only run on the CPU (int8); autocast is turned off too
+    def use_cpu(self):
+        if not self.gpu_ids:
+            return
+        print('running on the CPU')
+        self.gpu_ids = self.opt.gpu_ids = []
+        self.Tensor = torch.Tensor
+        self.amp_device, self.amp_dtype = 'cpu', None
+        if hasattr(self, 'allocate_inputs'):
+            self.allocate_inputs(tuple(self.input_AB.size()))
+            return
+        for name, value in list(vars(self).items()):
+            if name.startswith('input_') and torch.is_tensor(value):
+                setattr(self, name, value.cpu())
+
+    # Position of the learning rate schedules: scheduler states and the
+    # current learning rates. set_schedule applies it to new optimizers and
+    # schedulers (e.g. after pruning replaced them), so the schedule goes on
+    # where it was instead of restarting at --lr.
+    def get_schedule(self):
+        return ([scheduler.state_dict() for scheduler in self.schedulers],
+                [[group['lr'] for group in optimizer.param_groups] for optimizer in self.optimizers])
+
+    def set_schedule(self, schedule):
+        scheduler_states, lrs = schedule
+        for scheduler, state in zip(self.schedulers, scheduler_states):
+            scheduler.load_state_dict(state)
+        for optimizer, group_lrs in zip(self.optimizers, lrs):
+            for group, lr in zip(optimizer.param_groups, group_lrs):
+                group['lr'] = lr
 
     # update learning rate (called once every epoch)
     def update_learning_rate(self):
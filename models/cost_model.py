@@ -0,0 +1,241 @@
+import time
+from collections import OrderedDict
+
+import torch
+import torch.nn as nn
+
+from . import networks
+from . import pruning
+
+# Static cost of a training configuration, without allocating it. netG and
+# netD are built on the meta device from the same define_G/define_D
+# arguments the models use and run on meta inputs of the configured shape,
+# so every layer's output shape is exact while no memory is touched.
+# From those shapes:
+#   params      parameter counts
+#   flops       conv FLOPs (multiply-adds x 2) of one forward pass; a
+#               training step costs about 3x the forward passes it makes
+#               (backward computes gradients for inputs and weights)
+#   train_mb    weights, gradients and Adam moments, the input buffer and
+#               the activations autograd keeps alive at the peak of a step
+#   infer_mb    weights plus the activations live at once in a no_grad
+#               generator pass (U-Net skips stay alive until their concat)
+# Activations of in-place layers share their input's storage and are not
+# counted. The estimates leave out the CUDA context, cudnn workspaces and
+# allocator fragmentation; --auto_batch keeps a margin and confirms its
+# pick with one real step (probe).
+
+AMP_ELEMENT_SIZE = {'fp32': 4, 'fp16': 2, 'bf16': 2}
+# forward passes per training step and how many of their activation sets
+# are alive at the peak (the generator graph stays alive through the D
+# update, which holds both discriminator passes)
+PASSES = {
+    'pix2pix': {'G': (1, 1), 'D': (3, 2)},
+    'cycle_gan': {'G_A': (2, 2), 'G_B': (2, 2), 'D_A': (2, 1), 'D_B': (2, 1)},
+    'distill': {'G': (1, 1), 'D': (3, 2), 'T': (1, 0)},
+}
+# networks that are not trained: no gradients or Adam moments, and their
+# (no_grad) forward passes have no backward
+FROZEN = ('T',)
+
+
+def _is_inplace(m):
+    return getattr(m, 'inplace', False)
+
+
+def _trace(net, shape):
+    layers = []
+
+    def hook(m, inputs, output):
+        flops = networks._conv_flops(m, inputs[0], output) if isinstance(m, nn.modules.conv._ConvNd) else 0
+        layers.append((m, inputs[0].numel(), 0 if _is_inplace(m) else output.numel(), flops))
+
+    handles = [m.register_forward_hook(hook) for m in net.modules() if len(list(m.children())) == 0]
+    skips = []
+    for m in net.modules():
+        if isinstance(m, networks.UnetSkipConnectionBlock) and not m.outermost:
+            handles.append(m.register_forward_pre_hook(lambda m, inputs: skips.append(inputs[0].numel())))
+    with torch.no_grad():
+        net(torch.empty(shape, device='meta'))
+    for handle in handles:
+        handle.remove()
+    return {'params': sum(p.numel() for p in net.parameters()),
+            'flops': sum(layer[3] for layer in layers),
+            'activations': sum(layer[2] for layer in layers),
+            'largest': max(layer[2] for layer in layers),
+            'live': sum(skips) + max(layer[1] + layer[2] for layer in layers)}
+
+
+def _networks(opt):
+    spec = pruning.load_spec(opt.prune_spec) if opt.prune_spec else {}
+    norm_layer = networks.get_norm_layer(opt.norm)
+    clip = (opt.depth, opt.fineSize, opt.fineSize)
+
+    def G(input_nc, output_nc, channels=None):
+        return (networks._build_G(input_nc, output_nc, opt.ngf, opt.which_model_netG, norm_layer,
+                                  not opt.no_dropout, [], channels),
+                (opt.batchSize, input_nc) + clip)
+
+    def D(input_nc, channels=None):
+        shape = (opt.batchSize, input_nc) + clip
+        # --d_windows: the shape networks.sample_windows cuts
+        if getattr(opt, 'd_windows', 0) > 0:
+            crop = min(opt.d_crop, opt.fineSize) if opt.d_crop > 0 else opt.fineSize
+            shape = (opt.batchSize * opt.d_windows, input_nc, min(opt.d_window_len, opt.depth), crop, crop)
+        return (networks._build_D(input_nc, opt.ndf, opt.which_model_netD, opt.n_layers_D, norm_layer,
+                                  opt.no_lsgan, [], channels),
+                shape)
+
+    with torch.device('meta'):
+        if opt.model in ('pix2pix', 'distill'):
+            nets = OrderedDict([('G', G(opt.input_nc, opt.output_nc, spec.get('G'))),
+                                ('D', D(opt.input_nc + opt.output_nc, spec.get('D')))])
+            if opt.model == 'distill':
+                # the frozen teacher (the student's feature adapters are
+                # negligible)
+                nets['T'] = (networks._build_G(opt.input_nc, opt.output_nc, opt.teacher_ngf, opt.teacher_netG,
+                                               norm_layer, not opt.no_dropout, [], None),
+                             (opt.batchSize, opt.input_nc) + clip)
+            return nets
+        if opt.model == 'cycle_gan':
+            return OrderedDict([('G_A', G(opt.input_nc, opt.output_nc)), ('G_B', G(opt.output_nc, opt.input_nc)),
+                                ('D_A', D(opt.output_nc)), ('D_B', D(opt.input_nc))])
+    raise NotImplementedError('no cost model for model [%s]' % opt.model)
+
+
+# |overrides| replace options (e.g. batchSize=4) for this estimate only
+def estimate(opt, **overrides):
+    if overrides:
+        opt = _override(opt, overrides)
+    act_size = AMP_ELEMENT_SIZE[opt.precision]
+    nets = OrderedDict((name, _trace(net, shape)) for name, (net, shape) in _networks(opt).items())
+    passes = PASSES[opt.model]
+    params = sum(net['params'] for name, net in nets.items() if name not in FROZEN)
+    frozen_params = sum(net['params'] for name, net in nets.items() if name in FROZEN)
+    step_flops = sum(net['flops'] * passes[name][0] * (1 if name in FROZEN else 3) for name, net in nets.items())
+    activations = sum(net['activations'] * passes[name][1] for name, net in nets.items())
+    # the input pair buffer, plus the largest single layer output twice
+    # over for the gradients in flight during backward
+    inputs = opt.batchSize * (opt.input_nc + opt.output_nc) * opt.depth * opt.fineSize ** 2
+    gradients = 2 * max(net['largest'] for net in nets.values())
+    generators = [net for name, net in nets.items() if name.startswith('G')]
+    result = OrderedDict()
+    for name, net in nets.items():
+        result['params_' + name] = net['params']
+        result['gflops_' + name] = net['flops'] / 1e9
+    result['gflops_step'] = step_flops / 1e9
+    result['activation_mb'] = activations * act_size / 2. ** 20
+    result['train_mb'] = (16 * params + 4 * frozen_params + 4 * inputs + act_size * activations +
+                          4 * gradients) / 2. ** 20
+    result['infer_mb'] = (4 * sum(net['params'] for net in generators) +
+                          act_size * max(net['live'] for net in generators)) / 2. ** 20
+    return result
+
+
+def _override(opt, overrides):
+    copy = type(opt)()
+    copy.__dict__.update(vars(opt))
+    copy.__dict__.update(overrides)
+    return copy
+
+
+def print_estimate(opt, result=None):
+    result = result or estimate(opt)
+    print('---------- Cost estimate: %s, input %s -------------' %
+          (opt.model, (opt.batchSize, opt.input_nc, opt.depth, opt.fineSize, opt.fineSize)))
+    for key, value in result.items():
+        print('%-16s %s' % (key, ('%d' % value) if key.startswith('params') else '%.1f' % value))
+
+
+# bytes available for training: --mem_budget_mb, or the free memory of the
+# first GPU
+def memory_budget(opt):
+    if opt.mem_budget_mb > 0:
+        return opt.mem_budget_mb * 2 ** 20
+    if not opt.gpu_ids:
+        raise ValueError('--auto_batch on the CPU needs --mem_budget_mb')
+    free, total = torch.cuda.mem_get_info(opt.gpu_ids[0])
+    return free
+
+
+# largest value of option |key| in [1, limit] whose estimated training
+# memory fits |budget| bytes (memory grows with batch size and depth)
+def fit(opt, key, budget, limit=4096):
+    def fits(value):
+        return estimate(opt, **{key: value})['train_mb'] * 2 ** 20 <= budget
+    if not fits(1):
+        return 0
+    low, high = 1, 2
+    while high <= limit and fits(high):
+        low, high = high, high * 2
+    high = min(high, limit + 1)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+# Peak bytes of one real training step of the networks at opt's sizes on
+# the first GPU, or None if it runs out of memory. Uses throwaway networks,
+# so the model's weights are not touched.
+def probe(opt):
+    device = torch.device('cuda', opt.gpu_ids[0])
+    torch.cuda.empty_cache()
+    torch.cuda.reset_peak_memory_stats(device)
+    try:
+        nets = OrderedDict((name, (net.to_empty(device=device), shape)) for name, (net, shape) in _networks(opt).items())
+        params = [p for name, (net, shape) in nets.items() if name not in FROZEN for p in net.parameters()]
+        optimizer = torch.optim.Adam(params, fused=True)
+        dtype = {'fp16': torch.float16, 'bf16': torch.bfloat16}.get(opt.precision)
+        passes = PASSES[opt.model]
+        with torch.autocast('cuda', dtype=dtype, enabled=dtype is not None):
+            loss = 0
+            for name, (net, shape) in nets.items():
+                if name in FROZEN:
+                    with torch.no_grad():
+                        net(torch.randn(shape, device=device))
+                for _ in range(passes[name][1]):
+                    loss = loss + net(torch.randn(shape, device=device)).float().mean()
+        loss.backward()
+        optimizer.step()
+        torch.cuda.synchronize(device)
+        return torch.cuda.max_memory_allocated(device)
+    except torch.cuda.OutOfMemoryError:
+        return None
+    finally:
+        nets = params = optimizer = loss = None
+        torch.cuda.empty_cache()
+
+
+# --auto_batch / --auto_depth: sets opt.batchSize or opt.depth to the
+# largest value the cost model fits into the memory budget (less
+# --mem_margin), then, on a GPU, shrinks it until a probe step fits
+def auto_size(opt):
+    key = 'batchSize' if opt.auto_batch else 'depth'
+    budget = memory_budget(opt)
+    usable = budget * (1 - opt.mem_margin)
+    value = fit(opt, key, usable)
+    if value == 0:
+        raise RuntimeError('%s 1 does not fit the memory budget of %.0fMB' % (key, budget / 2. ** 20))
+    print('cost model: %s %d fits %.0fMB (estimated %.0fMB)' %
+          (key, value, usable / 2. ** 20, estimate(opt, **{key: value})['train_mb']))
+    if opt.gpu_ids:
+        while value > 0:
+            start = time.time()
+            peak = probe(_override(opt, {key: value}))
+            if peak is not None and peak <= budget:
+                print('probe: %s %d peaks at %.0fMB (%.1fs)' % (key, value, peak / 2. ** 20, time.time() - start))
+                break
+            print('probe: %s %d does not fit, shrinking' % (key, value))
+            value = min(value - 1, int(value * 0.9))
+        if value == 0:
+            raise RuntimeError('%s 1 does not fit into GPU memory' % key)
+    setattr(opt, key, value)
+    if key == 'depth' and opt.overlap > value:
+        # B clips start depth - overlap frames into A (data.img_loder.gen_frame)
+        print('overlap lowered from %d to the depth %d' % (opt.overlap, value))
+        opt.overlap = value
+    return value
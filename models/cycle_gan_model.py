@@ -28,18 +28,18 @@ class CycleGANModel(BaseModel):
         # Code (paper): G_A (G), G_B (F), D_A (D_Y), D_B (D_X)
 
         self.netG_A = networks.define_G(opt.input_nc, opt.output_nc,
-                                        opt.ngf, opt.which_model_netG, opt.norm, not opt.no_dropout, opt.init_type, self.gpu_ids)
+                                        opt.ngf, opt.which_model_netG, opt.norm, not opt.no_dropout, self.init_type(), self.gpu_ids)
         self.netG_B = networks.define_G(opt.output_nc, opt.input_nc,
-                                        opt.ngf, opt.which_model_netG, opt.norm, not opt.no_dropout, opt.init_type, self.gpu_ids)
+                                        opt.ngf, opt.which_model_netG, opt.norm, not opt.no_dropout, self.init_type(), self.gpu_ids)
 
         if self.isTrain:
             use_sigmoid = opt.no_lsgan
             self.netD_A = networks.define_D(opt.output_nc, opt.ndf,
                                             opt.which_model_netD,
-                                            opt.n_layers_D, opt.norm, use_sigmoid, opt.init_type, self.gpu_ids)
+                                            opt.n_layers_D, opt.norm, use_sigmoid, self.init_type(), self.gpu_ids)
             self.netD_B = networks.define_D(opt.input_nc, opt.ndf,
                                             opt.which_model_netD,
-                                            opt.n_layers_D, opt.norm, use_sigmoid, opt.init_type, self.gpu_ids)
+                                            opt.n_layers_D, opt.norm, use_sigmoid, self.init_type(), self.gpu_ids)
         if not self.isTrain or opt.continue_train:
             which_epoch = opt.which_epoch
             self.load_network(self.netG_A, 'G_A', which_epoch)
@@ -50,17 +50,16 @@ class CycleGANModel(BaseModel):
 
         if self.isTrain:
             self.old_lr = opt.lr
-            self.fake_A_pool = ImagePool(opt.pool_size)
-            self.fake_B_pool = ImagePool(opt.pool_size)
+            self.fake_A_pool = ImagePool(opt.pool_size, opt.pool_storage, opt.pool_max_mb)
+            self.fake_B_pool = ImagePool(opt.pool_size, opt.pool_storage, opt.pool_max_mb)
             # define loss functions
             self.criterionGAN = networks.GANLoss(use_lsgan=not opt.no_lsgan, tensor=self.Tensor)
             self.criterionCycle = torch.nn.L1Loss()
             self.criterionIdt = torch.nn.L1Loss()
             # initialize optimizers
-            self.optimizer_G = torch.optim.Adam(itertools.chain(self.netG_A.parameters(), self.netG_B.parameters()),
-                                                lr=opt.lr, betas=(opt.beta1, 0.999))
-            self.optimizer_D_A = torch.optim.Adam(self.netD_A.parameters(), lr=opt.lr, betas=(opt.beta1, 0.999))
-            self.optimizer_D_B = torch.optim.Adam(self.netD_B.parameters(), lr=opt.lr, betas=(opt.beta1, 0.999))
+            self.optimizer_G = self.adam(itertools.chain(self.netG_A.parameters(), self.netG_B.parameters()))
+            self.optimizer_D_A = self.adam(self.netD_A.parameters())
+            self.optimizer_D_B = self.adam(self.netD_B.parameters())
             self.optimizers = []
             self.schedulers = []
             self.optimizers.append(self.optimizer_G)
@@ -90,60 +89,84 @@ class CycleGANModel(BaseModel):
         self.real_B = Variable(self.input_B)
 
     def test(self):
-        real_A = Variable(self.input_A, volatile=True)
-        fake_B = self.netG_A(real_A)
-        self.rec_A = self.netG_B(fake_B).data
-        self.fake_B = fake_B.data
+        with torch.no_grad(), self.autocast():
+            real_A = self.input_A
+            fake_B = self.netG_A(real_A)
+            self.rec_A = self.netG_B(fake_B).data.float()
+            self.fake_B = fake_B.data.float()
 
-        real_B = Variable(self.input_B, volatile=True)
-        fake_A = self.netG_B(real_B)
-        self.rec_B = self.netG_A(fake_A).data
-        self.fake_A = fake_A.data
+            real_B = self.input_B
+            fake_A = self.netG_B(real_B)
+            self.rec_B = self.netG_A(fake_A).data.float()
+            self.fake_A = fake_A.data.float()
 
     # get image paths
     def get_image_paths(self):
         return self.image_paths
 
     def backward_D_basic(self, netD, real, fake):
-        # Real
-        pred_real = netD(real)
-        loss_D_real = self.criterionGAN(pred_real, True)
-        # Fake
-        pred_fake = netD(fake.detach())
-        loss_D_fake = self.criterionGAN(pred_fake, False)
-        # Combined loss
-        loss_D = (loss_D_real + loss_D_fake) * 0.5
+        with self.autocast():
+            # Real
+            pred_real = netD(real)
+            loss_D_real = self.criterionGAN(pred_real, True)
+            # Fake
+            pred_fake = netD(fake.detach())
+            loss_D_fake = self.criterionGAN(pred_fake, False)
+            # Combined loss
+            loss_D = (loss_D_real + loss_D_fake) * 0.5
         # backward
-        loss_D.backward()
+        self.backward(loss_D)
         return loss_D
 
     def backward_D_A(self):
         fake_B = self.fake_B_pool.query(self.fake_B)
         loss_D_A = self.backward_D_basic(self.netD_A, self.real_B, fake_B)
-        self.loss_D_A = loss_D_A.data[0]
+        self.loss_D_A = loss_D_A.detach()
 
     def backward_D_B(self):
         fake_A = self.fake_A_pool.query(self.fake_A)
         loss_D_B = self.backward_D_basic(self.netD_B, self.real_A, fake_A)
-        self.loss_D_B = loss_D_B.data[0]
+        self.loss_D_B = loss_D_B.detach()
 
     def backward_G(self):
+        with self.profile('G_forward'), self.autocast():
+            loss_G = self.compute_loss_G()
+        with self.profile('G_backward'):
+            self.backward(loss_G)
+
+    # runs |net| on each of |inputs|. With --batch_G_calls the inputs are
+    # stacked into a single forward pass; batch norm layers then normalize
+    # each input with its own statistics, as separate calls would
+    def run_G(self, net, inputs):
+        if not self.opt.batch_G_calls or len(inputs) == 1:
+            return [net(input) for input in inputs]
+        with networks.split_batch_norm(net, len(inputs)):
+            output = net(torch.cat(inputs, 0))
+        return output.chunk(len(inputs), 0)
+
+    def compute_loss_G(self):
         lambda_idt = self.opt.identity
         lambda_A = self.opt.lambda_A
         lambda_B = self.opt.lambda_B
+        # First stage generator passes: G_A(B), G_A(A) and G_B(A), G_B(B)
+        if lambda_idt > 0:
+            idt_A, fake_B = self.run_G(self.netG_A, [self.real_B, self.real_A])
+            idt_B, fake_A = self.run_G(self.netG_B, [self.real_A, self.real_B])
+        else:
+            fake_B, = self.run_G(self.netG_A, [self.real_A])
+            fake_A, = self.run_G(self.netG_B, [self.real_B])
+
         # Identity loss
         if lambda_idt > 0:
             # G_A should be identity if real_B is fed.
-            idt_A = self.netG_A(self.real_B)
             loss_idt_A = self.criterionIdt(idt_A, self.real_B) * lambda_B * lambda_idt
             # G_B should be identity if real_A is fed.
-            idt_B = self.netG_B(self.real_A)
             loss_idt_B = self.criterionIdt(idt_B, self.real_A) * lambda_A * lambda_idt
 
             self.idt_A = idt_A.data
             self.idt_B = idt_B.data
-            self.loss_idt_A = loss_idt_A.data[0]
-            self.loss_idt_B = loss_idt_B.data[0]
+            self.loss_idt_A = loss_idt_A.detach()
+            self.loss_idt_B = loss_idt_B.detach()
         else:
             loss_idt_A = 0
             loss_idt_B = 0
@@ -151,12 +174,10 @@ class CycleGANModel(BaseModel):
             self.loss_idt_B = 0
 
         # GAN loss D_A(G_A(A))
-        fake_B = self.netG_A(self.real_A)
         pred_fake = self.netD_A(fake_B)
         loss_G_A = self.criterionGAN(pred_fake, True)
 
         # GAN loss D_B(G_B(B))
-        fake_A = self.netG_B(self.real_B)
         pred_fake = self.netD_B(fake_A)
         loss_G_B = self.criterionGAN(pred_fake, True)
 
@@ -169,40 +190,50 @@ class CycleGANModel(BaseModel):
         loss_cycle_B = self.criterionCycle(rec_B, self.real_B) * lambda_B
         # combined loss
         loss_G = loss_G_A + loss_G_B + loss_cycle_A + loss_cycle_B + loss_idt_A + loss_idt_B
-        loss_G.backward()
 
         self.fake_B = fake_B.data
         self.fake_A = fake_A.data
         self.rec_A = rec_A.data
         self.rec_B = rec_B.data
 
-        self.loss_G_A = loss_G_A.data[0]
-        self.loss_G_B = loss_G_B.data[0]
-        self.loss_cycle_A = loss_cycle_A.data[0]
-        self.loss_cycle_B = loss_cycle_B.data[0]
+        # detached loss tensors, read (with a host sync) only when reported
+        self.loss_G_A = loss_G_A.detach()
+        self.loss_G_B = loss_G_B.detach()
+        self.loss_cycle_A = loss_cycle_A.detach()
+        self.loss_cycle_B = loss_cycle_B.detach()
+        return loss_G
 
     def optimize_parameters(self):
         # forward
         self.forward()
         # G_A and G_B
-        self.optimizer_G.zero_grad()
+        self.optimizer_G.zero_grad(set_to_none=True)
         self.backward_G()
-        self.optimizer_G.step()
+        with self.profile('G_step'):
+            self.step(self.optimizer_G)
         # D_A
-        self.optimizer_D_A.zero_grad()
-        self.backward_D_A()
-        self.optimizer_D_A.step()
+        self.optimizer_D_A.zero_grad(set_to_none=True)
+        with self.profile('D_backward'):
+            self.backward_D_A()
+        with self.profile('D_step'):
+            self.step(self.optimizer_D_A)
         # D_B
-        self.optimizer_D_B.zero_grad()
-        self.backward_D_B()
-        self.optimizer_D_B.step()
+        self.optimizer_D_B.zero_grad(set_to_none=True)
+        with self.profile('D_backward'):
+            self.backward_D_B()
+        with self.profile('D_step'):
+            self.step(self.optimizer_D_B)
+
+        self.update_scale()
 
     def get_current_errors(self):
-        ret_errors = OrderedDict([('D_A', self.loss_D_A), ('G_A', self.loss_G_A), ('Cyc_A', self.loss_cycle_A),
-                                 ('D_B', self.loss_D_B), ('G_B', self.loss_G_B), ('Cyc_B',  self.loss_cycle_B)])
+        ret_errors = OrderedDict([('D_A', self.loss_D_A.item()), ('G_A', self.loss_G_A.item()),
+                                  ('Cyc_A', self.loss_cycle_A.item()), ('D_B', self.loss_D_B.item()),
+                                  ('G_B', self.loss_G_B.item()), ('Cyc_B',  self.loss_cycle_B.item())])
         if self.opt.identity > 0.0:
-            ret_errors['idt_A'] = self.loss_idt_A
-            ret_errors['idt_B'] = self.loss_idt_B
+            ret_errors['idt_A'] = self.loss_idt_A.item()
+            ret_errors['idt_B'] = self.loss_idt_B.item()
+        ret_errors.update(self.get_precision_stats())
         return ret_errors
 
     def get_current_visuals(self):
@@ -0,0 +1,117 @@
+import os
+import itertools
+import torch
+import torch.nn as nn
+from .pix2pix_model import Pix2PixModel
+from . import networks
+
+
+# Trains a compact student generator (smaller --ngf, fewer levels such as
+# unet_128, or the unet_*_2plus1d layout) against a frozen teacher loaded
+# from --teacher_name. Both see the same real_A clips from the producer
+# stream. On top of the pix2pix GAN and L1 losses the student matches the
+# teacher output (--lambda_distill) and the outputs of the U-Net levels both
+# networks have, through 1x1x1 conv adapters (--lambda_feat).
+class DistillModel(Pix2PixModel):
+    def name(self):
+        return 'DistillModel'
+
+    def initialize(self, opt):
+        Pix2PixModel.initialize(self, opt)
+        assert(self.isTrain)
+
+        self.netT = networks.define_G(opt.input_nc, opt.output_nc, opt.teacher_ngf,
+                                      opt.teacher_netG, opt.norm, not opt.no_dropout, None, self.gpu_ids)
+        self.load_network(self.netT, 'G', opt.teacher_epoch,
+                          save_dir=os.path.join(opt.checkpoints_dir, opt.teacher_name))
+        for param in self.netT.parameters():
+            param.requires_grad = False
+
+        self.student_feats, self.teacher_feats = {}, {}
+        for level, block in enumerate(self.netT.blocks()[1:], 1):
+            block.register_forward_hook(self.save_feature(self.teacher_feats, level))
+        self.student_hooks = []
+        self.criterionFeat = torch.nn.MSELoss()
+        self.attach_student()
+        if opt.continue_train:
+            self.load_network(self.adapters, 'adapters', opt.which_epoch)
+
+        print('---------- Teacher initialized -------------')
+        networks.print_network(self.netT)
+        print('distilling %d U-Net levels' % len(self.adapters))
+        print('-----------------------------------------------')
+
+    # Hooks the U-Net levels of netG below the outermost one, which has the
+    # same resolution in both networks, and pairs them with the teacher's
+    # through new adapters. Called again when prune() replaces netG.
+    def attach_student(self):
+        for handle in self.student_hooks:
+            handle.remove()
+        self.student_feats.clear()
+        student_blocks, teacher_blocks = self.netG.blocks(), self.netT.blocks()
+        num_levels = min(len(student_blocks), len(teacher_blocks))
+        self.student_hooks = []
+        adapters = []
+        for level in range(1, num_levels):
+            self.student_hooks.append(
+                student_blocks[level].register_forward_hook(self.save_feature(self.student_feats, level)))
+            adapters.append(nn.Conv3d(self.block_channels(student_blocks[level]),
+                                      self.block_channels(teacher_blocks[level]), kernel_size=1))
+        self.adapters = nn.ModuleList(adapters)
+        if len(self.gpu_ids) > 0:
+            self.adapters.cuda(self.gpu_ids[0])
+
+        # the adapters are trained together with the student; the schedule
+        # of the optimizer_G this replaces goes on
+        schedule = self.get_schedule()
+        self.optimizer_G = self.adam(itertools.chain(self.netG.parameters(), self.adapters.parameters()))
+        self.optimizers[0] = self.optimizer_G
+        self.schedulers[0] = networks.get_scheduler(self.optimizer_G, self.opt)
+        self.set_schedule(schedule)
+
+    # the pruned student has fewer channels per level, so its adapters are
+    # rebuilt (and trained from scratch)
+    def prune(self, ratio, criterion='weight'):
+        Pix2PixModel.prune(self, ratio, criterion)
+        self.attach_student()
+
+    @staticmethod
+    def block_channels(block):
+        # skip input channels + upsampled channels
+        convs = [m for m in block.model.children() if isinstance(m, (nn.Conv3d, nn.ConvTranspose3d))]
+        return convs[0].in_channels + convs[-1].out_channels
+
+    @staticmethod
+    def save_feature(store, level):
+        def hook(module, input, output):
+            store[level] = output
+        return hook
+
+    def forward(self):
+        Pix2PixModel.forward(self)
+        # the teacher runs exactly like it does in test.py
+        with torch.no_grad():
+            self.teacher_B = self.netT(self.real_A)
+
+    def compute_loss_G(self):
+        loss_G = Pix2PixModel.compute_loss_G(self)
+
+        self.loss_KD_out = self.criterionL1(self.fake_B, self.teacher_B.detach()) * self.opt.lambda_distill
+
+        loss_feat = 0
+        for level, adapter in zip(range(1, len(self.adapters) + 1), self.adapters):
+            loss_feat = loss_feat + self.criterionFeat(adapter(self.student_feats[level]),
+                                                       self.teacher_feats[level].detach())
+        self.loss_KD_feat = loss_feat / max(1, len(self.adapters)) * self.opt.lambda_feat
+
+        return loss_G + self.loss_KD_out + self.loss_KD_feat
+
+    def get_current_errors(self):
+        errors = Pix2PixModel.get_current_errors(self)
+        errors['KD_out'] = self.loss_KD_out.item()
+        errors['KD_feat'] = self.loss_KD_feat.item()
+        return errors
+
+    def save(self, label):
+        Pix2PixModel.save(self, label)
+        self.save_network(self.adapters, 'adapters', label, self.gpu_ids)
@@ -11,6 +11,10 @@ def create_model(opt):
         #assert(opt.dataset_mode == 'aligned')
         from .pix2pix_model import Pix2PixModel
         model = Pix2PixModel()
+    elif opt.model == 'distill':
+        assert (opt.dataset_mode == 'v')
+        from .distill_model import DistillModel
+        model = DistillModel()
     elif opt.model == 'test':
         assert(opt.dataset_mode == 'single')
         from .test_model import TestModel
@@ -2,6 +2,11 @@ import torch
 import torch.nn as nn
 from torch.nn import init
 import functools
+import contextlib
+import copy
+import time
+import json
+from collections import OrderedDict
 from torch.autograd import Variable
 from torch.optim import lr_scheduler
 import numpy as np
@@ -100,7 +105,8 @@ def get_scheduler(optimizer, opt):
     return scheduler
 
 
-def define_G(input_nc, output_nc, ngf, which_model_netG, norm='batch', use_dropout=False, init_type='normal', gpu_ids=[]):
+def define_G(input_nc, output_nc, ngf, which_model_netG, norm='batch', use_dropout=False, init_type='normal', gpu_ids=[],
+             channels=None):
     netG = None
     use_gpu = len(gpu_ids) > 0
     norm_layer = get_norm_layer(norm_type=norm)
@@ -108,43 +114,70 @@ def define_G(input_nc, output_nc, ngf, which_model_netG, norm='batch', use_dropo
     if use_gpu:
         assert(torch.cuda.is_available())
 
+    with _construction_device(init_type):
+        netG = _build_G(input_nc, output_nc, ngf, which_model_netG, norm_layer, use_dropout, gpu_ids, channels)
+    return _materialize(netG, init_type, gpu_ids)
+
+
+def _build_G(input_nc, output_nc, ngf, which_model_netG, norm_layer, use_dropout, gpu_ids, channels):
     if which_model_netG == 'resnet_9blocks':
         netG = ResnetGenerator(input_nc, output_nc, ngf, norm_layer=norm_layer, use_dropout=use_dropout, n_blocks=9, gpu_ids=gpu_ids)
     elif which_model_netG == 'resnet_6blocks':
         netG = ResnetGenerator(input_nc, output_nc, ngf, norm_layer=norm_layer, use_dropout=use_dropout, n_blocks=6, gpu_ids=gpu_ids)
     elif which_model_netG == 'unet_128':
-        netG = UnetGenerator(input_nc, output_nc, 7, ngf, norm_layer=norm_layer, use_dropout=use_dropout, gpu_ids=gpu_ids)
+        netG = UnetGenerator(input_nc, output_nc, 7, ngf, norm_layer=norm_layer, use_dropout=use_dropout, gpu_ids=gpu_ids, channels=channels)
     elif which_model_netG == 'unet_256':
-        netG = UnetGenerator(input_nc, output_nc, 8, ngf, norm_layer=norm_layer, use_dropout=use_dropout, gpu_ids=gpu_ids)
+        netG = UnetGenerator(input_nc, output_nc, 8, ngf, norm_layer=norm_layer, use_dropout=use_dropout, gpu_ids=gpu_ids, channels=channels)
+    elif which_model_netG == 'unet_128_2plus1d':
+        netG = UnetGenerator(input_nc, output_nc, 7, ngf, norm_layer=norm_layer, use_dropout=use_dropout, gpu_ids=gpu_ids, use_2plus1d=True, channels=channels)
+    elif which_model_netG == 'unet_256_2plus1d':
+        netG = UnetGenerator(input_nc, output_nc, 8, ngf, norm_layer=norm_layer, use_dropout=use_dropout, gpu_ids=gpu_ids, use_2plus1d=True, channels=channels)
     else:
         raise NotImplementedError('Generator model name [%s] is not recognized' % which_model_netG)
-    if len(gpu_ids) > 0:
-        netG.cuda(gpu_ids[0])
-    init_weights(netG, init_type=init_type)
     return netG
 
 
 def define_D(input_nc, ndf, which_model_netD,
-             n_layers_D=3, norm='batch', use_sigmoid=False, init_type='normal', gpu_ids=[]):
+             n_layers_D=3, norm='batch', use_sigmoid=False, init_type='normal', gpu_ids=[], channels=None):
     netD = None
     use_gpu = len(gpu_ids) > 0
     norm_layer = get_norm_layer(norm_type=norm)
 
     if use_gpu:
         assert(torch.cuda.is_available())
+    with _construction_device(init_type):
+        netD = _build_D(input_nc, ndf, which_model_netD, n_layers_D, norm_layer, use_sigmoid, gpu_ids, channels)
+    return _materialize(netD, init_type, gpu_ids)
+
+
+def _build_D(input_nc, ndf, which_model_netD, n_layers_D, norm_layer, use_sigmoid, gpu_ids, channels):
     if which_model_netD == 'basic':
-        netD = NLayerDiscriminator(input_nc, ndf, n_layers=3, norm_layer=norm_layer, use_sigmoid=use_sigmoid, gpu_ids=gpu_ids)
+        netD = NLayerDiscriminator(input_nc, ndf, n_layers=3, norm_layer=norm_layer, use_sigmoid=use_sigmoid, gpu_ids=gpu_ids, channels=channels)
     elif which_model_netD == 'n_layers':
-        netD = NLayerDiscriminator(input_nc, ndf, n_layers_D, norm_layer=norm_layer, use_sigmoid=use_sigmoid, gpu_ids=gpu_ids)
+        netD = NLayerDiscriminator(input_nc, ndf, n_layers_D, norm_layer=norm_layer, use_sigmoid=use_sigmoid, gpu_ids=gpu_ids, channels=channels)
     else:
         raise NotImplementedError('Discriminator model name [%s] is not recognized' %
                                   which_model_netD)
-    if use_gpu:
-        netD.cuda(gpu_ids[0])
-    init_weights(netD, init_type=init_type)
     return netD
 
 
+# init_type None means the weights will be loaded from a checkpoint: the
+# modules are then built on the meta device, which skips the default
+# parameter initialization of every layer as well as init_weights, and are
+# only given (uninitialized) storage afterwards
+def _construction_device(init_type):
+    return torch.device('meta') if init_type is None else contextlib.nullcontext()
+
+
+def _materialize(net, init_type, gpu_ids):
+    if init_type is None:
+        return net.to_empty(device=torch.device('cuda', gpu_ids[0]) if len(gpu_ids) > 0 else 'cpu')
+    if len(gpu_ids) > 0:
+        net.cuda(gpu_ids[0])
+    init_weights(net, init_type=init_type)
+    return net
+
+
 def print_network(net):
     num_params = 0
     for param in net.parameters():
@@ -153,11 +186,405 @@ def print_network(net):
     print('Total number of parameters: %d' % num_params)
 
 
+# Layer-level cost of the networks during training. Hooks every
+# UnetSkipConnectionBlock (named by U-Net level, 0 outermost), ResnetBlock
+# and discriminator layer and records per call
+#   - forward and backward wall time (inclusive of nested blocks; 'self'
+#     excludes them, so a U-Net level's self time is its own convs)
+#   - output activation bytes and conv FLOPs (multiply-adds x 2)
+#   - on the GPU, allocated memory kept after the forward (mostly what is
+#     saved for backward) and the peak above the starting allocation
+# The GPU is synchronized in every hook, so use it for a few steps only.
+# Backward time runs from the output gradient to the last input or
+# parameter gradient of the block. Call step() once per training step; it
+# returns True after |steps| steps, when table()/save_json() report the
+# per-step averages.
+def _conv_flops(m, input, output):
+    if isinstance(m, nn.modules.conv._ConvTransposeNd):
+        return 2 * input.numel() * m.out_channels // m.groups * int(np.prod(m.kernel_size))
+    return 2 * output.numel() * m.in_channels // m.groups * int(np.prod(m.kernel_size))
+
+
+def _nbytes(output):
+    if torch.is_tensor(output):
+        return output.numel() * output.element_size()
+    if isinstance(output, (list, tuple)):
+        return sum(_nbytes(o) for o in output)
+    return 0
+
+
+def _profiled_units(net, net_name):
+    units = OrderedDict()
+    if isinstance(net, NLayerDiscriminator):
+        for i, layer in enumerate(net.model):
+            units[layer] = '%s.layer%d.%s' % (net_name, i, type(layer).__name__)
+        return units
+    level = 0
+    for path, m in net.named_modules():
+        if isinstance(m, UnetSkipConnectionBlock):
+            units[m] = '%s.unet%d' % (net_name, level)
+            level += 1
+        elif isinstance(m, ResnetBlock):
+            units[m] = '%s.%s' % (net_name, path)
+    return units
+
+
+class LayerProfiler():
+    def __init__(self, nets, steps=10):
+        self.steps = steps
+        self.num_steps = 0
+        self.units = OrderedDict()
+        self.parent = {}
+        self.stats = {}
+        self.frames = []      # [unit, start, allocated, peak] of running forwards
+        self.pending = {}     # [start, end] of the step's backward calls
+        self.active = {}
+        self.handles = []
+        owner = {}
+        for net_name, net in nets.items():
+            units = _profiled_units(net, net_name)
+            self.units.update(units)
+            # modules() is preorder, so inner units take over their modules
+            for unit in units:
+                self.parent[unit] = owner.get(unit)
+                for m in unit.modules():
+                    owner[m] = unit
+        for unit in self.units:
+            self.stats[unit] = {'calls': 0, 'forward': 0., 'backward': 0., 'bytes': 0, 'flops': 0,
+                                'kept': 0, 'peak': 0}
+            self.handles.append(unit.register_forward_pre_hook(functools.partial(self.pre_forward, unit)))
+            self.handles.append(unit.register_forward_hook(functools.partial(self.post_forward, unit)))
+        for m, unit in owner.items():
+            if isinstance(m, nn.modules.conv._ConvNd):
+                self.handles.append(m.register_forward_hook(functools.partial(self.count_flops, unit)))
+            for param in m.parameters(recurse=False):
+                if param.requires_grad:
+                    self.handles.append(param.register_hook(functools.partial(self.backward_end, unit)))
+
+    def now(self, tensor):
+        if torch.is_tensor(tensor) and tensor.is_cuda:
+            torch.cuda.synchronize(tensor.device)
+        return time.perf_counter()
+
+    # folds the peak since the last reset into every running forward
+    def observe_peak(self, device):
+        peak = torch.cuda.max_memory_allocated(device)
+        for frame in self.frames:
+            frame[3] = max(frame[3], peak)
+        torch.cuda.reset_peak_memory_stats(device)
+
+    def pre_forward(self, unit, module, inputs):
+        x = inputs[0]
+        allocated = 0
+        if x.is_cuda:
+            self.observe_peak(x.device)
+            allocated = torch.cuda.memory_allocated(x.device)
+        if torch.is_grad_enabled() and x.requires_grad:
+            x.register_hook(functools.partial(self.backward_end, unit))
+        self.frames.append([unit, self.now(x), allocated, allocated])
+
+    def post_forward(self, unit, module, inputs, output):
+        end = self.now(output)
+        frame = self.frames.pop()
+        stats = self.stats[unit]
+        stats['calls'] += 1
+        stats['forward'] += end - frame[1]
+        stats['bytes'] += _nbytes(output)
+        if output.is_cuda:
+            self.observe_peak(output.device)
+            stats['kept'] += torch.cuda.memory_allocated(output.device) - frame[2]
+            stats['peak'] = max(stats['peak'], frame[3] - frame[2])
+        if torch.is_grad_enabled() and output.requires_grad:
+            call = [None, None]
+            self.pending.setdefault(unit, []).append(call)
+            output.register_hook(functools.partial(self.backward_start, unit, call))
+
+    def count_flops(self, unit, module, inputs, output):
+        self.stats[unit]['flops'] += _conv_flops(module, inputs[0], output)
+
+    def backward_start(self, unit, call, grad):
+        call[0] = self.now(grad)
+        self.active[unit] = call
+
+    # backward calls run in reverse order of the forwards, so a gradient
+    # belongs to the call whose backward started last
+    def backward_end(self, unit, grad):
+        call = self.active.get(unit)
+        if call is not None:
+            call[1] = self.now(grad)
+
+    def step(self):
+        for unit, calls in self.pending.items():
+            self.stats[unit]['backward'] += sum(end - start for start, end in calls
+                                                if start is not None and end is not None)
+        self.pending = {}
+        self.active = {}
+        self.num_steps += 1
+        return self.num_steps >= self.steps
+
+    # per-step averages, in the order of the networks' modules
+    def report(self):
+        steps = max(self.num_steps, 1)
+        children = {}
+        for unit, parent in self.parent.items():
+            if parent is not None:
+                children.setdefault(parent, []).append(unit)
+        rows = []
+        for unit, name in self.units.items():
+            stats = self.stats[unit]
+            nested = [self.stats[child] for child in children.get(unit, [])]
+            rows.append(OrderedDict([
+                ('name', name),
+                ('calls', stats['calls'] / float(steps)),
+                ('forward_ms', stats['forward'] * 1e3 / steps),
+                ('backward_ms', stats['backward'] * 1e3 / steps),
+                ('self_forward_ms', (stats['forward'] - sum(c['forward'] for c in nested)) * 1e3 / steps),
+                ('self_backward_ms', (stats['backward'] - sum(c['backward'] for c in nested)) * 1e3 / steps),
+                ('activation_mb', stats['bytes'] / 2. ** 20 / steps),
+                ('gflops', stats['flops'] / 1e9 / steps),
+                ('kept_mb', stats['kept'] / 2. ** 20 / steps),
+                ('peak_mb', stats['peak'] / 2. ** 20),
+            ]))
+        return rows
+
+    def table(self):
+        columns = ['calls', 'forward_ms', 'backward_ms', 'self_forward_ms', 'self_backward_ms',
+                   'activation_mb', 'gflops', 'kept_mb', 'peak_mb']
+        rows = self.report()
+        width = max([len(row['name']) for row in rows] + [5])
+        lines = ['%-*s ' % (width, 'layer') + ' '.join('%16s' % c for c in columns)]
+        for row in rows:
+            lines.append('%-*s ' % (width, row['name']) + ' '.join('%16.2f' % row[c] for c in columns))
+        lines.append('averaged over %d steps' % self.num_steps)
+        return '\n'.join(lines)
+
+    def save_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'steps': self.num_steps, 'layers': self.report()}, f, indent=1)
+
+    def remove(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+
+def _feather_weight(length, overlap):
+    weight = torch.ones(length)
+    if overlap > 0:
+        ramp = torch.arange(1, overlap + 1).float() / (overlap + 1)
+        weight[:overlap] = ramp
+        weight[-overlap:] = torch.min(weight[-overlap:], ramp.flip(0))
+    return weight
+
+
+def _tile_starts(size, tile_size, stride):
+    starts = list(range(0, size - tile_size, stride))
+    starts.append(size - tile_size)
+    return starts
+
+
+# Splits the last two (spatial) dims of |input| into overlapping
+# tile_size x tile_size tiles, runs them through |net| tile_batch tiles at a
+# time and feathers the outputs back together with linear ramps over the
+# overlap. Runs without autograd, so peak activation memory is bounded by
+# tile_batch, not by frame size.
+@torch.no_grad()
+def tiled_forward(net, input, tile_size=256, overlap=32, tile_batch=4):
+    H, W = input.size(-2), input.size(-1)
+    if H <= tile_size and W <= tile_size:
+        return net(input)
+    assert(0 <= overlap < tile_size)
+
+    # frames smaller than a tile along one axis are padded up to it
+    pad_h, pad_w = max(0, tile_size - H), max(0, tile_size - W)
+    if pad_h or pad_w:
+        input = nn.functional.pad(input, (0, pad_w, 0, pad_h), mode='replicate')
+    stride = tile_size - overlap
+    coords = [(y, x) for y in _tile_starts(input.size(-2), tile_size, stride)
+              for x in _tile_starts(input.size(-1), tile_size, stride)]
+    weight = _feather_weight(tile_size, overlap)
+    weight = (weight.view(-1, 1) * weight.view(1, -1)).type_as(input)
+
+    n = input.size(0)
+    output, norm = None, None
+    for i in range(0, len(coords), tile_batch):
+        chunk = coords[i:i + tile_batch]
+        tiles = torch.cat([input[..., y:y + tile_size, x:x + tile_size] for y, x in chunk], 0)
+        result = net(tiles)
+        if output is None:
+            out_shape = list(result.size())
+            out_shape[0] = n
+            out_shape[-2:] = input.size()[-2:]
+            output = result.new(*out_shape).zero_()
+            norm = result.new(input.size(-2), input.size(-1)).zero_()
+        for j, (y, x) in enumerate(chunk):
+            output[..., y:y + tile_size, x:x + tile_size] += result[j * n:(j + 1) * n] * weight
+            norm[y:y + tile_size, x:x + tile_size] += weight
+    output /= norm
+    return output[..., :H, :W]
+
+
+# |num_windows| random sub-clips of |window_len| frames, optionally cropped
+# to random crop x crop patches, of 5D clips of |size|. Returned as slices
+# so the same windows can be cut from several tensors with crop_windows.
+def sample_windows(size, num_windows, window_len, crop=0):
+    depth, height, width = size[2], size[3], size[4]
+    length = min(window_len, depth)
+    crop_h = min(crop, height) if crop > 0 else height
+    crop_w = min(crop, width) if crop > 0 else width
+    windows = []
+    for _ in range(num_windows):
+        t = np.random.randint(0, depth - length + 1)
+        y = np.random.randint(0, height - crop_h + 1)
+        x = np.random.randint(0, width - crop_w + 1)
+        windows.append((slice(t, t + length), slice(y, y + crop_h), slice(x, x + crop_w)))
+    return windows
+
+
+# stacks the |windows| of |input| along the batch dimension
+def crop_windows(input, windows):
+    return torch.cat([input[:, :, t, y, x] for t, y, x in windows], 0)
+
+
+# Inference-time graph optimization. Folds eval-mode batch norm into the
+# preceding Conv/ConvTranspose, drops Dropout (a no-op in eval), and picks
+# the faster of contiguous / channels_last memory formats when an |example|
+# input is given. Returns |net| in eval mode; use check_equivalence against
+# a copy of the original to verify the result.
+_FOLDABLE_CONVS = (nn.Conv2d, nn.Conv3d, nn.ConvTranspose2d, nn.ConvTranspose3d)
+_FOLDABLE_NORMS = (nn.BatchNorm2d, nn.BatchNorm3d)
+
+
+def fold_conv_norm(conv, norm):
+    scale = torch.rsqrt(norm.running_var + norm.eps)
+    if norm.affine:
+        scale = scale * norm.weight.data
+    shift = -norm.running_mean * scale
+    if norm.affine:
+        shift = shift + norm.bias.data
+
+    folded = copy.deepcopy(conv)
+    weight = conv.weight.data
+    # ConvTranspose weights are (in, out, ...), Conv weights (out, in, ...)
+    out_dim = 1 if isinstance(conv, (nn.ConvTranspose2d, nn.ConvTranspose3d)) else 0
+    shape = [1] * weight.dim()
+    shape[out_dim] = -1
+    folded.weight = nn.Parameter(weight * scale.view(shape))
+    bias = conv.bias.data if conv.bias is not None else torch.zeros_like(scale)
+    folded.bias = nn.Parameter(bias * scale + shift)
+    return folded
+
+
+def _optimize_sequential(seq):
+    layers = list(seq.children())
+    optimized = []
+    i = 0
+    while i < len(layers):
+        layer = layers[i]
+        following = layers[i + 1] if i + 1 < len(layers) else None
+        if isinstance(layer, _FOLDABLE_CONVS) and isinstance(following, _FOLDABLE_NORMS) \
+                and following.running_mean is not None:
+            optimized.append(fold_conv_norm(layer, following))
+            i += 2
+            continue
+        if not isinstance(layer, nn.Dropout):
+            optimized.append(layer)
+        i += 1
+    seq._modules = OrderedDict((str(j), m) for j, m in enumerate(optimized))
+
+
+def _channels_last_format(example):
+    return torch.channels_last_3d if example.dim() == 5 else torch.channels_last
+
+
+def _time_forward(net, example, runs=3):
+    with torch.no_grad():
+        net(example)
+        start = time.time()
+        for i in range(runs):
+            net(example)
+    return (time.time() - start) / runs
+
+
+def optimize_for_inference(net, example=None, memory_format=None):
+    net.eval()
+    for m in list(net.modules()):
+        if isinstance(m, nn.Sequential):
+            _optimize_sequential(m)
+    net.memory_format = torch.contiguous_format
+    if memory_format is not None:
+        # chosen before, e.g. for the running copy of a reloaded network
+        net.to(memory_format=memory_format)
+        net.memory_format = memory_format
+    elif example is not None:
+        t_contiguous = _time_forward(net, example)
+        fmt = _channels_last_format(example)
+        net.to(memory_format=fmt)
+        t_channels_last = _time_forward(net, example.contiguous(memory_format=fmt))
+        if t_channels_last < t_contiguous:
+            net.memory_format = fmt
+        else:
+            net.to(memory_format=torch.contiguous_format)
+        print('inference memory format: %s (contiguous %.4fs, channels_last %.4fs)' %
+              (net.memory_format, t_contiguous, t_channels_last))
+    return net
+
+
+# max abs difference between |reference| and |optimized| outputs on |input|
+def check_equivalence(reference, optimized, input, atol=1e-4):
+    reference.eval()
+    optimized.eval()
+    with torch.no_grad():
+        expected = reference(input)
+        output = optimized(input.contiguous(memory_format=getattr(optimized, 'memory_format', torch.contiguous_format)))
+    diff = float((output - expected).abs().max())
+    print('optimized network max abs diff: %.2e (atol %.0e)' % (diff, atol))
+    return diff <= atol, diff
+
+
 ##############################################################################
 # Classes
 ##############################################################################
 
 
+class _SplitBatchNorm(object):
+    def forward(self, input):
+        return torch.cat([super(_SplitBatchNorm, self).forward(chunk)
+                          for chunk in input.chunk(self.split_chunks, 0)], 0)
+
+
+_split_classes = {}
+
+
+# Within the block, the batch norm layers of |net| split their input batch
+# into |chunks| equal parts and normalize (and update running statistics
+# with) each part separately: one forward pass over stacked inputs behaves
+# like one pass per input. Swaps the class rather than the forward method so
+# data_parallel replicas, which then split their own slice, keep working.
+class split_batch_norm():
+    def __init__(self, net, chunks):
+        self.net = net
+        self.chunks = chunks
+        self.patched = []
+
+    def __enter__(self):
+        for m in self.net.modules():
+            if isinstance(m, nn.modules.batchnorm._BatchNorm) and not isinstance(m, _SplitBatchNorm):
+                cls = type(m)
+                if cls not in _split_classes:
+                    _split_classes[cls] = type('Split' + cls.__name__, (_SplitBatchNorm, cls), {})
+                m.__class__ = _split_classes[cls]
+                m.split_chunks = self.chunks
+                self.patched.append((m, cls))
+        return self.net
+
+    def __exit__(self, *args):
+        for m, cls in self.patched:
+            m.__class__ = cls
+            del m.split_chunks
+        self.patched = []
+
+
 # Defines the GAN loss which uses either LSGAN or the regular GAN.
 # When LSGAN is used, it is basically same as MSELoss,
 # but it abstracts away the need to create the target label tensor
@@ -177,26 +604,20 @@ class GANLoss(nn.Module):
             self.loss = nn.BCELoss()
 
     def get_target_tensor(self, input, target_is_real):
-        target_tensor = None
-        if target_is_real:
-            create_label = ((self.real_label_var is None) or
-                            (self.real_label_var.numel() != input.numel()))
-            if create_label:
-                real_tensor = self.Tensor(input.size()).fill_(self.real_label)
-                self.real_label_var = Variable(real_tensor, requires_grad=False)
-            target_tensor = self.real_label_var
-        else:
-            create_label = ((self.fake_label_var is None) or
-                            (self.fake_label_var.numel() != input.numel()))
-            if create_label:
-                fake_tensor = self.Tensor(input.size()).fill_(self.fake_label)
-                self.fake_label_var = Variable(fake_tensor, requires_grad=False)
-            target_tensor = self.fake_label_var
-        return target_tensor
+        # single element labels broadcast to the shape of the prediction,
+        # so no label tensor is allocated whatever the size of the input
+        if self.real_label_var is None:
+            self.real_label_var = Variable(self.Tensor(1).fill_(self.real_label), requires_grad=False)
+            self.fake_label_var = Variable(self.Tensor(1).fill_(self.fake_label), requires_grad=False)
+        target_tensor = self.real_label_var if target_is_real else self.fake_label_var
+        return target_tensor.expand_as(input)
 
     def __call__(self, input, target_is_real):
         target_tensor = self.get_target_tensor(input, target_is_real)
-        return self.loss(input, target_tensor)
+        # the loss is always computed in fp32: BCELoss is not autocast safe,
+        # and a half precision D output would lose the small differences
+        with torch.autocast(input.device.type, enabled=False):
+            return self.loss(input.float(), target_tensor)
 
 
 # Defines the generator that consists of Resnet blocks between a few
@@ -304,20 +725,37 @@ class ResnetBlock(nn.Module):
 # at the bottleneck
 
 ## 3D Change
+# Per-level channel counts of a U-Net, outermost level first: 'inner' are the
+# downconv outputs, 'outer' the upconv outputs (outer[0] is output_nc).
+# Pruned generators (models/pruning.py) pass their own.
+def unet_channels(output_nc, num_downs, ngf=64):
+    inner = [ngf * min(2**level, 8) for level in range(num_downs)]
+    outer = [output_nc] + inner[:-1]
+    return {'inner': inner, 'outer': outer}
+
+
 class UnetGenerator(nn.Module):
     def __init__(self, input_nc, output_nc, num_downs, ngf=64,
-                 norm_layer=nn.BatchNorm3d, use_dropout=False, gpu_ids=[]):
+                 norm_layer=nn.BatchNorm3d, use_dropout=False, gpu_ids=[], use_2plus1d=False, channels=None):
         super(UnetGenerator, self).__init__()
         self.gpu_ids = gpu_ids
-
-        # construct unet structure
-        unet_block = UnetSkipConnectionBlock(ngf * 8, ngf * 8, input_nc=None, submodule=None, norm_layer=norm_layer, innermost=True)
-        for i in range(num_downs - 5):
-            unet_block = UnetSkipConnectionBlock(ngf * 8, ngf * 8, input_nc=None, submodule=unet_block, norm_layer=norm_layer, use_dropout=use_dropout)
-        unet_block = UnetSkipConnectionBlock(ngf * 4, ngf * 8, input_nc=None, submodule=unet_block, norm_layer=norm_layer)
-        unet_block = UnetSkipConnectionBlock(ngf * 2, ngf * 4, input_nc=None, submodule=unet_block, norm_layer=norm_layer)
-        unet_block = UnetSkipConnectionBlock(ngf, ngf * 2, input_nc=None, submodule=unet_block, norm_layer=norm_layer)
-        unet_block = UnetSkipConnectionBlock(output_nc, ngf, input_nc=input_nc, submodule=unet_block, outermost=True, norm_layer=norm_layer)
+        if channels is None:
+            channels = unet_channels(output_nc, num_downs, ngf)
+        inner, outer = channels['inner'], channels['outer']
+        assert(len(inner) == num_downs and len(outer) == num_downs)
+
+        # construct unet structure, innermost level first; the ngf * 8
+        # levels between the fourth and the innermost one get dropout
+        unet_block = None
+        for level in reversed(range(num_downs)):
+            outermost, innermost = level == 0, level == num_downs - 1
+            up_input_nc = inner[level] if innermost else inner[level] + outer[level + 1]
+            unet_block = UnetSkipConnectionBlock(outer[level], inner[level],
+                                                 input_nc=input_nc if outermost else inner[level - 1],
+                                                 submodule=unet_block, outermost=outermost, innermost=innermost,
+                                                 norm_layer=norm_layer,
+                                                 use_dropout=use_dropout and 4 <= level < num_downs - 1,
+                                                 use_2plus1d=use_2plus1d, up_input_nc=up_input_nc)
 
         self.model = unet_block
 
@@ -327,6 +765,34 @@ class UnetGenerator(nn.Module):
         else:
             return self.model(input)
 
+    # skip connection blocks, outermost first
+    def blocks(self):
+        blocks = []
+        block = self.model
+        while block is not None:
+            blocks.append(block)
+            block = block.submodule()
+        return blocks
+
+
+# Convolutions of one U-Net level. The (2+1)D layout factorizes each
+# [3,4,4] kernel into a spatial [1,4,4] (strided) and a temporal [3,1,1] conv.
+def unet_down_conv(input_nc, inner_nc, use_bias, use_2plus1d=False):
+    if use_2plus1d:
+        return [nn.Conv3d(input_nc, inner_nc, kernel_size=[1,4,4], stride=(1,2,2), padding=(0,1,1), bias=use_bias),
+                nn.Conv3d(inner_nc, inner_nc, kernel_size=[3,1,1], padding=(1,0,0), bias=use_bias)]
+    return [nn.Conv3d(input_nc, inner_nc, kernel_size=[3,4,4],
+                      stride=(1,2,2), padding=1, bias=use_bias)]
+
+
+def unet_up_conv(inner_nc, outer_nc, use_bias, use_2plus1d=False):
+    if use_2plus1d:
+        return [nn.ConvTranspose3d(inner_nc, outer_nc, kernel_size=[1,4,4], stride=(1,2,2), padding=(0,1,1), bias=use_bias),
+                nn.Conv3d(outer_nc, outer_nc, kernel_size=[3,1,1], padding=(1,0,0), bias=use_bias)]
+    return [nn.ConvTranspose3d(inner_nc, outer_nc,
+                               kernel_size=[3,4,4], stride=(1,2,2),
+                               padding=1, bias=use_bias)]
+
 
 # Defines the submodule with skip connection.
 # X -------------------identity---------------------- X
@@ -335,7 +801,8 @@ class UnetGenerator(nn.Module):
 ## 3D Change
 class UnetSkipConnectionBlock(nn.Module):
     def __init__(self, outer_nc, inner_nc, input_nc=None,
-                 submodule=None, outermost=False, innermost=False, norm_layer=nn.BatchNorm3d, use_dropout=False):
+                 submodule=None, outermost=False, innermost=False, norm_layer=nn.BatchNorm3d, use_dropout=False,
+                 use_2plus1d=False, up_input_nc=None):
         super(UnetSkipConnectionBlock, self).__init__()
         self.outermost = outermost
         if type(norm_layer) == functools.partial:
@@ -344,35 +811,28 @@ class UnetSkipConnectionBlock(nn.Module):
             use_bias = norm_layer == nn.InstanceNorm3d
         if input_nc is None:
             input_nc = outer_nc
-        kw = [3,4,4]
-        s = (1,2,2)
-        downconv = nn.Conv3d(input_nc, inner_nc, kernel_size=kw,
-                             stride=s, padding=1, bias=use_bias)
+        if up_input_nc is None:
+            up_input_nc = inner_nc if innermost else inner_nc * 2
+        downconv = unet_down_conv(input_nc, inner_nc, use_bias, use_2plus1d)
         downrelu = nn.LeakyReLU(0.2, True)
         downnorm = norm_layer(inner_nc)
         uprelu = nn.ReLU(True)
         upnorm = norm_layer(outer_nc)
 
         if outermost:
-            upconv = nn.ConvTranspose3d(inner_nc * 2, outer_nc,
-                                        kernel_size=kw, stride=s,
-                                        padding=1)
-            down = [downconv]
-            up = [uprelu, upconv, nn.Tanh()]
+            upconv = unet_up_conv(up_input_nc, outer_nc, True, use_2plus1d)
+            down = downconv
+            up = [uprelu] + upconv + [nn.Tanh()]
             model = down + [submodule] + up
         elif innermost:
-            upconv = nn.ConvTranspose3d(inner_nc, outer_nc,
-                                        kernel_size=kw, stride=s,
-                                        padding=1, bias=use_bias)
-            down = [downrelu, downconv]
-            up = [uprelu, upconv, upnorm]
+            upconv = unet_up_conv(up_input_nc, outer_nc, use_bias, use_2plus1d)
+            down = [downrelu] + downconv
+            up = [uprelu] + upconv + [upnorm]
             model = down + up
         else:
-            upconv = nn.ConvTranspose3d(inner_nc * 2, outer_nc,
-                                        kernel_size=kw, stride=s,
-                                        padding=1, bias=use_bias)
-            down = [downrelu, downconv, downnorm]
-            up = [uprelu, upconv, upnorm]
+            upconv = unet_up_conv(up_input_nc, outer_nc, use_bias, use_2plus1d)
+            down = [downrelu] + downconv + [downnorm]
+            up = [uprelu] + upconv + [upnorm]
 
             if use_dropout:
                 model = down + [submodule] + up + [nn.Dropout(0.5)]
@@ -381,6 +841,12 @@ class UnetSkipConnectionBlock(nn.Module):
 
         self.model = nn.Sequential(*model)
 
+    def submodule(self):
+        for m in self.model.children():
+            if isinstance(m, UnetSkipConnectionBlock):
+                return m
+        return None
+
     def forward(self, x):
         if self.outermost:
             return self.model(x)
@@ -401,47 +867,61 @@ class UnetSkipConnectionBlock(nn.Module):
           :math:`W_{out} = (W_{in} - 1) * stride[2] - 2 * padding[2] + kernel\_size[2] + output\_padding[2]`
 '''
 
+# Smallest height/width an NLayerDiscriminator with |n_layers| stride-2
+# convs (kernel 4, padding 1) followed by two stride-1 ones still scores
+# with at least one patch.
+def patchgan_min_size(n_layers):
+    def output_size(size):
+        for _ in range(n_layers):
+            size = (size - 2) // 2 + 1
+        return size - 2
+    size = 1
+    while output_size(size) < 1:
+        size += 1
+    return size
+
+
 # Defines the PatchGAN discriminator with the specified arguments.
 class NLayerDiscriminator(nn.Module):
-    def __init__(self, input_nc, ndf=64, n_layers=3, norm_layer=nn.BatchNorm3d, use_sigmoid=False, gpu_ids=[]):
+    def __init__(self, input_nc, ndf=64, n_layers=3, norm_layer=nn.BatchNorm3d, use_sigmoid=False, gpu_ids=[],
+                 channels=None):
         super(NLayerDiscriminator, self).__init__()
         self.gpu_ids = gpu_ids
         if type(norm_layer) == functools.partial:
             use_bias = norm_layer.func == nn.InstanceNorm3d
         else:
             use_bias = norm_layer == nn.InstanceNorm3d
+        # output channels of the n_layers + 1 hidden convs; pruned
+        # discriminators (models/pruning.py) pass their own
+        if channels is None:
+            channels = [ndf * min(2**n, 8) for n in range(n_layers + 1)]
+        assert(len(channels) == n_layers + 1)
 
         ## TODO: D kernel 4
         kw = [3,4,4]
         padw = 1
         s = [1,2,2]
         sequence = [
-            nn.Conv3d(input_nc, ndf, kernel_size=kw, stride=(1,2,2), padding=padw),
+            nn.Conv3d(input_nc, channels[0], kernel_size=kw, stride=(1,2,2), padding=padw),
             nn.LeakyReLU(0.2, True)
         ]
 
-        nf_mult = 1
-        nf_mult_prev = 1
         for n in range(1, n_layers):
-            nf_mult_prev = nf_mult
-            nf_mult = min(2**n, 8)
             sequence += [
-                nn.Conv3d(ndf * nf_mult_prev, ndf * nf_mult,
+                nn.Conv3d(channels[n - 1], channels[n],
                           kernel_size=kw, stride=(1,2,2), padding=padw, bias=use_bias),
-                norm_layer(ndf * nf_mult),
+                norm_layer(channels[n]),
                 nn.LeakyReLU(0.2, True)
             ]
 
-        nf_mult_prev = nf_mult
-        nf_mult = min(2**n_layers, 8)
         sequence += [
-            nn.Conv3d(ndf * nf_mult_prev, ndf * nf_mult,
+            nn.Conv3d(channels[n_layers - 1], channels[n_layers],
                       kernel_size=kw, stride=1, padding=padw, bias=use_bias),
-            norm_layer(ndf * nf_mult),
+            norm_layer(channels[n_layers]),
             nn.LeakyReLU(0.2, True)
         ]
 
-        sequence += [nn.Conv3d(ndf * nf_mult, 1, kernel_size=kw, stride=1, padding=padw)]
+        sequence += [nn.Conv3d(channels[n_layers], 1, kernel_size=kw, stride=1, padding=padw)]
 
         if use_sigmoid:
             sequence += [nn.Sigmoid()]
@@ -4,9 +4,10 @@ import os
 from collections import OrderedDict
 from torch.autograd import Variable
 import util.util as util
-# from util.image_pool import ImagePool
+from util.image_pool import ImagePool
 from .base_model import BaseModel
 from . import networks
+from . import pruning
 
 
 class Pix2PixModel(BaseModel):
@@ -19,43 +20,49 @@ class Pix2PixModel(BaseModel):
         self.isTrain = opt.isTrain
         # define tensors
         # 3D tensor shape (N,Cin,Din,Hin,Win)
-        self.input_A = self.Tensor(opt.batchSize, opt.input_nc,
-                                   opt.depth, opt.fineSize, opt.fineSize)
-        self.input_B = self.Tensor(opt.batchSize, opt.output_nc,
-                                   opt.depth, opt.fineSize, opt.fineSize)
+        # A and B are channel views of one persistent device buffer, so the
+        # real pair fed to netD needs no concatenation
+        self.allocate_inputs((opt.batchSize, opt.input_nc + opt.output_nc,
+                              opt.depth, opt.fineSize, opt.fineSize))
 
         # load/define networks
-        self.netG = networks.define_G(opt.input_nc, opt.output_nc, opt.ngf, # of gen filters in first conv layer
-                                      opt.which_model_netG, opt.norm, not opt.no_dropout, opt.init_type, self.gpu_ids)
+        # --prune_spec holds the channel counts of pruned networks
+        spec = pruning.load_spec(opt.prune_spec) if opt.prune_spec else {}
+        self.netG = self.define_G(spec.get('G'))
         if self.isTrain:
-            use_sigmoid = opt.no_lsgan
-            self.netD = networks.define_D(opt.input_nc + opt.output_nc, opt.ndf,
-                                          opt.which_model_netD,
-                                          opt.n_layers_D, opt.norm, use_sigmoid, opt.init_type, self.gpu_ids)
+            self.netD = self.define_D(spec.get('D'))
+            if opt.prune_ratio > 0 and not opt.prune_spec:
+                # fail now rather than at --prune_at
+                pruning.check_criterion(self.netG, opt.prune_criterion)
+                pruning.check_criterion(self.netD, opt.prune_criterion)
+            if opt.d_windows > 0 and 0 < opt.d_crop < opt.fineSize:
+                n_layers = 3 if opt.which_model_netD == 'basic' else opt.n_layers_D
+                min_crop = networks.patchgan_min_size(n_layers)
+                if opt.d_crop < min_crop:
+                    raise ValueError('--d_crop %d is too small for the %d stride-2 layers of netD, use at least %d' %
+                                     (opt.d_crop, n_layers, min_crop))
         if not self.isTrain or opt.continue_train:
             self.load_network(self.netG, 'G', opt.which_epoch)
             if self.isTrain:
                 self.load_network(self.netD, 'D', opt.which_epoch)
+        self.netG = self.optimize_network(self.netG, 'G')
 
         if self.isTrain:
-            # 3D Change
-            # self.fake_AB_pool = ImagePool(opt.pool_size)
+            # 3D Change: the pool of fake clips is optional (--use_pool), see
+            # --pool_storage and --pool_max_mb for keeping it affordable
+            self.fake_AB_pool = ImagePool(opt.pool_size if opt.use_pool else 0,
+                                          opt.pool_storage, opt.pool_max_mb)
             self.old_lr = opt.lr
             # define loss functions
             self.criterionGAN = networks.GANLoss(use_lsgan=not opt.no_lsgan, tensor=self.Tensor)
             self.criterionL1 = torch.nn.L1Loss()
+            # netD update schedule, see d_step_due
+            self.num_steps = 0
+            self.num_D_steps = 0
+            self.steps_since_D = None
+            self.loss_D_avg = None
 
-            # initialize optimizers
-            self.schedulers = []
-            self.optimizers = []
-            self.optimizer_G = torch.optim.Adam(self.netG.parameters(),
-                                                lr=opt.lr, betas=(opt.beta1, 0.999))
-            self.optimizer_D = torch.optim.Adam(self.netD.parameters(),
-                                                lr=opt.lr, betas=(opt.beta1, 0.999))
-            self.optimizers.append(self.optimizer_G)
-            self.optimizers.append(self.optimizer_D)
-            for optimizer in self.optimizers:
-                self.schedulers.append(networks.get_scheduler(optimizer, opt))
+            self.init_optimizers()
 
         print('---------- Networks initialized -------------')
         networks.print_network(self.netG)
@@ -63,90 +70,233 @@ class Pix2PixModel(BaseModel):
             networks.print_network(self.netD)
         print('-----------------------------------------------')
 
+    # by default the weights are only initialized when they will not be
+    # loaded from a checkpoint (BaseModel.init_type)
+    def define_G(self, channels=None, init_type='auto'):
+        opt = self.opt
+        return networks.define_G(opt.input_nc, opt.output_nc, opt.ngf, # of gen filters in first conv layer
+                                 opt.which_model_netG, opt.norm, not opt.no_dropout,
+                                 self.init_type() if init_type == 'auto' else init_type, self.gpu_ids,
+                                 channels=channels)
+
+    def define_D(self, channels=None, init_type='auto'):
+        opt = self.opt
+        use_sigmoid = opt.no_lsgan
+        return networks.define_D(opt.input_nc + opt.output_nc, opt.ndf,
+                                 opt.which_model_netD,
+                                 opt.n_layers_D, opt.norm, use_sigmoid,
+                                 self.init_type() if init_type == 'auto' else init_type, self.gpu_ids,
+                                 channels=channels)
+
+    def init_optimizers(self):
+        opt = self.opt
+        self.schedulers = []
+        self.optimizers = []
+        self.optimizer_G = self.adam(self.netG.parameters())
+        self.optimizer_D = self.adam(self.netD.parameters())
+        self.optimizers.append(self.optimizer_G)
+        self.optimizers.append(self.optimizer_D)
+        for optimizer in self.optimizers:
+            self.schedulers.append(networks.get_scheduler(optimizer, opt))
+
+    # Structured channel pruning of netG and netD (see models/pruning.py).
+    # The activation and taylor criteria rank channels on the current input
+    # batch, taylor by the pix2pix generator and discriminator losses.
+    # The channel spec is written to [checkpoints_dir]/[name]/prune_spec.json;
+    # pass it as --prune_spec to load the pruned checkpoints later.
+    def prune(self, ratio, criterion='weight'):
+        params_before = pruning.count_parameters(self.netG) + pruning.count_parameters(self.netD)
+
+        def loss_G():
+            self.forward()
+            return self.compute_loss_G()
+
+        def loss_D():
+            pred_fake = self.netD(self.d_input(self.fake_AB.detach()))
+            pred_real = self.netD(self.d_input(self.input_AB))
+            return (self.criterionGAN(pred_fake, False) + self.criterionGAN(pred_real, True)) * 0.5
+
+        channels_G, keep_inner, keep_outer = pruning.plan_unet(self.netG, ratio, criterion,
+                                                               [Variable(self.input_A)], loss_G)
+        netG = self.define_G(channels_G, self.opt.init_type)
+        pruning.apply_unet(self.netG, netG, keep_inner, keep_outer)
+
+        # loss_D scores the fake pair loss_G made with the unpruned netG
+        channels_D, keep = pruning.plan_discriminator(self.netD, ratio, criterion, [self.input_AB], loss_D)
+        netD = self.define_D(channels_D, self.opt.init_type)
+        pruning.apply_discriminator(self.netD, netD, keep)
+
+        self.netG, self.netD = netG, netD
+        # the learning rate schedule carries on; the Adam moments start
+        # over, they do not match the pruned parameters
+        schedule = self.get_schedule()
+        self.init_optimizers()
+        self.set_schedule(schedule)
+
+        spec_path = os.path.join(self.save_dir, 'prune_spec.json')
+        pruning.save_spec(spec_path, {'G': channels_G, 'D': channels_D})
+        self.opt.prune_spec = spec_path
+        params_after = pruning.count_parameters(self.netG) + pruning.count_parameters(self.netD)
+        print('pruned %.0f%% of channels by %s: %d -> %d parameters, spec saved to %s' %
+              (ratio * 100, criterion, params_before, params_after, spec_path))
+
+    # (re)allocates the device input buffer, plus a pinned host staging
+    # buffer on the GPU so the upload can be asynchronous
+    def allocate_inputs(self, shape):
+        nc_A = self.opt.input_nc if self.opt.which_direction == 'AtoB' else self.opt.output_nc
+        self.input_AB = self.Tensor(*shape)
+        self.input_A = self.input_AB[:, :nc_A]
+        self.input_B = self.input_AB[:, nc_A:]
+        if self.gpu_ids:
+            self.host_AB = torch.empty(shape, pin_memory=True)
+            self.upload_done = torch.cuda.Event()
+        else:
+            self.host_AB = self.input_AB
+
     def set_input(self, input):
         AtoB = self.opt.which_direction == 'AtoB'
-        ## numpy to torch tensor
-        #input_A = input['A' if AtoB else 'B']
-        #input_B = input['B' if AtoB else 'A']
         input_A = torch.from_numpy(input['A' if AtoB else 'B'])
-
-        #print("======input A SIZE==== {0}".format(input_A.size()))
         input_B = torch.from_numpy(input['B' if AtoB else 'A'])
-        self.input_A.resize_(input_A.size()).copy_(input_A)
-        self.input_B.resize_(input_B.size()).copy_(input_B)
-        # convert to cuda
-        if torch.cuda.is_available():
-            self.input_A = self.input_A.cuda()
-            self.input_B = self.input_B.cuda()
+        shape = (input_A.size(0), input_A.size(1) + input_B.size(1)) + tuple(input_A.size()[2:])
+        if tuple(self.input_AB.size()) != shape:
+            self.allocate_inputs(shape)
+        if self.host_AB is not self.input_AB:
+            # the previous upload must be done before the staging buffer is reused
+            self.upload_done.synchronize()
+        self.host_AB[:, :input_A.size(1)].copy_(input_A)
+        self.host_AB[:, input_A.size(1):].copy_(input_B)
+        if self.host_AB is not self.input_AB:
+            self.input_AB.copy_(self.host_AB, non_blocking=True)
+            self.upload_done.record()
 
         self.image_paths = input['A_paths' if AtoB else 'B_paths']
 
     def forward(self):
-        self.real_A = Variable(self.input_A)
+        self.real_A = self.input_A
+        self.real_B = self.input_B
         self.fake_B = self.netG(self.real_A)
-        self.real_B = Variable(self.input_B)
-        #print('test batchsize',self.real_A.size())
+        # built once per step, shared by backward_D (detached) and compute_loss_G
+        self.fake_AB = torch.cat((self.real_A, self.fake_B), 1)
+        if self.isTrain and self.opt.d_windows > 0:
+            self.windows = networks.sample_windows(self.fake_AB.size(), self.opt.d_windows,
+                                                   self.opt.d_window_len, self.opt.d_crop)
+
+    # with --d_windows, netD scores the step's random sub-windows of the
+    # clip pairs, stacked along the batch, instead of whole clips. The GAN
+    # losses average over all windows, so they keep their scale.
+    def d_input(self, AB):
+        if self.opt.d_windows > 0:
+            return networks.crop_windows(AB, self.windows)
+        return AB
 
     # no backprop gradients
     def test(self):
-        self.real_A = Variable(self.input_A, volatile=True)
+        self.real_A = self.input_A
         #print("===================={0}".format(self.real_A))
-        self.fake_B = self.netG(self.real_A)
-        self.real_B = Variable(self.input_B, volatile=True)
+        with torch.no_grad(), self.autocast():
+            self.fake_B = self.run_tiled(self.netG, self.real_A).float()
+        self.real_B = self.input_B
 
     # get image paths
     def get_image_paths(self):
         return self.image_paths
 
     def backward_D(self):
-        # Fake
-        # stop backprop to the generator by detaching fake_B
-        #fake_AB = self.fake_AB_pool.query(torch.cat((self.real_A, self.fake_B), 1).data)
-        fake_AB = torch.cat((self.real_A, self.fake_B), 1).data
-        fake_AB_ = Variable(fake_AB)
-        pred_fake = self.netD(fake_AB_.detach())
-        self.loss_D_fake = self.criterionGAN(pred_fake, False)
+        with self.autocast():
+            # Fake
+            # stop backprop to the generator by detaching fake_B
+            fake_AB = self.fake_AB_pool.query(self.fake_AB.detach())
+            pred_fake = self.netD(self.d_input(fake_AB))
+            self.loss_D_fake = self.criterionGAN(pred_fake, False)
 
-        # Real
-        real_AB = torch.cat((self.real_A, self.real_B), 1)
-        pred_real = self.netD(real_AB)
-        self.loss_D_real = self.criterionGAN(pred_real, True)
+            # Real
+            pred_real = self.netD(self.d_input(self.input_AB))
+            self.loss_D_real = self.criterionGAN(pred_real, True)
 
-        # Combined loss
-        self.loss_D = (self.loss_D_fake + self.loss_D_real) * 0.5
+            # Combined loss
+            self.loss_D = (self.loss_D_fake + self.loss_D_real) * 0.5
 
-        self.loss_D.backward()
+        self.backward(self.loss_D)
 
-    def backward_G(self):
+    def compute_loss_G(self):
         # First, G(A) should fake the discriminator
-        fake_AB = torch.cat((self.real_A, self.fake_B), 1)
-        pred_fake = self.netD(fake_AB)
+        pred_fake = self.netD(self.d_input(self.fake_AB))
         self.loss_G_GAN = self.criterionGAN(pred_fake, True)
 
         # Second, G(A) = B
         self.loss_G_L1 = self.criterionL1(self.fake_B, self.real_B) * self.opt.lambda_A
 
-        self.loss_G = self.loss_G_GAN + self.loss_G_L1
+        return self.loss_G_GAN + self.loss_G_L1
+
+    def backward_G(self):
+        with self.autocast():
+            self.loss_G = self.compute_loss_G()
+
+        self.backward(self.loss_G)
+
+    def get_training_state(self):
+        state = BaseModel.get_training_state(self)
+        state['D_schedule'] = {'num_steps': self.num_steps, 'num_D_steps': self.num_D_steps,
+                               'steps_since_D': self.steps_since_D, 'loss_D_avg': self.loss_D_avg}
+        return state
+
+    def set_training_state(self, state):
+        BaseModel.set_training_state(self, state)
+        for name, value in state['D_schedule'].items():
+            setattr(self, name, value)
 
-        self.loss_G.backward()
+    # netD is updated every --d_every steps. With --d_skip_below, updates
+    # are also skipped while the running average of loss_D stays below that
+    # value (D is winning), but at least every --d_max_skip steps. Non-D
+    # steps skip backward_D entirely, including the real pair forward.
+    def d_step_due(self):
+        opt = self.opt
+        if self.steps_since_D is None:
+            return True
+        if self.steps_since_D < opt.d_every:
+            return False
+        if opt.d_skip_below > 0 and self.loss_D_avg < opt.d_skip_below:
+            return opt.d_max_skip > 0 and self.steps_since_D >= opt.d_max_skip
+        return True
 
     def optimize_parameters(self):
-        self.forward()
+        with self.profile('G_forward'), self.autocast():
+            self.forward()
 
-        self.optimizer_D.zero_grad()
-        self.backward_D()
-        self.optimizer_D.step()
+        self.num_steps += 1
+        self.D_step = self.d_step_due()
+        if self.D_step:
+            self.optimizer_D.zero_grad(set_to_none=True)
+            with self.profile('D_backward'):
+                self.backward_D()
+            with self.profile('D_step'):
+                self.step(self.optimizer_D)
+            self.num_D_steps += 1
+            self.steps_since_D = 1
+            if self.opt.d_skip_below > 0:
+                loss_D = self.loss_D.item()
+                self.loss_D_avg = loss_D if self.loss_D_avg is None else 0.9 * self.loss_D_avg + 0.1 * loss_D
+        else:
+            self.steps_since_D += 1
+
+        self.optimizer_G.zero_grad(set_to_none=True)
+        with self.profile('G_backward'):
+            self.backward_G()
+        with self.profile('G_step'):
+            self.step(self.optimizer_G)
 
-        self.optimizer_G.zero_grad()
-        self.backward_G()
-        self.optimizer_G.step()
+        self.update_scale()
 
     def get_current_errors(self):
-        return OrderedDict([('G_GAN', self.loss_G_GAN.data[0]),
-                            ('G_L1', self.loss_G_L1.data[0]),
-                            ('D_real', self.loss_D_real.data[0]),
-                            ('D_fake', self.loss_D_fake.data[0])
-                            ])
+        errors = OrderedDict([('G_GAN', self.loss_G_GAN.item()),
+                              ('G_L1', self.loss_G_L1.item()),
+                              ('D_real', self.loss_D_real.item()),
+                              ('D_fake', self.loss_D_fake.item()),
+                              ('D_step', int(self.D_step)),
+                              ('D_rate', self.num_D_steps / float(self.num_steps))
+                              ])
+        errors.update(self.get_precision_stats())
+        return errors
 
     def get_current_visuals(self):
         if self.dataset_mode == 'v':
@@ -159,6 +309,15 @@ class Pix2PixModel(BaseModel):
             real_B = util.tensor2im(self.real_B.data)
         return OrderedDict([('real_A', real_A), ('fake_B', fake_B), ('real_B', real_B)])
 
+    # first clip of the batch as uint8 (T, H, W, C), converted on the
+    # device so only a quarter of the bytes cross to the host
+    def get_current_visual_tensors(self):
+        visuals = OrderedDict()
+        for name, clip in [('real_A', self.real_A), ('fake_B', self.fake_B), ('real_B', self.real_B)]:
+            clip = clip.data[0].float().add(1).mul_(127.5).clamp_(0, 255).to(torch.uint8)
+            visuals[name] = clip.permute(1, 2, 3, 0).cpu().numpy()
+        return visuals
+
     def save(self, label):
         self.save_network(self.netG, 'G', label, self.gpu_ids)
         self.save_network(self.netD, 'D', label, self.gpu_ids)
@@ -0,0 +1,236 @@
+import json
+import torch
+import torch.nn as nn
+
+# Structured channel pruning for UnetGenerator and NLayerDiscriminator.
+# Output channels of every Conv3d/ConvTranspose3d are ranked by importance
+# and the least important ones removed, consistently across the U-Net skip
+# concatenations, giving a smaller dense network that define_G / define_D
+# rebuild from a channel spec (see networks.unet_channels).
+#
+# importance criteria:
+#   weight:     L1 norm of each output filter, scaled by |gamma| of the
+#               following batch norm if there is one
+#   activation: mean |activation| of each channel on calibration inputs
+#   taylor:     first-order estimate of the loss change when a channel is
+#               removed, |sum of activation x gradient| over the channel,
+#               on a calibration batch
+# Normalization without an affine transform (the default --norm instance)
+# gives every channel unit variance and has no gamma, which leaves weight
+# and activation nothing to rank by; only taylor works with it.
+
+_CONVS = (nn.Conv3d, nn.ConvTranspose3d)
+_NORMS = (nn.BatchNorm3d, nn.InstanceNorm3d)
+
+
+# downconv/downnorm/upconv/upnorm of a (standard layout) skip block
+def block_layers(block):
+    layers = list(block.model.children())
+    found = {'downconv': None, 'downnorm': None, 'upconv': None, 'upnorm': None}
+    for i, layer in enumerate(layers):
+        following = layers[i + 1] if i + 1 < len(layers) else None
+        norm = following if isinstance(following, _NORMS) else None
+        if isinstance(layer, nn.Conv3d):
+            assert found['downconv'] is None, 'pruning does not support the (2+1)D layout'
+            found['downconv'], found['downnorm'] = layer, norm
+        elif isinstance(layer, nn.ConvTranspose3d):
+            found['upconv'], found['upnorm'] = layer, norm
+    return found
+
+
+def filter_importance(conv, norm=None):
+    weight = conv.weight.data.abs()
+    if isinstance(conv, nn.ConvTranspose3d):
+        importance = weight.transpose(0, 1).contiguous().view(weight.size(1), -1).sum(1)
+    else:
+        importance = weight.view(weight.size(0), -1).sum(1)
+    if norm is not None and getattr(norm, 'affine', False):
+        importance = importance * norm.weight.data.abs()
+    return importance.cpu()
+
+
+def check_criterion(net, criterion):
+    if criterion not in ('weight', 'activation', 'taylor'):
+        raise NotImplementedError('pruning criterion [%s] is not implemented' % criterion)
+    if criterion != 'taylor' and any(isinstance(m, nn.InstanceNorm3d) and not m.affine for m in net.modules()):
+        raise ValueError('pruning criterion [%s] cannot rank channels of instance norm layers without affine '
+                         'parameters, use taylor' % criterion)
+
+
+# mean |activation| per channel of each module in |modules| over |inputs|
+def activation_importance(net, modules, inputs):
+    sums = [None] * len(modules)
+
+    def make_hook(i):
+        def hook(module, input, output):
+            value = output.data.abs().transpose(0, 1).contiguous().view(output.size(1), -1).mean(1).cpu()
+            sums[i] = value if sums[i] is None else sums[i] + value
+        return hook
+
+    handles = [m.register_forward_hook(make_hook(i)) for i, m in enumerate(modules)]
+    # eval mode: no dropout noise in the ranking and no update of the batch
+    # norm running statistics by the calibration batches
+    training = net.training
+    net.eval()
+    try:
+        with torch.no_grad():
+            for input in inputs:
+                net(input)
+    finally:
+        net.train(training)
+        for handle in handles:
+            handle.remove()
+    return sums
+
+
+# Taylor importance per channel of each module in |modules|: the outputs
+# are multiplied by per sample and channel gates of 1, so the gradient of
+# the loss returned by |loss_fn| with respect to a gate is the activation x
+# gradient sum of that channel (the first-order loss change of zeroing it),
+# taken after the module's normalization. Absolute values are averaged over
+# the batch. Runs |net| in eval mode and clears the gradients afterwards.
+def taylor_importance(net, modules, loss_fn):
+    gates = [[] for _ in modules]
+
+    def make_hook(i):
+        def hook(module, input, output):
+            gate = output.new_ones(output.shape[:2] + (1,) * (output.dim() - 2)).requires_grad_()
+            # one gate per call, data_parallel replicas included
+            gates[i].append(gate)
+            return output * gate
+        return hook
+
+    handles = [m.register_forward_hook(make_hook(i)) for i, m in enumerate(modules)]
+    training = net.training
+    net.eval()
+    try:
+        loss_fn().backward()
+    finally:
+        net.train(training)
+        for handle in handles:
+            handle.remove()
+        net.zero_grad(set_to_none=True)
+    return [torch.cat([gate.grad.detach().float().view(gate.size(0), -1).cpu() for gate in module_gates]).abs().mean(0)
+            for module_gates in gates]
+
+
+def keep_indices(importance, ratio):
+    num_keep = max(1, int(round(importance.numel() * (1. - ratio))))
+    return importance.topk(num_keep)[1].sort()[0]
+
+
+def _copy_conv(old, new, in_idx, out_idx):
+    weight = old.weight.data
+    if isinstance(old, nn.ConvTranspose3d):
+        weight = weight.index_select(0, in_idx.to(weight.device)).index_select(1, out_idx.to(weight.device))
+    else:
+        weight = weight.index_select(0, out_idx.to(weight.device)).index_select(1, in_idx.to(weight.device))
+    new.weight.data.copy_(weight)
+    if old.bias is not None:
+        new.bias.data.copy_(old.bias.data.index_select(0, out_idx.to(weight.device)))
+
+
+def _copy_norm(old, new, idx):
+    if old is None:
+        return
+    for name in ('weight', 'bias', 'running_mean', 'running_var'):
+        src, dst = getattr(old, name, None), getattr(new, name, None)
+        if src is not None and dst is not None:
+            dst.data.copy_(src.data.index_select(0, idx.to(src.device)))
+
+
+def _all(n):
+    return torch.arange(n).long()
+
+
+# returns ({'inner': [...], 'outer': [...]}, keep_inner, keep_outer)
+# |inputs| are the calibration inputs of the activation criterion, |loss_fn|
+# computes the calibration loss of the taylor criterion
+def plan_unet(netG, ratio, criterion='weight', inputs=None, loss_fn=None):
+    check_criterion(netG, criterion)
+    blocks = [block_layers(b) for b in netG.blocks()]
+    if criterion in ('activation', 'taylor'):
+        modules = []
+        for layers in blocks:
+            modules.append(layers['downnorm'] or layers['downconv'])
+            modules.append(layers['upnorm'] or layers['upconv'])
+        if criterion == 'activation':
+            acts = activation_importance(netG, modules, inputs)
+        else:
+            acts = taylor_importance(netG, modules, loss_fn)
+        down_imp, up_imp = acts[0::2], acts[1::2]
+    else:
+        down_imp = [filter_importance(l['downconv'], l['downnorm']) for l in blocks]
+        up_imp = [filter_importance(l['upconv'], l['upnorm']) for l in blocks]
+
+    keep_inner = [keep_indices(imp, ratio) for imp in down_imp]
+    # the outermost upconv produces the image and is never pruned
+    keep_outer = [_all(blocks[0]['upconv'].out_channels)] + [keep_indices(imp, ratio) for imp in up_imp[1:]]
+    channels = {'inner': [len(k) for k in keep_inner], 'outer': [len(k) for k in keep_outer]}
+    return channels, keep_inner, keep_outer
+
+
+def apply_unet(old, new, keep_inner, keep_outer):
+    old_blocks, new_blocks = old.blocks(), new.blocks()
+    num_levels = len(old_blocks)
+    for level in range(num_levels):
+        o, n = block_layers(old_blocks[level]), block_layers(new_blocks[level])
+        in_idx = _all(o['downconv'].in_channels) if level == 0 else keep_inner[level - 1]
+        _copy_conv(o['downconv'], n['downconv'], in_idx, keep_inner[level])
+        _copy_norm(o['downnorm'], n['downnorm'], keep_inner[level])
+
+        if level == num_levels - 1:
+            up_in = keep_inner[level]
+        else:
+            # upconv input is cat([skip, submodule upconv output])
+            up_in = torch.cat([keep_inner[level], keep_outer[level + 1] + o['downconv'].out_channels])
+        _copy_conv(o['upconv'], n['upconv'], up_in, keep_outer[level])
+        _copy_norm(o['upnorm'], n['upnorm'], keep_outer[level])
+
+
+def _discriminator_layers(netD):
+    layers = list(netD.model.children())
+    convs = []
+    for i, layer in enumerate(layers):
+        if isinstance(layer, nn.Conv3d):
+            following = layers[i + 1] if i + 1 < len(layers) else None
+            convs.append((layer, following if isinstance(following, _NORMS) else None))
+    return convs
+
+
+# returns (channel list, keep indices per hidden conv)
+def plan_discriminator(netD, ratio, criterion='weight', inputs=None, loss_fn=None):
+    check_criterion(netD, criterion)
+    hidden = _discriminator_layers(netD)[:-1]
+    if criterion == 'activation':
+        importance = activation_importance(netD, [norm or conv for conv, norm in hidden], inputs)
+    elif criterion == 'taylor':
+        importance = taylor_importance(netD, [norm or conv for conv, norm in hidden], loss_fn)
+    else:
+        importance = [filter_importance(conv, norm) for conv, norm in hidden]
+    keep = [keep_indices(imp, ratio) for imp in importance]
+    return [len(k) for k in keep], keep
+
+
+def apply_discriminator(old, new, keep):
+    old_layers, new_layers = _discriminator_layers(old), _discriminator_layers(new)
+    in_idx = _all(old_layers[0][0].in_channels)
+    for i, ((o_conv, o_norm), (n_conv, n_norm)) in enumerate(zip(old_layers, new_layers)):
+        out_idx = keep[i] if i < len(keep) else _all(o_conv.out_channels)
+        _copy_conv(o_conv, n_conv, in_idx, out_idx)
+        _copy_norm(o_norm, n_norm, out_idx)
+        in_idx = out_idx
+
+
+def count_parameters(net):
+    return sum(p.numel() for p in net.parameters())
+
+
+def save_spec(path, spec):
+    with open(path, 'w') as f:
+        json.dump(spec, f, indent=2)
+
+
+def load_spec(path):
+    with open(path) as f:
+        return json.load(f)
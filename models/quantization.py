@@ -0,0 +1,98 @@
+import torch
+import torch.nn as nn
+
+# Post-training int8 quantization of generators for CPU inference.
+#
+# dynamic: Conv3d/ConvTranspose3d (and 2D) weights are stored as int8 and
+#          activations are quantized on the fly per batch; no calibration.
+# static:  FX graph mode quantization of netG.model; activation ranges are
+#          calibrated on sample clips, the whole graph then runs in int8.
+#
+# Quantized checkpoints are saved as a dict tagged with the mode, which
+# BaseModel.load_network recognizes and rebuilds transparently.
+
+QUANT_KEY = '__quantization__'
+
+
+def _dynamic_modules():
+    import torch.ao.nn.quantized.dynamic as nnqd
+    return {nn.Conv2d: nnqd.Conv2d, nn.Conv3d: nnqd.Conv3d,
+            nn.ConvTranspose2d: nnqd.ConvTranspose2d, nn.ConvTranspose3d: nnqd.ConvTranspose3d}
+
+
+def _input_nc(net):
+    for m in net.modules():
+        if isinstance(m, (nn.Conv2d, nn.Conv3d)):
+            return m.in_channels, m.weight.dim()
+    raise ValueError('network has no convolution layers')
+
+
+def _example_input(net):
+    input_nc, weight_dim = _input_nc(net)
+    if weight_dim == 5:
+        return torch.zeros(1, input_nc, 1, 8, 8)
+    return torch.zeros(1, input_nc, 8, 8)
+
+
+def set_backend(backend='fbgemm'):
+    torch.backends.quantized.engine = backend
+
+
+def quantize_dynamic(net):
+    from torch.ao.quantization import quantize_dynamic as _quantize_dynamic, default_dynamic_qconfig
+    mapping = _dynamic_modules()
+    qconfig_spec = dict((m, default_dynamic_qconfig) for m in mapping)
+    net.cpu().eval()
+    net.model = _quantize_dynamic(net.model, qconfig_spec, mapping=mapping)
+    net.gpu_ids = []
+    return net
+
+
+# inserts observers; run calibration clips through |net| afterwards
+def prepare_static(net, backend='fbgemm'):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx
+    set_backend(backend)
+    net.cpu().eval()
+    net.model = prepare_fx(net.model, get_default_qconfig_mapping(backend), (_example_input(net),))
+    net.gpu_ids = []
+    return net
+
+
+def convert_static(net):
+    from torch.ao.quantization.quantize_fx import convert_fx
+    net.model = convert_fx(net.model)
+    return net
+
+
+def quantize(net, mode, calibration=None, backend='fbgemm'):
+    if mode == 'dynamic':
+        set_backend(backend)
+        return quantize_dynamic(net)
+    elif mode == 'static':
+        prepare_static(net, backend)
+        with torch.no_grad():
+            for input in calibration or []:
+                net(input)
+        return convert_static(net)
+    raise NotImplementedError('quantization mode [%s] is not implemented' % mode)
+
+
+def quantized_state(net, mode, backend='fbgemm'):
+    return {QUANT_KEY: mode, 'backend': backend, 'state_dict': net.state_dict()}
+
+
+def is_quantized_state(obj):
+    return isinstance(obj, dict) and QUANT_KEY in obj
+
+
+# rebuilds the quantized structure on the fp32 |net| and loads the weights
+def load_quantized(net, obj):
+    mode, backend = obj[QUANT_KEY], obj['backend']
+    set_backend(backend)
+    if mode == 'dynamic':
+        quantize_dynamic(net)
+    else:
+        convert_static(prepare_static(net, backend))
+    net.load_state_dict(obj['state_dict'])
+    return net
@@ -1,4 +1,4 @@
-from torch.autograd import Variable
+import torch
 from collections import OrderedDict
 import util.util as util
 from .base_model import BaseModel
@@ -17,10 +17,11 @@ class TestModel(BaseModel):
         self.netG = networks.define_G(opt.input_nc, opt.output_nc,
                                       opt.ngf, opt.which_model_netG,
                                       opt.norm, not opt.no_dropout,
-                                      opt.init_type,
+                                      self.init_type(),
                                       self.gpu_ids)
         which_epoch = opt.which_epoch
         self.load_network(self.netG, 'G', which_epoch)
+        self.netG = self.optimize_network(self.netG, 'G')
 
         print('---------- Networks initialized -------------')
         networks.print_network(self.netG)
@@ -33,8 +34,9 @@ class TestModel(BaseModel):
         self.image_paths = input['A_paths']
 
     def test(self):
-        self.real_A = Variable(self.input_A)
-        self.fake_B = self.netG(self.real_A)
+        self.real_A = self.input_A
+        with torch.no_grad(), self.autocast():
+            self.fake_B = self.run_tiled(self.netG, self.real_A).float()
 
     # get image paths
     def get_image_paths(self):
@@ -29,7 +29,7 @@ class BaseOptions():
         self.parser.add_argument('--name', type=str, default='experiment_name', help='name of the experiment. It decides where to store samples and models')
         self.parser.add_argument('--dataset_mode', type=str, default='unaligned', help='chooses how datasets are loaded. [unaligned | aligned | single | v]')
         self.parser.add_argument('--model', type=str, default='cycle_gan',
-                                 help='chooses which model to use. cycle_gan, pix2pix, test')
+                                 help='chooses which model to use. cycle_gan, pix2pix, distill, test')
         self.parser.add_argument('--which_direction', type=str, default='AtoB', help='AtoB or BtoA')
         self.parser.add_argument('--nThreads', default=2, type=int, help='# threads for loading data')
         self.parser.add_argument('--checkpoints_dir', type=str, default='./checkpoints', help='models are saved here')
@@ -42,6 +42,20 @@ class BaseOptions():
         self.parser.add_argument('--max_dataset_size', type=int, default=float("inf"), help='Maximum number of samples allowed per dataset. If the dataset directory contains more than max_dataset_size, only a subset is loaded.')
         self.parser.add_argument('--resize_or_crop', type=str, default='resize_and_crop', help='scaling and cropping of images at load time [resize_and_crop|crop|scale_width|scale_width_and_crop]')
         self.parser.add_argument('--no_flip', action='store_true', help='if specified, do not flip the images for data augmentation')
+        self.parser.add_argument('--prune_spec', type=str, default='', help='channel spec json of pruned networks (written by --prune_ratio)')
+        ## add load data option
+        self.parser.add_argument('--load_video', type=int, default=0, help='load video = 1 | load image = 0')
+        self.parser.add_argument('--data_dir', type=str, default='/data/dataset/depthdata/vkitti_1.3.1_rgb/**/**/',
+                                 help='video or images data repository, example: virtualkitti dataset = /data/dataset/depthdata/vkitti_1.3.1_rgb/**/**/ | babayCrawlling dataset: /data/dataset/UCF/v_BabyCrawling**.avi')
+        self.parser.add_argument('--skip', type=int, default=1, help='skip how many frames to catch data')
+        self.parser.add_argument('--overlap', type=int, default=75, help='how many frames B will have as same as A')
+        self.parser.add_argument('--record_stream', type=str, default='', help='append every batch the data producers deliver to this stream log (see util/stream_log.py)')
+        self.parser.add_argument('--replay_stream', type=str, default='', help='read batches from this stream log instead of starting the data producers, wrapping around at its end')
+        self.parser.add_argument('--replay_start', type=int, default=0, help='index of the first replayed batch, e.g. a step to reproduce')
+        self.parser.add_argument('--seed', type=int, default=0, help='seed of the data producers and, at the start of training, of torch, numpy and random')
+        self.parser.add_argument('--checkpoint_format', type=str, default='pth', help='format of saved networks [pth | mmap]. mmap writes aligned, checksummed shards that load without unpickling (util/mmap_checkpoint.py); loading falls back to whichever format exists')
+        self.parser.add_argument('--checkpoint_fp16', action='store_true', help='with --checkpoint_format mmap, store float32 weights as float16')
+        self.parser.add_argument('--precision', type=str, default='fp32', help='arithmetic of the forward passes and losses [fp32 | fp16 | bf16]. fp16 uses dynamic loss scaling and needs a GPU, bf16 also runs on the CPU')
         self.parser.add_argument('--init_type', type=str, default='xavier', help='network initialization [normal|xavier|kaiming|orthogonal]')
 
 
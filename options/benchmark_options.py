@@ -0,0 +1,18 @@
+from .train_options import TrainOptions
+
+
+class BenchmarkOptions(TrainOptions):
+    def initialize(self):
+        TrainOptions.initialize(self)
+        self.parser.add_argument('--bench_steps', type=int, default=20, help='# of timed training steps')
+        self.parser.add_argument('--bench_warmup', type=int, default=3, help='# of untimed steps before measuring (cudnn autotuning, allocator warm up)')
+        self.parser.add_argument('--legacy_step', action='store_true', help='also measure the previous (allocating) pix2pix training step for comparison')
+        # benchmark.py sweeps: comma separated values, empty for the single value of the matching option
+        self.parser.add_argument('--sweep_netG', type=str, default='', help='which_model_netG values to sweep, e.g. unet_128,unet_128_2plus1d (3D generators only)')
+        self.parser.add_argument('--sweep_norm', type=str, default='', help='norm values to sweep, e.g. batch,instance')
+        self.parser.add_argument('--sweep_depth', type=str, default='', help='depth values to sweep, e.g. 8,16,32')
+        self.parser.add_argument('--sweep_fineSize', type=str, default='', help='fineSize values to sweep, e.g. 64,128')
+        self.parser.add_argument('--sweep_batchSize', type=str, default='', help='batchSize values to sweep, e.g. 1,2,4')
+        self.parser.add_argument('--bench_results', type=str, default='', help='write the results as json to this file, default [checkpoints_dir]/[name]/benchmark.json')
+        self.parser.add_argument('--compare', type=str, default='', help='baseline results json; configurations that got slower or use more memory than --tolerance allows are reported and the exit status is 1')
+        self.parser.add_argument('--tolerance', type=float, default=0.1, help='relative throughput drop / peak memory growth tolerated by --compare')
@@ -0,0 +1,15 @@
+from .train_options import TrainOptions
+
+
+class DataBenchmarkOptions(TrainOptions):
+    def initialize(self):
+        TrainOptions.initialize(self)
+        self.parser.add_argument('--synthetic_dir', type=str, default='', help='if set, generate synthetic png sequences (or avi videos with --load_video 1) here and benchmark them instead of --data_dir')
+        self.parser.add_argument('--synthetic_files', type=int, default=4, help='# of synthetic sequences/videos')
+        self.parser.add_argument('--synthetic_frames', type=int, default=200, help='frames per synthetic sequence/video')
+        self.parser.add_argument('--synthetic_width', type=int, default=1242, help='synthetic frame width (the png loader crops the centre 375 columns of 1242)')
+        self.parser.add_argument('--synthetic_height', type=int, default=375, help='synthetic frame height')
+        self.parser.add_argument('--bench_clips', type=int, default=16, help='# of clips timed per stage and per producer count')
+        self.parser.add_argument('--max_producers', type=int, default=8, help='end to end throughput is measured with 1, 2, 4, ... up to this many producer processes')
+        self.parser.add_argument('--bench_port', type=int, default=6550, help='first port of the benchmark producers')
+        self.parser.add_argument('--bench_results', type=str, default='', help='write the results as json to this file, default [checkpoints_dir]/[name]/data_benchmark.json')
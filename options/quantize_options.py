@@ -0,0 +1,11 @@
+from .test_options import TestOptions
+
+
+class QuantizeOptions(TestOptions):
+    def initialize(self):
+        TestOptions.initialize(self)
+        self.parser.add_argument('--quantize', type=str, default='static', help='int8 quantization mode [dynamic | static]')
+        self.parser.add_argument('--quant_backend', type=str, default='fbgemm', help='quantized engine [fbgemm | qnnpack]')
+        self.parser.add_argument('--calib_clips', type=int, default=16, help='# of training clips used to calibrate static quantization')
+        self.parser.add_argument('--eval_clips', type=int, default=4, help='# of training clips used to compare int8 with fp32 outputs')
+        self.parser.add_argument('--quant_label', type=str, default='', help='epoch label of the saved int8 generator, defaults to [which_epoch]_int8')
@@ -0,0 +1,17 @@
+from .test_options import TestOptions
+
+
+class ServeOptions(TestOptions):
+    def initialize(self):
+        TestOptions.initialize(self)
+        self.parser.add_argument('--port', type=int, default=5600, help='port the inference server binds to')
+        self.parser.add_argument('--max_batch', type=int, default=8, help='maximum number of clips run through netG in one batch')
+        self.parser.add_argument('--max_wait_ms', type=float, default=10, help='maximum time a request waits for its batch to fill up')
+        self.parser.add_argument('--latency_window', type=int, default=1000, help='number of recent requests used for latency percentiles')
+        self.parser.add_argument('--stats_freq', type=int, default=100, help='print server stats every stats_freq batches')
+        self.parser.add_argument('--eval_mode', action='store_true', help='run netG in eval mode; otherwise batch norm uses per-batch statistics and outputs depend on how requests are grouped')
+        self.parser.add_argument('--cache_items', type=int, default=256, help='results kept in the in-memory LRU cache, 0 disables it')
+        self.parser.add_argument('--cache_dir', type=str, default='', help='directory of the on-disk result cache, empty disables it')
+        self.parser.add_argument('--cache_disk_mb', type=float, default=1024, help='size budget of the on-disk result cache')
+        self.parser.add_argument('--watch_checkpoint', action='store_true', help='reload [which_epoch]_net_G.pth in the background when it changes and swap it in between batches')
+        self.parser.add_argument('--watch_interval', type=float, default=5.0, help='seconds between checkpoint change checks')
@@ -10,5 +10,11 @@ class TestOptions(BaseOptions):
         self.parser.add_argument('--phase', type=str, default='test', help='train, val, test, etc')
         self.parser.add_argument('--which_epoch', type=str, default='latest', help='which epoch to load? set to latest to use latest cached model')
         self.parser.add_argument('--how_many', type=int, default=50, help='how many test images to run')
+        self.parser.add_argument('--depth', type=int, default=75, help='3D Video frames length')
+        self.parser.add_argument('--tile_size', type=int, default=0, help='if > 0, frames larger than this are split into overlapping tiles of this size for netG (use fineSize)')
+        self.parser.add_argument('--tile_overlap', type=int, default=32, help='overlap in pixels between neighbouring tiles, feathered when blending')
+        self.parser.add_argument('--tile_batch', type=int, default=4, help='number of tiles run through netG at once; bounds peak memory')
+        self.parser.add_argument('--no_resize', action='store_true', help='feed whole frames at their native resolution instead of the 256x256 training crops; use with --tile_size for frames larger than fineSize')
+        self.parser.add_argument('--optimize_inference', action='store_true', help='fold batch norm into convolutions and strip dropout in netG (runs netG in eval mode)')
         #self.parser.add_argument('--identity', type=float, default=0.0, help='use identity mapping. Setting identity other than 1 has an effect of scaling the weight of the identity mapping loss. For example, if the weight of the identity loss should be 10 times smaller than the weight of the reconstruction loss, please set optidentity = 0.1')
         self.isTrain = False
@@ -7,9 +7,18 @@ class TrainOptions(BaseOptions):
         self.parser.add_argument('--display_freq', type=int, default=100, help='frequency of showing training results on screen')
         self.parser.add_argument('--display_single_pane_ncols', type=int, default=0, help='if positive, display all images in a single visdom web panel with certain number of images per row.')
         self.parser.add_argument('--update_html_freq', type=int, default=1000, help='frequency of saving training results to html')
+        self.parser.add_argument('--preview_queue', type=int, default=2, help='preview videos are rendered and encoded by a background thread; at most this many wait, further ones are dropped. 0 renders on the training thread')
         self.parser.add_argument('--print_freq', type=int, default=100, help='frequency of showing training results on console')
+        self.parser.add_argument('--profile', action='store_true', help='time the phases of each training step (data wait, set_input, G/D forward, backward and optimizer steps, preview, checkpoint); percentiles are printed every print_freq steps and every step is logged to [checkpoints_dir]/[name]/profile.jsonl')
+        self.parser.add_argument('--profile_window', type=int, default=100, help='number of recent steps the printed percentiles cover')
+        self.parser.add_argument('--profile_sync', action='store_true', help='synchronize the GPU at section boundaries, so asynchronous kernels are charged to the section that launched them (slows training)')
+        self.parser.add_argument('--profile_layers', type=int, default=0, help='hook the U-Net levels, resnet blocks and discriminator layers for this many steps, then print their time, activation size, FLOPs and memory and write [checkpoints_dir]/[name]/layer_profile.json. 0 to disable')
+        self.parser.add_argument('--trace_start', type=int, default=10, help='first step written to the Chrome trace')
+        self.parser.add_argument('--trace_steps', type=int, default=0, help='write steps [trace_start, trace_start + trace_steps) as a Chrome trace to [checkpoints_dir]/[name]/trace.json, 0 for no trace')
         self.parser.add_argument('--save_latest_freq', type=int, default=2000, help='frequency of saving the latest results')
         self.parser.add_argument('--save_epoch_freq', type=int, default=1, help='frequency of saving checkpoints at the end of epochs')
+        self.parser.add_argument('--keep_checkpoints', type=int, default=0, help='if > 0, keep only this many of the most recent step checkpoints; latest and end of epoch checkpoints are always kept')
+        self.parser.add_argument('--sync_save', action='store_true', help='wait for each checkpoint to be written before training continues')
         self.parser.add_argument('--continue_train', action='store_true', help='continue training: load the latest model')
         self.parser.add_argument('--epoch_count', type=int, default=1, help='the starting epoch count, we save the model by <epoch_count>, <epoch_count>+<save_latest_freq>, ...')
         self.parser.add_argument('--phase', type=str, default='train', help='train, val, test, etc')
@@ -22,17 +31,37 @@ class TrainOptions(BaseOptions):
         self.parser.add_argument('--lambda_A', type=float, default=10.0, help='weight for cycle loss (A -> B -> A)')
         self.parser.add_argument('--lambda_B', type=float, default=10.0, help='weight for cycle loss (B -> A -> B)')
         self.parser.add_argument('--pool_size', type=int, default=50, help='the size of image buffer that stores previously generated images')
+        self.parser.add_argument('--d_every', type=int, default=1, help='update the discriminator every d_every generator steps')
+        self.parser.add_argument('--d_skip_below', type=float, default=0, help='if > 0, skip discriminator updates while the running average of its loss is below this value')
+        self.parser.add_argument('--d_max_skip', type=int, default=10, help='with --d_skip_below, update the discriminator at least every d_max_skip steps (0 = no limit)')
+        self.parser.add_argument('--d_windows', type=int, default=0, help='if > 0, the discriminator scores this many random temporal sub-windows of each clip instead of the whole clip')
+        self.parser.add_argument('--d_window_len', type=int, default=16, help='frames per discriminator sub-window')
+        self.parser.add_argument('--d_crop', type=int, default=0, help='if > 0, also crop the sub-windows to random d_crop x d_crop patches; at least 24 for the basic netD (3 stride-2 layers), doubling per extra layer')
+        self.parser.add_argument('--use_pool', action='store_true', help='pix2pix: show netD a history of fake clips (--pool_size) instead of only the latest')
+        self.parser.add_argument('--pool_storage', type=str, default='device', help='where and how the image pool is kept [device | float16 | uint8], the last two on the CPU')
+        self.parser.add_argument('--pool_max_mb', type=float, default=0, help='if > 0, shrink the image pool to fit this many MB')
         self.parser.add_argument('--no_html', action='store_true', help='do not save intermediate training results to [opt.checkpoints_dir]/[opt.name]/web/')
         self.parser.add_argument('--lr_policy', type=str, default='lambda', help='learning rate policy: lambda|step|plateau')
         self.parser.add_argument('--lr_decay_iters', type=int, default=50, help='multiply by a gamma every lr_decay_iters iterations')
         self.parser.add_argument('--identity', type=float, default=0.5, help='use identity mapping. Setting identity other than 1 has an effect of scaling the weight of the identity mapping loss. For example, if the weight of the identity loss should be 10 times smaller than the weight of the reconstruction loss, please set optidentity = 0.1')
-        ## add load data option
-        self.parser.add_argument('--load_video', type=int, default=0, help='load video = 1 | load image = 0')
-        self.parser.add_argument('--data_dir', type=str, default='/data/dataset/depthdata/vkitti_1.3.1_rgb/**/**/',
-                                 help='video or images data repository, example: virtualkitti dataset = /data/dataset/depthdata/vkitti_1.3.1_rgb/**/**/ | babayCrawlling dataset: /data/dataset/UCF/v_BabyCrawling**.avi')
+        self.parser.add_argument('--batch_G_calls', action='store_true', help='cycle_gan: stack the inputs of each generator into one forward pass per stage (batch norm statistics stay per input)')
         self.parser.add_argument('--depth', type=int, default=75, help='3D Video frames length')
-        self.parser.add_argument('--skip', type=int, default=1, help='skip how many frames to catch data')
-        self.parser.add_argument('--overlap', type=int, default=75, help='how many frames B will have as same as A')
+        self.parser.add_argument('--auto_batch', action='store_true', help='set batchSize to the largest that fits the memory budget (see models/cost_model.py), confirmed by a probe step on the GPU')
+        self.parser.add_argument('--auto_depth', action='store_true', help='set depth to the largest that fits the memory budget, like --auto_batch; overlap is lowered to the chosen depth if it is larger (the producer ports follow the depth too)')
+        self.parser.add_argument('--mem_budget_mb', type=int, default=0, help='memory budget of --auto_batch/--auto_depth, 0 for the free memory of the first GPU')
+        self.parser.add_argument('--mem_margin', type=float, default=0.1, help='fraction of the budget the cost model leaves for the CUDA context, cudnn workspaces and fragmentation')
+        self.parser.add_argument('--estimate_only', action='store_true', help='print the estimated parameters, FLOPs and training/inference memory of the configuration and exit')
+        ## structured channel pruning, then fine-tuning
+        self.parser.add_argument('--prune_ratio', type=float, default=0, help='if > 0, prune this fraction of the conv output channels of G and D and fine-tune the result')
+        self.parser.add_argument('--prune_criterion', type=str, default='weight', help='channel importance used for pruning [weight | activation | taylor]; only taylor ranks channels of non-affine instance norm layers (--norm instance)')
+        self.parser.add_argument('--prune_at', type=int, default=0, help='prune once total_steps reaches this value')
+        ## knowledge distillation (--model distill)
+        self.parser.add_argument('--teacher_name', type=str, default='', help='experiment name of the frozen teacher generator')
+        self.parser.add_argument('--teacher_epoch', type=str, default='latest', help='which epoch of the teacher to load')
+        self.parser.add_argument('--teacher_netG', type=str, default='unet_256', help='teacher generator architecture')
+        self.parser.add_argument('--teacher_ngf', type=int, default=64, help='# of teacher gen filters in first conv layer')
+        self.parser.add_argument('--lambda_distill', type=float, default=10.0, help='weight for L1 between student and teacher outputs')
+        self.parser.add_argument('--lambda_feat', type=float, default=1.0, help='weight for intermediate U-Net feature matching')
 
 
 
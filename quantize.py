@@ -0,0 +1,84 @@
+import os
+import copy
+import glob
+import time
+import random
+
+import numpy as np
+import torch
+
+from options.quantize_options import QuantizeOptions
+from data.img_loder import data_gen, video_data_gen
+from models import networks, quantization
+from util import mmap_checkpoint
+
+# Post-training int8 quantization of a trained generator for the CPU render
+# farm. Calibrates on clips taken from the training data (same producers as
+# data/server.py), reports L1/PSNR against the fp32 outputs and the speedup,
+# then saves [which_epoch]_int8_net_G.pth, which load_network picks up
+# transparently via --which_epoch [which_epoch]_int8 --gpu_ids -1.
+
+
+def sample_clips(opt, n):
+    f_lst = glob.glob(opt.data_dir)
+    random.shuffle(f_lst)
+    clips = []
+    for path in f_lst:
+        if opt.load_video == 1:
+            _, gen = video_data_gen(path, opt)
+        else:
+            _, gen = data_gen(path, skip=opt.skip, length=opt.depth, pre=opt.depth)
+        for AB in gen:
+            A = AB[0 if opt.which_direction == 'AtoB' else 1]
+            clips.append(torch.from_numpy(A[np.newaxis].astype(np.float32) / 127.5 - 1.))
+            if len(clips) == n:
+                return clips
+    return clips
+
+
+def timed(net, input):
+    start = time.time()
+    with torch.no_grad():
+        output = net(input)
+    return output, time.time() - start
+
+
+def compare(fp32_net, int8_net, clips):
+    l1, psnr, t_fp32, t_int8 = [], [], 0., 0.
+    for input in clips:
+        expected, t = timed(fp32_net, input)
+        t_fp32 += t
+        output, t = timed(int8_net, input)
+        t_int8 += t
+        l1.append(float((output - expected).abs().mean()))
+        # PSNR on the 0..255 scale
+        mse = float(((output - expected) * 127.5).pow(2).mean())
+        psnr.append(10 * np.log10(255. ** 2 / max(mse, 1e-10)))
+    print('int8 vs fp32 on %d clips: L1 %.5f, PSNR %.2f dB' % (len(clips), np.mean(l1), np.mean(psnr)))
+    print('fp32 %.3f sec/clip, int8 %.3f sec/clip, speedup %.2fx' %
+          (t_fp32 / len(clips), t_int8 / len(clips), t_fp32 / max(t_int8, 1e-10)))
+
+
+if __name__ == '__main__':
+    opt = QuantizeOptions().parse()
+    netG = networks.define_G(opt.input_nc, opt.output_nc, opt.ngf, opt.which_model_netG,
+                             opt.norm, not opt.no_dropout, None, [])
+    save_dir = os.path.join(opt.checkpoints_dir, opt.name)
+    prefix = os.path.join(save_dir, '%s_net_G' % opt.which_epoch)
+    if mmap_checkpoint.exists(prefix) and not os.path.exists(prefix + '.pth'):
+        netG.load_state_dict(mmap_checkpoint.load(prefix))
+    else:
+        netG.load_state_dict(torch.load(prefix + '.pth', map_location='cpu'))
+    netG.eval()
+
+    clips = sample_clips(opt, opt.calib_clips + opt.eval_clips)
+    calibration, evaluation = clips[:opt.calib_clips], clips[opt.calib_clips:]
+    print('quantizing [%s] with %d calibration clips' % (opt.quantize, len(calibration)))
+    int8_net = quantization.quantize(copy.deepcopy(netG), opt.quantize, calibration, opt.quant_backend)
+    if evaluation:
+        compare(netG, int8_net, evaluation)
+
+    label = opt.quant_label or '%s_int8' % opt.which_epoch
+    save_path = os.path.join(save_dir, '%s_net_G.pth' % label)
+    torch.save(quantization.quantized_state(int8_net, opt.quantize, opt.quant_backend), save_path)
+    print('saved int8 generator to %s' % save_path)
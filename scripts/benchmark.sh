@@ -0,0 +1 @@
+python benchmark.py --name bench_pix2pix --model pix2pix --gpu_ids -1 --norm batch --sweep_netG unet_128,unet_128_2plus1d --sweep_depth 8,16 --fineSize 128 --batchSize 1 --bench_steps 5 --compare ./checkpoints/bench_pix2pix_baseline/benchmark.json
@@ -0,0 +1 @@
+python benchmark_data.py --name bench_data --synthetic_dir ./datasets/synthetic_png --synthetic_files 4 --synthetic_frames 200 --depth 16 --overlap 16 --batchSize 1 --max_producers 8 --gpu_ids -1
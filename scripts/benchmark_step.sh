@@ -0,0 +1 @@
+python benchmark_step.py --name bench_pix2pix --model pix2pix --which_model_netG unet_128 --fineSize 128 --depth 16 --batchSize 1 --norm batch --gpu_ids 0 --legacy_step
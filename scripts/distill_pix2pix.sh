@@ -0,0 +1 @@
+python train.py --dataroot ~/elsaW/video/ --dataset_mode v --model distill --name vkitti75-student --teacher_name vkitti75-zdx --teacher_netG unet_256 --teacher_ngf 64 --which_model_netG unet_256_2plus1d --ngf 32 --which_direction AtoB --norm batch --depth 75 --overlap 75 --batchSize 1
@@ -0,0 +1 @@
+python inference_client.py --address tcp://localhost:5600 --clients 8 --requests 20 --depth 16
@@ -0,0 +1 @@
+python inference_server.py --name facades_pix2pix --model pix2pix --which_model_netG unet_256 --dataset_mode v --norm batch --depth 16 --max_batch 8 --max_wait_ms 10
@@ -1,15 +1,33 @@
 import time , os ,cv2
+import sys
+import signal
+import random
+import torch
 from options.train_options import TrainOptions
 from data.data_loader import CreateDataLoader
 from models.models import create_model
+from models.networks import LayerProfiler
+from models import cost_model
 import ntpath
 import numpy as np
 import skvideo.io
 import time
+from util.preview import PreviewWriter
+from util.profiler import StepProfiler
 
 
 output_video = False
 opt = TrainOptions().parse()
+random.seed(opt.seed)
+np.random.seed(opt.seed)
+torch.manual_seed(opt.seed)
+# sized before the data loader, which reads clips of opt.depth frames
+if opt.auto_batch or opt.auto_depth:
+    cost_model.auto_size(opt)
+if opt.estimate_only or opt.auto_batch or opt.auto_depth:
+    cost_model.print_estimate(opt)
+    if opt.estimate_only:
+        sys.exit(0)
 data_loader = CreateDataLoader(opt)
 dataset = data_loader.load_data()
 print(dataset)
@@ -19,7 +37,38 @@ print('#training videos = %d' % dataset_size)
 model = create_model(opt)
 opt.results_dir = './results/'
 total_steps = 0
+start_epoch, start_index = opt.epoch_count, 0
+
+# --continue_train also restores the optimizers, schedulers, counters, RNG
+# and data stream position saved with the checkpoint, if there are any
+if opt.continue_train:
+    state = model.load_training_state(opt.which_epoch)
+    if state is not None:
+        start_epoch, start_index, total_steps = state['epoch'], state['index'], state['total_steps']
+        dataset.load_state_dict(state['data'])
+        print('resuming at epoch %d, iteration %d, total_steps %d' % (start_epoch, start_index, total_steps))
+
+def training_state(epoch, index):
+    return {'epoch': epoch, 'index': index, 'total_steps': total_steps, 'data': dataset.state_dict()}
+
+# on SIGTERM (preemption), stop after the current step with a resumable
+# 'latest' checkpoint
+stop_signal = []
+signal.signal(signal.SIGTERM, lambda signum, frame: stop_signal.append(signum))
 web_dir = os.path.join(opt.results_dir, opt.name, '%s_%s' % (opt.phase, opt.which_epoch))
+preview = PreviewWriter(opt.preview_queue) if opt.preview_queue > 0 else None
+
+# --profile: per-step timing breakdown, see util/profiler.py
+profile_dir = os.path.join(opt.checkpoints_dir, opt.name)
+profiler = StepProfiler(opt.profile, opt.profile_window, os.path.join(profile_dir, 'profile.jsonl'),
+                        os.path.join(profile_dir, 'trace.json') if opt.trace_steps > 0 else '',
+                        opt.trace_start, opt.trace_steps, opt.profile_sync)
+if opt.profile:
+    model.profiler = profiler
+# --profile_layers: per-layer costs over the first steps (the hooks
+# synchronize the GPU and are removed afterwards)
+layer_profiler = LayerProfiler(model.get_networks(), opt.profile_layers) if opt.profile_layers > 0 else None
+step = 0
 
 def ck_array(i,o):
     i_A = np.transpose(127.5*(i['A']+1.)[0],(1,2,3,0))
@@ -84,11 +133,21 @@ def save_videos(web_dir, visuals, vid_path, epoch):
 
 
 
-for epoch in range(opt.epoch_count, opt.niter + opt.niter_decay + 1):
+for epoch in range(start_epoch, opt.niter + opt.niter_decay + 1):
     epoch_start_time = time.time()
-    epoch_iter = 0
-
-    for i, data in enumerate(dataset):
+    first_index = start_index if epoch == start_epoch else 0
+    epoch_iter = first_index * opt.batchSize
+
+    # iterated by hand, so the wait for the next batch is part of the step
+    batches = enumerate(dataset.iterate(first_index), first_index)
+    while True:
+        profiler.begin_step(step)
+        with profiler.section('data'):
+            batch = next(batches, None)
+        if batch is None:
+            break
+        i, data = batch
+        step += 1
 
         #print(data.shape())
 
@@ -96,23 +155,43 @@ for epoch in range(opt.epoch_count, opt.niter + opt.niter_decay + 1):
         #visualizer.reset()
         total_steps += opt.batchSize
         epoch_iter += opt.batchSize
-        model.set_input(data)
+        with profiler.section('set_input'):
+            model.set_input(data)
+        if opt.prune_ratio > 0 and not opt.prune_spec and total_steps >= opt.prune_at:
+            model.prune(opt.prune_ratio, opt.prune_criterion)
         model.optimize_parameters()
+        if layer_profiler is not None and layer_profiler.step():
+            print(layer_profiler.table())
+            layer_profiler.save_json(os.path.join(profile_dir, 'layer_profile.json'))
+            layer_profiler.remove()
+            layer_profiler = None
 
         if total_steps % opt.display_freq == 0:
             save_result = total_steps % opt.update_html_freq == 0
 
-            visuals = model.get_current_visuals()
-            #ck_array(data, visuals)
             vid_path = model.get_image_paths()
-
-            # print(visuals)
-            print('process video... %s,progress %d' % (vid_path, i) )
-            save_videos(web_dir, visuals, vid_path, epoch)
+            with profiler.section('preview'):
+                visuals = model.get_current_visual_tensors() if preview is not None else None
+                if visuals is not None:
+                    # only the device to host copy happens here
+                    path = os.path.join(web_dir, 'videos', str(epoch), time.strftime('%Y%m%d-%H%M%S') + '_.mp4')
+                    if not preview.submit(path, visuals['real_A'], visuals['real_B'], visuals['fake_B']):
+                        print('preview dropped, %d so far' % preview.num_dropped)
+                else:
+                    visuals = model.get_current_visuals()
+                    #ck_array(data, visuals)
+
+                    # print(visuals)
+                    print('process video... %s,progress %d' % (vid_path, i) )
+                    save_videos(web_dir, visuals, vid_path, epoch)
 
         if total_steps % opt.print_freq == 0:
             errors = model.get_current_errors()
             t = (time.time() - iter_start_time) / opt.batchSize
+            print('(epoch: %d, iters: %d, time: %.3f) ' % (epoch, epoch_iter, t) +
+                  ' '.join('%s: %.3f' % (k, v) for k, v in errors.items()))
+            if opt.profile:
+                print(profiler.summary())
             #visualizer.print_current_errors(epoch, epoch_iter, errors, t)
             #if opt.display_id > 0:
                 #visualizer.plot_current_errors(epoch, float(epoch_iter)/dataset_size, opt, errors)
@@ -120,22 +199,38 @@ for epoch in range(opt.epoch_count, opt.niter + opt.niter_decay + 1):
         if total_steps % opt.save_latest_freq == 0:
             print('saving the latest model (epoch %d, total_steps %d)' %
                   (epoch, total_steps))
-            model.save('latest')
+            with profiler.section('checkpoint'):
+                model.checkpoint('latest', state=training_state(epoch, i + 1))
 
 
         if total_steps % 20010 == 0:
             print('saving the 20010 model (epoch %d, total_steps %d)' %
                   (epoch, total_steps))
-            model.save(total_steps)
+            with profiler.section('checkpoint'):
+                model.checkpoint(total_steps, state=training_state(epoch, i + 1))
+        profiler.end_step()
 
+        if stop_signal:
+            print('stopping on signal %d (epoch %d, total_steps %d)' % (stop_signal[0], epoch, total_steps))
+            model.checkpoint('latest', state=training_state(epoch, i + 1))
+            model.flush_checkpoints()
+            if preview is not None:
+                preview.flush()
+            sys.exit(0)
 
 
+    print('End of epoch %d / %d \t Time Taken: %d sec' %
+          (epoch, opt.niter + opt.niter_decay, time.time() - epoch_start_time))
+    model.update_learning_rate()
+
+    # saved after the learning rate update, so a resumed run starts the
+    # next epoch with the right schedule
     if epoch % opt.save_epoch_freq == 0:
         print('saving the model at the end of epoch %d, iters %d' %
               (epoch, total_steps))
-        model.save('latest')
-        model.save(epoch)
+        model.checkpoint('latest', state=training_state(epoch + 1, 0))
+        model.checkpoint(epoch, milestone=True, state=training_state(epoch + 1, 0))
 
-    print('End of epoch %d / %d \t Time Taken: %d sec' %
-          (epoch, opt.niter + opt.niter_decay, time.time() - epoch_start_time))
-    model.update_learning_rate()
+model.flush_checkpoints()
+if preview is not None:
+    preview.flush()
@@ -0,0 +1,115 @@
+import os
+import copy
+import time
+import threading
+
+import torch
+
+from .result_cache import weights_digest
+from . import mmap_checkpoint
+from models import quantization
+
+
+# Watches a checkpoint file for a long-running inference process. When the
+# file changes (and its size has been stable for one poll, so half-written
+# files are skipped) the new state dict is loaded, validated against the
+# live network and loaded into a private copy of it, all on this thread.
+# The serving loop calls poll() between batches and swaps the returned
+# network in, so requests never wait on deserialization.
+#
+# If the running network was transformed after loading (e.g. batch norm
+# folded by networks.optimize_for_inference), its parameters no longer match
+# the checkpoints: |template| is then the untransformed network on the meta
+# device, which checkpoints are validated against and loaded into, and
+# |prepare| applies the transformation to the loaded copy.
+class CheckpointWatcher(threading.Thread):
+    def __init__(self, net, path, interval=5.0, template=None, prepare=None):
+        super(CheckpointWatcher, self).__init__()
+        self.daemon = True
+        self.net = net
+        self.template = template
+        self.prepare = prepare
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.ready = None
+        self.last_seen = self.stat()
+        self.num_reloads = 0
+        self.num_rejected = 0
+
+    def stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def validate(self, state_dict):
+        expected = (self.template if self.template is not None else self.net).state_dict()
+        if set(state_dict.keys()) != set(expected.keys()):
+            return 'parameter names differ from the running network'
+        for name, tensor in state_dict.items():
+            if not torch.is_tensor(tensor):
+                # packed params of int8 layers
+                continue
+            if tensor.size() != expected[name].size():
+                return 'shape mismatch for %s: %s vs %s' % (name, tuple(tensor.size()), tuple(expected[name].size()))
+            if tensor.is_floating_point() and not torch.isfinite(tensor).all():
+                return 'non-finite values in %s' % name
+        return None
+
+    def load(self):
+        if self.path.endswith(mmap_checkpoint.INDEX_SUFFIX):
+            state_dict = mmap_checkpoint.load(self.path[:-len(mmap_checkpoint.INDEX_SUFFIX)])
+        else:
+            state_dict = torch.load(self.path, map_location='cpu')
+            if quantization.is_quantized_state(state_dict):
+                # quantize.py checkpoint; the running int8 network already
+                # has the quantized structure
+                state_dict = state_dict['state_dict']
+        error = self.validate(state_dict)
+        if error is not None:
+            print('checkpoint %s rejected: %s' % (self.path, error))
+            self.num_rejected += 1
+            return
+        if self.template is not None:
+            device = next(self.net.parameters()).device
+            candidate = copy.deepcopy(self.template).to_empty(device=device)
+            candidate.load_state_dict(state_dict)
+            candidate = self.prepare(candidate)
+        else:
+            candidate = copy.deepcopy(self.net)
+            candidate.load_state_dict(state_dict)
+        digest = weights_digest(candidate)
+        with self.lock:
+            self.ready = (candidate, digest)
+        self.num_reloads += 1
+        print('checkpoint %s loaded, ready to swap in' % self.path)
+
+    def run(self):
+        pending = None
+        while True:
+            time.sleep(self.interval)
+            current = self.stat()
+            if current is None or current == self.last_seen:
+                pending = None
+                continue
+            if current != pending:
+                # wait one more poll for the writer to finish
+                pending = current
+                continue
+            self.last_seen = current
+            pending = None
+            try:
+                self.load()
+            except Exception as e:
+                print('checkpoint %s could not be loaded: %s' % (self.path, e))
+                self.num_rejected += 1
+
+    # returns (net, weights digest) of a newly loaded checkpoint, or None
+    def poll(self):
+        with self.lock:
+            ready, self.ready = self.ready, None
+        if ready is not None:
+            self.net = ready[0]
+        return ready
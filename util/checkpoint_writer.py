@@ -0,0 +1,147 @@
+import os
+import json
+import queue
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def atomic_write(path, write):
+    tmp = '%s.tmp.%d' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+# Writes checkpoints off the training thread. submit() copies a state dict
+# (or any nest of dicts/lists of tensors, e.g. optimizer state) into host
+# buffers that are reused between saves (pinned for GPU tensors, so the copy
+# is a non-blocking DMA) and queues it; this thread then serializes it to a
+# temp file, fsyncs and renames it over the target, so a crash never leaves
+# a truncated checkpoint behind.
+#
+# Retention: after each save, commit(label, milestone) records the label in
+# [save_dir]/checkpoints.json. With keep > 0 only the |keep| most recent
+# non-milestone labels are kept on disk; milestones and 'latest' are never
+# deleted.
+class CheckpointWriter(threading.Thread):
+    MANIFEST = 'checkpoints.json'
+
+    def __init__(self, save_dir, keep=0):
+        super(CheckpointWriter, self).__init__()
+        self.daemon = True
+        self.save_dir = save_dir
+        self.keep = keep
+        self.jobs = queue.Queue()
+        self.buffers = {}
+        self.idle = {}
+        self.error = None
+        self.manifest = self.load_manifest()
+        self.start()
+
+    def load_manifest(self):
+        path = os.path.join(self.save_dir, self.MANIFEST)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return json.load(f)
+
+    def to_host(self, obj, buffers, key):
+        if torch.is_tensor(obj):
+            buf = buffers.get(key)
+            if buf is None or buf.size() != obj.size() or buf.dtype != obj.dtype:
+                buf = torch.empty(obj.size(), dtype=obj.dtype, pin_memory=obj.is_cuda)
+                buffers[key] = buf
+            buf.copy_(obj, non_blocking=True)
+            return buf
+        if isinstance(obj, dict):
+            host = OrderedDict((k, self.to_host(v, buffers, '%s/%s' % (key, k))) for k, v in obj.items())
+            if hasattr(obj, '_metadata'):
+                host._metadata = obj._metadata
+            return host
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self.to_host(v, buffers, '%s/%d' % (key, i)) for i, v in enumerate(obj))
+        return obj
+
+    # |save(state, path)| replaces the default atomic torch.save. |slot|
+    # names the host buffers the state is copied into (default: the
+    # filename); states submitted to the same slot reuse them, so callers
+    # saving under ever new filenames bound the pinned memory by their slots
+    def submit(self, filename, state, save=None, slot=None):
+        self.check()
+        slot = slot or filename
+        if slot not in self.idle:
+            self.idle[slot] = threading.Event()
+            self.idle[slot].set()
+        # the host buffers of this slot may still be being written
+        self.idle[slot].wait()
+        self.idle[slot].clear()
+        host = self.to_host(state, self.buffers.setdefault(slot, {}), '')
+        event = None
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            event = torch.cuda.Event()
+            event.record()
+        self.jobs.put(('write', filename, (host, save, slot), event))
+
+    def commit(self, label, milestone=False):
+        self.jobs.put(('commit', str(label), milestone, None))
+
+    # blocks until everything submitted so far is on disk
+    def flush(self):
+        self.jobs.join()
+        self.check()
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError('checkpoint writer failed: %s' % self.error)
+
+    def write(self, filename, payload, event):
+        host, save, slot = payload
+        if event is not None:
+            event.synchronize()
+        path = os.path.join(self.save_dir, filename)
+        if save is not None:
+            save(host, path)
+        else:
+            atomic_write(path, lambda f: torch.save(host, f))
+
+    def retain(self, label, milestone):
+        files = sorted(f for f in os.listdir(self.save_dir)
+                       if f.startswith(label + '_net_') or f == label + '_train_state.pth')
+        self.manifest = [entry for entry in self.manifest if entry['label'] != label]
+        self.manifest.append({'label': label, 'milestone': milestone, 'files': files})
+        if self.keep > 0:
+            recent = [entry for entry in self.manifest if not entry['milestone'] and entry['label'] != 'latest']
+            for entry in recent[:-self.keep]:
+                for filename in entry['files']:
+                    path = os.path.join(self.save_dir, filename)
+                    if os.path.exists(path):
+                        os.remove(path)
+                self.manifest.remove(entry)
+                print('removed checkpoint %s' % entry['label'])
+        manifest = json.dumps(self.manifest, indent=2).encode()
+        atomic_write(os.path.join(self.save_dir, self.MANIFEST), lambda f: f.write(manifest))
+
+    def run(self):
+        while True:
+            op, name, payload, event = self.jobs.get()
+            try:
+                if op == 'write':
+                    self.write(name, payload, event)
+                else:
+                    self.retain(name, payload)
+            except Exception as e:
+                print('checkpoint %s could not be written: %s' % (name, e))
+                self.error = e
+            finally:
+                if op == 'write':
+                    self.idle[payload[2]].set()
+                self.jobs.task_done()
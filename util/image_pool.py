@@ -1,33 +1,73 @@
-import random
-import numpy as np
 import torch
 from torch.autograd import Variable
 
+
+# History of generated images (or 5D clips) shown to the discriminator.
+# The pool is one preallocated tensor ring, so a query costs a few indexed
+# copies whatever the batch size. storage:
+#   device:  same dtype and device as the queried images
+#   float16: half precision on the CPU
+#   uint8:   quantized to 256 levels of [-1, 1] on the CPU, a quarter of the
+#            float32 size; a 75 frame 256x256 clip costs ~4.7MB per
+#            channel, so ~28MB for pix2pix's 6 channel fake_AB
+# With max_mb > 0 the pool holds at most as many items as fit in max_mb.
 class ImagePool():
-    def __init__(self, pool_size):
+    def __init__(self, pool_size, storage='device', max_mb=0):
+        if storage not in ('device', 'float16', 'uint8'):
+            raise NotImplementedError('pool storage [%s] is not implemented' % storage)
         self.pool_size = pool_size
+        self.storage = storage
+        self.max_bytes = max_mb * 2 ** 20
+        self.num_imgs = 0
+        self.images = None
+
+    def allocate(self, images):
+        shape = tuple(images.size()[1:])
+        if self.storage == 'device':
+            dtype, device = images.dtype, images.device
+        else:
+            dtype, device = (torch.float16 if self.storage == 'float16' else torch.uint8), torch.device('cpu')
+        item_bytes = torch.Size(shape).numel() * torch.tensor([], dtype=dtype).element_size()
+        if self.max_bytes > 0 and self.pool_size * item_bytes > self.max_bytes:
+            self.pool_size = int(self.max_bytes // item_bytes)
+            print('image pool limited to %d items of %.1fMB by the byte budget' % (self.pool_size, item_bytes / 2. ** 20))
         if self.pool_size > 0:
-            self.num_imgs = 0
-            self.images = []
+            self.images = torch.empty((self.pool_size,) + shape, dtype=dtype, device=device)
+
+    def encode(self, images):
+        if self.storage == 'uint8':
+            return images.detach().add(1).mul_(127.5).round_().clamp_(0, 255).to('cpu', torch.uint8)
+        return images.detach().to(self.images.device, self.images.dtype)
+
+    def decode(self, stored, like):
+        images = stored.to(like.device, non_blocking=True)
+        if self.storage == 'uint8':
+            return images.to(like.dtype).div_(127.5).sub_(1)
+        return images.to(like.dtype)
 
     def query(self, images):
+        if self.pool_size > 0 and self.images is None:
+            self.allocate(images)
         if self.pool_size == 0:
             return Variable(images)
-        return_images = []
-        for image in images:
-            image = torch.unsqueeze(image, 0)
-            if self.num_imgs < self.pool_size:
-                self.num_imgs = self.num_imgs + 1
-                self.images.append(image)
-                return_images.append(image)
-            else:
-                p = random.uniform(0, 1)
-                if p > 0.5:
-                    random_id = random.randint(0, self.pool_size-1)
-                    tmp = self.images[random_id].clone()
-                    self.images[random_id] = image
-                    return_images.append(tmp)
-                else:
-                    return_images.append(image)
-        return_images = Variable(torch.cat(return_images, 0))
-        return return_images
+
+        # the first images fill the pool and are returned as they are
+        num_fill = min(images.size(0), self.pool_size - self.num_imgs)
+        if num_fill > 0:
+            self.images[self.num_imgs:self.num_imgs + num_fill] = self.encode(images[:num_fill])
+            self.num_imgs += num_fill
+        num_rest = images.size(0) - num_fill
+        if num_rest == 0:
+            return Variable(images)
+
+        # then each image is, with probability 0.5, swapped with a random
+        # pooled one (distinct slots within a query)
+        positions = (torch.rand(num_rest) > 0.5).nonzero().view(-1)[:self.pool_size] + num_fill
+        if positions.numel() == 0:
+            return Variable(images)
+        slots = torch.randperm(self.pool_size)[:positions.numel()].to(self.images.device)
+        positions = positions.to(images.device)
+        return_images = images.clone()
+        return_images.index_copy_(0, positions, self.decode(self.images.index_select(0, slots), images))
+        self.images[slots] = self.encode(images.index_select(0, positions))
+        return Variable(return_images)
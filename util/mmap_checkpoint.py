@@ -0,0 +1,103 @@
+import os
+import json
+import zlib
+import time
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from .checkpoint_writer import atomic_write
+
+# Memory-mappable checkpoint format. A state dict saved to [prefix] becomes
+#
+#   [prefix].mmap.json          index: per tensor shard, offset, byte size,
+#                               dtype, stored dtype, shape and crc32
+#   [prefix].[gen].[i].bin      shards of at most shard_mb, each tensor's raw
+#                               bytes starting at an ALIGN byte boundary
+#
+# Loading maps the shards and views every tensor in place, so there is no
+# unpickling and pages are only read when the weights are copied into the
+# network. Shards carry a generation tag and the index is replaced last, so
+# overwriting a checkpoint (e.g. 'latest') is atomic. With fp16, float32
+# tensors are stored as float16 and converted back on load.
+
+ALIGN = 4096
+INDEX_SUFFIX = '.mmap.json'
+
+
+def index_path(prefix):
+    return prefix + INDEX_SUFFIX
+
+
+def exists(prefix):
+    return os.path.exists(index_path(prefix))
+
+
+def _raw_bytes(tensor):
+    return tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy()
+
+
+def save(state_dict, prefix, fp16=False, shard_mb=256):
+    directory, base = os.path.split(os.path.abspath(prefix))
+    generation = '%x' % int(time.time() * 1e6)
+    shard_bytes = int(shard_mb * 2 ** 20)
+    entries = OrderedDict()
+    shards = [[]]
+    offset = 0
+    for name, tensor in state_dict.items():
+        stored = tensor
+        if fp16 and tensor.dtype == torch.float32:
+            stored = tensor.half()
+        raw = _raw_bytes(stored)
+        if offset > 0 and offset + raw.nbytes > shard_bytes:
+            shards.append([])
+            offset = 0
+        entries[name] = {'shard': len(shards) - 1, 'offset': offset, 'nbytes': int(raw.nbytes),
+                         'dtype': str(tensor.dtype).replace('torch.', ''),
+                         'stored_dtype': str(stored.dtype).replace('torch.', ''),
+                         'shape': list(tensor.size()), 'crc32': zlib.crc32(raw)}
+        shards[-1].append((offset, raw))
+        offset += (raw.nbytes + ALIGN - 1) // ALIGN * ALIGN
+
+    shard_files = []
+    for i, chunks in enumerate(shards):
+        shard_files.append('%s.%s.%d.bin' % (base, generation, i))
+
+        def write(f, chunks=chunks):
+            for offset, raw in chunks:
+                f.seek(offset)
+                f.write(raw.tobytes())
+        atomic_write(os.path.join(directory, shard_files[-1]), write)
+
+    old = read_index(prefix) if exists(prefix) else None
+    index = json.dumps({'version': 1, 'align': ALIGN, 'shards': shard_files, 'tensors': entries}, indent=1).encode()
+    atomic_write(index_path(prefix), lambda f: f.write(index))
+    if old is not None:
+        for shard in old['shards']:
+            if shard not in shard_files and os.path.exists(os.path.join(directory, shard)):
+                os.remove(os.path.join(directory, shard))
+
+
+def read_index(prefix):
+    with open(index_path(prefix)) as f:
+        return json.load(f)
+
+
+# state dict of CPU tensors backed by the mapped shards (copy on write, so
+# they can be modified without touching the files)
+def load(prefix, verify=True):
+    directory = os.path.dirname(os.path.abspath(prefix))
+    index = read_index(prefix)
+    shards = [np.memmap(os.path.join(directory, shard), dtype=np.uint8, mode='c') for shard in index['shards']]
+    state_dict = OrderedDict()
+    for name, entry in index['tensors'].items():
+        raw = shards[entry['shard']][entry['offset']:entry['offset'] + entry['nbytes']]
+        if verify and zlib.crc32(raw) != entry['crc32']:
+            raise IOError('checksum mismatch for %s in %s' % (name, index_path(prefix)))
+        tensor = torch.from_numpy(raw).view(getattr(torch, entry['stored_dtype'])).reshape(entry['shape'])
+        if entry['stored_dtype'] != entry['dtype']:
+            tensor = tensor.to(getattr(torch, entry['dtype']))
+        state_dict[name] = tensor
+    return state_dict
+
@@ -0,0 +1,73 @@
+import os
+import queue
+import threading
+
+import numpy as np
+import skvideo.io
+
+
+# Renders and encodes training preview videos off the training thread.
+# submit() takes uint8 (T, H, W, C) clips already copied to the host and
+# returns immediately; if |max_pending| previews are still waiting, the new
+# one is dropped rather than stalling training. The worker composites into
+# a canvas that is reused between previews, in the layout of train.save_videos:
+#
+#   frames 0..T-1:   A[t]     | B[0]        frames T..2T-1:  A[T-1] | B[t]
+#                    (blank)  | fake[0]                      (blank)| fake[t]
+class PreviewWriter(threading.Thread):
+    def __init__(self, max_pending=2, fps=12):
+        super(PreviewWriter, self).__init__()
+        self.daemon = True
+        self.fps = fps
+        self.jobs = queue.Queue(maxsize=max_pending)
+        self.canvas = None
+        self.num_written = 0
+        self.num_dropped = 0
+        self.start()
+
+    def submit(self, path, real_A, real_B, fake_B):
+        try:
+            self.jobs.put_nowait((path, real_A, real_B, fake_B))
+            return True
+        except queue.Full:
+            self.num_dropped += 1
+            return False
+
+    def composite(self, A, B, fake):
+        T, H, W, C = A.shape
+        if self.canvas is None or self.canvas.shape != (2 * T, 2 * H, 2 * W, C):
+            self.canvas = np.empty((2 * T, 2 * H, 2 * W, C), dtype=np.uint8)
+            # the blank quadrant never changes
+            self.canvas[:, H:, :W] = 1
+        first, second = self.canvas[:T], self.canvas[T:]
+        first[:, :H, :W] = A
+        first[:, :H, W:] = B[0]
+        first[:, H:, W:] = fake[0]
+        second[:, :H, :W] = A[-1]
+        second[:, :H, W:] = B
+        second[:, H:, W:] = fake
+        return self.canvas
+
+    def write(self, path, A, B, fake):
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        skvideo.io.vwrite(path, self.composite(A, B, fake),
+                          inputdict={'-r': str(self.fps)},
+                          outputdict={'-r': str(self.fps)})
+        self.num_written += 1
+        print('save video at ', path)
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                self.write(*job)
+            except Exception as e:
+                print('preview %s could not be written: %s' % (job[0], e))
+            finally:
+                self.jobs.task_done()
+
+    # waits for the queued previews
+    def flush(self):
+        self.jobs.join()
@@ -0,0 +1,103 @@
+import json
+import time
+import contextlib
+from collections import OrderedDict, deque
+
+import numpy as np
+import torch
+
+
+# Wall-clock breakdown of training steps. Code on the hot path is wrapped in
+# section(name); each step's section times are
+#   - kept for the last |window| steps, for the percentiles of summary()
+#   - appended to |log_path| as one JSON line per step, if set
+#   - for steps [trace_start, trace_start + trace_steps), recorded as
+#     Chrome trace events and written to |trace_path| (chrome://tracing or
+#     ui.perfetto.dev) once the window is over
+# CUDA work is asynchronous, so with sync the device is synchronized at each
+# section boundary: slower, but the time lands in the section that queued it.
+class StepProfiler():
+    def __init__(self, enabled=False, window=100, log_path='', trace_path='', trace_start=0, trace_steps=0,
+                 sync=False):
+        self.enabled = enabled
+        self.sync = sync and torch.cuda.is_available()
+        self.history = OrderedDict()
+        self.window = window
+        self.log = open(log_path, 'a') if enabled and log_path else None
+        self.trace_path = trace_path
+        self.trace_start = trace_start
+        self.trace_end = trace_start + trace_steps
+        self.trace_events = []
+        self.step = None
+        self.times = None
+        self.origin = time.perf_counter()
+
+    def tracing(self):
+        return self.trace_path and self.trace_start <= self.step < self.trace_end
+
+    def begin_step(self, step):
+        if not self.enabled:
+            return
+        self.step = step
+        self.times = OrderedDict()
+        self.step_start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def section(self, name):
+        if not self.enabled or self.times is None:
+            yield
+            return
+        if self.sync:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.sync:
+                torch.cuda.synchronize()
+            end = time.perf_counter()
+            self.times[name] = self.times.get(name, 0.) + end - start
+            if self.tracing():
+                self.trace_events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': 0, 'args': {'step': self.step},
+                                          'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6})
+
+    def end_step(self):
+        if not self.enabled or self.times is None:
+            return
+        self.times['step'] = time.perf_counter() - self.step_start
+        for name, seconds in self.times.items():
+            if name not in self.history:
+                self.history[name] = deque(maxlen=self.window)
+            self.history[name].append(seconds)
+        if self.log is not None:
+            record = OrderedDict([('step', self.step)])
+            record.update((name, round(seconds * 1e3, 3)) for name, seconds in self.times.items())
+            self.log.write(json.dumps(record) + '\n')
+            self.log.flush()
+        if self.tracing() and self.step + 1 >= self.trace_end:
+            self.write_trace()
+        self.times = None
+
+    def write_trace(self):
+        with open(self.trace_path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events, 'displayTimeUnit': 'ms'}, f)
+        print('wrote trace of steps %d-%d to %s' % (self.trace_start, self.trace_end - 1, self.trace_path))
+        self.trace_events = []
+
+    # p50/p90/p99 milliseconds of each section over the window
+    def percentiles(self):
+        stats = OrderedDict()
+        for name, values in self.history.items():
+            p50, p90, p99 = np.percentile(list(values), [50, 90, 99]) * 1e3
+            stats[name] = (p50, p90, p99)
+        return stats
+
+    def summary(self):
+        if not self.history:
+            return ''
+        stats = self.percentiles()
+        step_p50 = max(stats['step'][0], 1e-9)
+        lines = ['%-12s %9s %9s %9s %7s' % ('section (ms)', 'p50', 'p90', 'p99', 'share')]
+        for name, (p50, p90, p99) in stats.items():
+            lines.append('%-12s %9.2f %9.2f %9.2f %6.1f%%' % (name, p50, p90, p99, 100. * p50 / step_p50))
+        return '\n'.join(lines)
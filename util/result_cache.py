@@ -0,0 +1,133 @@
+import os
+import glob
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+
+def _hash_tensor(h, tensor):
+    tensor = tensor.detach().cpu()
+    if tensor.is_quantized:
+        # int8 values plus the quantization parameters
+        if tensor.qscheme() in (torch.per_tensor_affine, torch.per_tensor_symmetric):
+            h.update(('%r %r' % (tensor.q_scale(), tensor.q_zero_point())).encode())
+        else:
+            h.update(tensor.q_per_channel_scales().numpy().tobytes())
+            h.update(tensor.q_per_channel_zero_points().numpy().tobytes())
+        tensor = tensor.int_repr()
+    h.update(tensor.numpy().tobytes())
+
+
+# Digest of every tensor in |net|'s state dict; together with which_epoch it
+# identifies the checkpoint a cached result was produced by. Works on int8
+# networks (quantize.py) too: packed params, stored as (weight, bias)
+# tuples, are hashed by their tensors and other non-tensor entries skipped.
+def weights_digest(net):
+    h = hashlib.sha1()
+    for name, value in net.state_dict().items():
+        tensors = [v for v in value if torch.is_tensor(v)] if isinstance(value, (tuple, list)) else [value]
+        tensors = [t for t in tensors if torch.is_tensor(t)]
+        if not tensors:
+            continue
+        h.update(name.encode())
+        for tensor in tensors:
+            _hash_tensor(h, tensor)
+    return h.hexdigest()
+
+
+# Content-addressed cache of netG outputs. Keys hash the input clip bytes
+# (with dtype and shape) and the model identity (checkpoint and inference
+# settings, see InferenceServer.make_model_id), so a new checkpoint or a
+# disk cache reused with other settings never serves stale results. Lookups go to an in-memory LRU of |max_items|
+# entries first, then to .npy files under |cache_dir| kept within
+# |max_disk_mb| by evicting the least recently used files.
+class ResultCache():
+    def __init__(self, max_items=256, cache_dir='', max_disk_mb=1024):
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+        self.memory = OrderedDict()
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+        self.counters = OrderedDict([('memory_hits', 0), ('disk_hits', 0), ('misses', 0),
+                                     ('memory_evictions', 0), ('disk_evictions', 0)])
+        if self.cache_dir:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # rebuild the disk index, oldest access first
+            paths = sorted(glob.glob(os.path.join(self.cache_dir, '*.npy')), key=os.path.getmtime)
+            for path in paths:
+                key = os.path.basename(path)[:-len('.npy')]
+                self.disk[key] = os.path.getsize(path)
+                self.disk_bytes += self.disk[key]
+            self.evict_disk()
+
+    def key(self, clip, model_id):
+        h = hashlib.sha1()
+        h.update(model_id.encode())
+        h.update(('%s%s' % (clip.dtype, clip.shape)).encode())
+        h.update(np.ascontiguousarray(clip).tobytes())
+        return h.hexdigest()
+
+    def disk_path(self, key):
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.counters['memory_hits'] += 1
+            return self.memory[key]
+        if key in self.disk:
+            path = self.disk_path(key)
+            try:
+                value = np.load(path)
+            except (IOError, ValueError):
+                self.disk_bytes -= self.disk.pop(key)
+            else:
+                os.utime(path, None)
+                self.disk.move_to_end(key)
+                self.counters['disk_hits'] += 1
+                self.put_memory(key, value)
+                return value
+        self.counters['misses'] += 1
+        return None
+
+    def put(self, key, value):
+        self.put_memory(key, value)
+        if self.cache_dir and key not in self.disk:
+            path = self.disk_path(key)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, value)
+            os.replace(tmp_path, path)
+            self.disk[key] = os.path.getsize(path)
+            self.disk_bytes += self.disk[key]
+            self.evict_disk()
+
+    def put_memory(self, key, value):
+        if self.max_items <= 0:
+            return
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+            self.counters['memory_evictions'] += 1
+
+    def evict_disk(self):
+        while self.disk and self.disk_bytes > self.max_disk_bytes:
+            key, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            if os.path.exists(self.disk_path(key)):
+                os.remove(self.disk_path(key))
+            self.counters['disk_evictions'] += 1
+
+    def stats(self):
+        stats = OrderedDict(self.counters)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = float(lookups - stats['misses']) / lookups if lookups else 0.
+        stats['memory_items'] = len(self.memory)
+        stats['disk_items'] = len(self.disk)
+        stats['disk_mb'] = self.disk_bytes / (1024. * 1024.)
+        return stats
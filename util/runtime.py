@@ -0,0 +1,57 @@
+import os
+import json
+
+import numpy as np
+
+# Minimal CPU runner for generators exported by export.py. It only needs
+# numpy plus either torch (TorchScript .pt) or onnxruntime (.onnx); options,
+# models and the training stack are never imported.
+
+
+class GeneratorRuntime():
+    def __init__(self, path, num_threads=0):
+        self.path = path
+        meta_path = os.path.splitext(path)[0] + '.json'
+        self.meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+
+        if path.endswith('.onnx'):
+            import onnxruntime
+            so = onnxruntime.SessionOptions()
+            if num_threads > 0:
+                so.intra_op_num_threads = num_threads
+            self.session = onnxruntime.InferenceSession(path, so, providers=['CPUExecutionProvider'])
+            self.input_name = self.session.get_inputs()[0].name
+            self.module = None
+        else:
+            import torch
+            if num_threads > 0:
+                torch.set_num_threads(num_threads)
+            self.module = torch.jit.load(path, map_location='cpu')
+            self.module.eval()
+            self.session = None
+
+    def check_input(self, input):
+        if self.meta.get('input_nc') is not None and input.shape[1] != self.meta['input_nc']:
+            raise ValueError('expected %d input channels, got %d' % (self.meta['input_nc'], input.shape[1]))
+        if self.meta.get('depth') and not self.meta.get('dynamic_depth') and input.ndim == 5 \
+                and input.shape[2] != self.meta['depth']:
+            raise ValueError('artifact was exported for depth %d, got %d' % (self.meta['depth'], input.shape[2]))
+
+    # |input|: float32 array in [-1, 1], (N, C, D, H, W) or (N, C, H, W)
+    def __call__(self, input):
+        input = np.ascontiguousarray(input, dtype=np.float32)
+        self.check_input(input)
+        if self.session is not None:
+            return self.session.run(None, {self.input_name: input})[0]
+        import torch
+        with torch.no_grad():
+            return self.module(torch.from_numpy(input)).numpy()
+
+    # |clip|: uint8 array without the batch dim, e.g. (C, D, H, W)
+    def run_uint8(self, clip):
+        input = clip[np.newaxis].astype(np.float32) / 127.5 - 1.
+        output = self(input)[0]
+        return np.clip((output + 1.) * 127.5, 0, 255).astype(np.uint8)
@@ -0,0 +1,69 @@
+import os
+import json
+
+import numpy as np
+
+# Append-only log of the batches the training data stream delivers, for
+# replaying it without the decode cost. A log at [path] is
+#
+#   [path]          the raw bytes of each batch (uint8 clips), back to back
+#   [path].index    one json line per batch: offset, shape, dtype and the
+#                   source path the producer sent with it
+#
+# The index line is written after its data, so an interrupted recording
+# never indexes a partial batch, and recording into an existing log
+# continues it. Replay maps the data file and returns views of it.
+
+INDEX_SUFFIX = '.index'
+
+
+def read_index(path):
+    with open(path + INDEX_SUFFIX) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class StreamRecorder():
+    def __init__(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.data = open(path, 'ab')
+        self.index = open(path + INDEX_SUFFIX, 'a')
+        self.num_batches = len(read_index(path)) if os.path.getsize(path + INDEX_SUFFIX) > 0 else 0
+        if self.num_batches > 0:
+            print('appending to the stream log %s after %d batches' % (path, self.num_batches))
+
+    def append(self, filename, batch):
+        batch = np.ascontiguousarray(batch)
+        offset = self.data.tell()
+        self.data.write(batch.data)
+        self.data.flush()
+        self.index.write(json.dumps({'offset': offset, 'shape': list(batch.shape), 'dtype': str(batch.dtype),
+                                     'filename': filename}) + '\n')
+        self.index.flush()
+        self.num_batches += 1
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+
+class StreamReplay():
+    def __init__(self, path):
+        self.entries = read_index(path)
+        if not self.entries:
+            raise ValueError('stream log %s has no batches' % path)
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        print('replaying %d batches from %s' % (len(self.entries), path))
+
+    def __len__(self):
+        return len(self.entries)
+
+    # (filename, batch) of the |i|th recorded batch; the batch is a read
+    # only view of the mapped log
+    def get(self, i):
+        entry = self.entries[i]
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape']))
+        raw = self.data[entry['offset']:entry['offset'] + count * dtype.itemsize]
+        return entry['filename'], raw.view(dtype).reshape(entry['shape'])